@@ -5,18 +5,30 @@
 
 
 # stdlib
-from fnmatch import fnmatch
+from array import array
+from fnmatch import translate
 from os import stat
-from os.path import abspath, exists, join
+from os.path import abspath, exists, join, normcase
+import re
 import time
 
 # 3p
-from scandir import walk
+from scandir import scandir
 
 # project
 from checks import AgentCheck
 from config import _is_affirmative
 
+# Same defaults as the agent's aggregator, used for histograms aggregated by the check
+DEFAULT_HISTOGRAM_AGGREGATES = ['max', 'median', 'avg', 'count']
+DEFAULT_HISTOGRAM_PERCENTILES = [0.95]
+
+# Listings of directories modified less than this many seconds ago aren't cached,
+# a change made within the resolution of the directory mtime would go unnoticed
+DIR_CACHE_MIN_AGE = 1
+
+NAN = float('nan')
+
 
 class DirectoryCheck(AgentCheck):
     """This check is for monitoring and reporting metrics on the files for a provided directory
@@ -31,10 +43,24 @@ class DirectoryCheck(AgentCheck):
         "filegauges" - boolean, when true stats will be an individual gauge per file (max. 20 files!) and not a histogram of the whole directory. default False
         "pattern" - string, the `fnmatch` pattern to use when reading the "directory"'s files. default "*"
         "recursive" - boolean, when true the stats will recurse into directories. default False
+        "dir_cache" - boolean, when true directories that were not modified since the previous run are not listed again. default False
+        "local_histograms" - boolean, when true file histograms are aggregated by the check and submitted as gauges. default False
     """
 
     SOURCE_TYPE_NAME = 'system'
 
+    def __init__(self, name, init_config, agentConfig, instances=None):
+        AgentCheck.__init__(self, name, init_config, agentConfig, instances)
+
+        # Compiled `pattern` matchers
+        self._matchers = {}
+
+        # Directory listings of the previous run, indexed by instance
+        self._dir_caches = {}
+
+        self.histogram_aggregates = agentConfig.get('histogram_aggregates') or DEFAULT_HISTOGRAM_AGGREGATES
+        self.histogram_percentiles = agentConfig.get('histogram_percentiles') or DEFAULT_HISTOGRAM_PERCENTILES
+
     def check(self, instance):
         if "directory" not in instance:
             raise Exception('DirectoryCheck: missing "directory" in config')
@@ -48,56 +74,198 @@ class DirectoryCheck(AgentCheck):
         filetagname = instance.get("filetagname", "filename")
         filegauges = _is_affirmative(instance.get("filegauges", False))
         countonly = _is_affirmative(instance.get("countonly", False))
+        dir_cache = _is_affirmative(instance.get("dir_cache", False))
+        local_histograms = _is_affirmative(instance.get("local_histograms", False))
 
         if not exists(abs_directory):
             raise Exception("DirectoryCheck: the directory (%s) does not exist" % abs_directory)
 
-        self._get_stats(abs_directory, name, dirtagname, filetagname, filegauges, pattern, recursive, countonly)
+        cache_key = None
+        if dir_cache:
+            cache_key = (abs_directory, pattern, recursive, filegauges, countonly)
+
+        self._get_stats(abs_directory, name, dirtagname, filetagname, filegauges, pattern, recursive, countonly,
+                        cache_key=cache_key, local_histograms=local_histograms)
+
+    def _get_matcher(self, pattern):
+        """Compile the `fnmatch` pattern once, returns None if it matches everything."""
+        if pattern not in self._matchers:
+            if pattern == "*":
+                self._matchers[pattern] = None
+            else:
+                self._matchers[pattern] = re.compile(translate(normcase(pattern))).match
+        return self._matchers[pattern]
+
+    def _list_directory(self, path, match, filegauges, countonly):
+        """
+        List the matching files and the sub-directories of a directory.
+
+        Returns (files count, file names, file stats, sub-directories). File names
+        are only kept for `filegauges`, file stats are (size, mtime, ctime) triplets
+        flattened in an array, NaN when the file couldn't be stat'ed.
+        """
+        count = 0
+        names = [] if filegauges else None
+        stats = array('d') if not countonly else None
+        subdirs = []
+
+        for entry in scandir(path):
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                # like os.walk, don't follow symlinks to directories
+                if not entry.is_symlink():
+                    subdirs.append(entry.path)
+                continue
+
+            # check if it passes our filter
+            if match is not None and not match(normcase(entry.path)):
+                continue
+
+            count += 1
+            if names is not None:
+                names.append(entry.name)
+
+            # We're just looking to count the files, don't stat it as well
+            if countonly:
+                continue
+
+            try:
+                file_stat = entry.stat()
+            except OSError as ose:
+                self.warning("DirectoryCheck: could not stat file %s - %s" % (entry.path, ose))
+                stats.extend((NAN, NAN, NAN))
+            else:
+                stats.extend((file_stat.st_size, file_stat.st_mtime, file_stat.st_ctime))
+
+        return count, names, stats, subdirs
+
+    def _walk(self, directory, match, recursive, filegauges, countonly, cache_key=None):
+        """
+        Yield the listing of `directory` and, if `recursive`, of all its sub-directories
+        in the same order as `os.walk`, as (directory, listing) tuples.
+
+        With a `cache_key`, the listings of directories whose mtime didn't change
+        since the previous run are re-used instead of listing them again.
+        """
+        cache = self._dir_caches.get(cache_key, {}) if cache_key is not None else None
+        new_cache = {}
+        now = time.time()
+
+        to_list = [directory]
+        while to_list:
+            path = to_list.pop()
+            listing = None
+
+            if cache is not None:
+                try:
+                    dir_mtime = stat(path).st_mtime
+                except OSError:
+                    continue
+                cached = cache.get(path)
+                if cached is not None and cached[0] == dir_mtime:
+                    listing = cached[1]
+
+            if listing is None:
+                try:
+                    listing = self._list_directory(path, match, filegauges, countonly)
+                except OSError as ose:
+                    self.log.debug("DirectoryCheck: could not list directory %s - %s", path, ose)
+                    continue
+
+            if cache is not None and now - dir_mtime >= DIR_CACHE_MIN_AGE:
+                new_cache[path] = (dir_mtime, listing)
+
+            yield path, listing
+
+            # if we do not want to do this recursively and just want
+            # the top level directory we gave it, then stop
+            if recursive:
+                to_list.extend(reversed(listing[3]))
+
+        if cache is not None:
+            self._dir_caches[cache_key] = new_cache
 
-    def _get_stats(self, directory, name, dirtagname, filetagname, filegauges, pattern, recursive, countonly):
+    def _get_stats(self, directory, name, dirtagname, filetagname, filegauges, pattern, recursive, countonly,
+                   cache_key=None, local_histograms=False):
         dirtags = [dirtagname + ":%s" % name]
         directory_bytes = 0
         directory_files = 0
-        for root, dirs, files in walk(directory):
-            for filename in files:
-                filename = join(root, filename)
-                # check if it passes our filter
-                if not fnmatch(filename, pattern):
-                    continue
+        match = self._get_matcher(pattern)
+        now = time.time()
 
-                directory_files += 1
+        histogram_values = {}
+        if local_histograms:
+            histogram_values = {
+                "system.disk.directory.file.bytes": array('d'),
+                "system.disk.directory.file.modified_sec_ago": array('d'),
+                "system.disk.directory.file.created_sec_ago": array('d'),
+            }
+
+        for root, (count, names, stats, _) in self._walk(directory, match, recursive, filegauges, countonly, cache_key):
+            # We're just looking to count the files
+            if countonly:
+                directory_files += count
+                continue
 
-                # We're just looking to count the files, don't stat it as well
-                if countonly:
+            for i in xrange(count):
+                directory_files += 1
+                size, mtime, ctime = stats[3 * i:3 * i + 3]
+                # couldn't stat the file
+                if size != size:
                     continue
 
-                try:
-                    file_stat = stat(filename)
+                # file specific metrics
+                directory_bytes += size
+                if filegauges and directory_files <= 20:
+                    filetags = list(dirtags)
+                    filetags.append(filetagname + ":%s" % join(root, names[i]))
+                    self.gauge("system.disk.directory.file.bytes", size, tags=filetags)
+                    self.gauge("system.disk.directory.file.modified_sec_ago", now - mtime, tags=filetags)
+                    self.gauge("system.disk.directory.file.created_sec_ago", now - ctime, tags=filetags)
+                elif not filegauges:
+                    if local_histograms:
+                        histogram_values["system.disk.directory.file.bytes"].append(size)
+                        histogram_values["system.disk.directory.file.modified_sec_ago"].append(now - mtime)
+                        histogram_values["system.disk.directory.file.created_sec_ago"].append(now - ctime)
+                    else:
+                        self.histogram("system.disk.directory.file.bytes", size, tags=dirtags)
+                        self.histogram("system.disk.directory.file.modified_sec_ago", now - mtime, tags=dirtags)
+                        self.histogram("system.disk.directory.file.created_sec_ago", now - ctime, tags=dirtags)
 
-                except OSError as ose:
-                    self.warning("DirectoryCheck: could not stat file %s - %s" % (filename, ose))
-                else:
-                    # file specific metrics
-                    directory_bytes += file_stat.st_size
-                    if filegauges and directory_files <= 20:
-                        filetags = list(dirtags)
-                        filetags.append(filetagname + ":%s" % filename)
-                        self.gauge("system.disk.directory.file.bytes", file_stat.st_size, tags=filetags)
-                        self.gauge("system.disk.directory.file.modified_sec_ago", time.time() - file_stat.st_mtime, tags=filetags)
-                        self.gauge("system.disk.directory.file.created_sec_ago", time.time() - file_stat.st_ctime, tags=filetags)
-                    elif not filegauges:
-                        self.histogram("system.disk.directory.file.bytes", file_stat.st_size, tags=dirtags)
-                        self.histogram("system.disk.directory.file.modified_sec_ago", time.time() - file_stat.st_mtime, tags=dirtags)
-                        self.histogram("system.disk.directory.file.created_sec_ago", time.time() - file_stat.st_ctime, tags=dirtags)
-
-            # os.walk gives us all sub-directories and their files
-            # if we do not want to do this recursively and just want
-            # the top level directory we gave it, then break
-            if not recursive:
-                break
+        for metric, values in histogram_values.iteritems():
+            self._submit_local_histogram(metric, values, dirtags)
 
         # number of files
         self.gauge("system.disk.directory.files", directory_files, tags=dirtags)
         # total file size
         if not countonly:
             self.gauge("system.disk.directory.bytes", directory_bytes, tags=dirtags)
+
+    def _submit_local_histogram(self, metric, values, tags):
+        """
+        Submit the aggregates of a histogram computed by the check, the same
+        way the agent's aggregator would. `count` is the number of values.
+        """
+        if not values:
+            return
+
+        samples = sorted(values)
+        length = len(samples)
+        aggregates = {
+            'min': samples[0],
+            'max': samples[-1],
+            'median': samples[int(round(length / 2 - 1))],
+            'avg': sum(samples) / length,
+            'sum': sum(samples),
+            'count': length,
+        }
+        for aggregate in self.histogram_aggregates:
+            if aggregate in aggregates:
+                self.gauge("%s.%s" % (metric, aggregate), aggregates[aggregate], tags=tags)
+
+        for percentile in self.histogram_percentiles:
+            value = samples[int(round(percentile * length - 1))]
+            self.gauge("%s.%spercentile" % (metric, int(percentile * 100)), value, tags=tags)
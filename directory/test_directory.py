@@ -7,6 +7,10 @@ from itertools import product
 import os
 import shutil
 import tempfile
+import time
+
+# 3p
+from nose.plugins.attrib import attr
 
 # project
 from tests.checks.common import AgentCheckTest
@@ -175,3 +179,118 @@ class DirectoryTestCase(AgentCheckTest):
 
         # Raises when coverage < 100%
         self.coverage_report()
+
+    def test_local_histograms(self):
+        """
+        Histograms aggregated by the check
+        """
+        config = {
+            'instances': [{
+                'directory': self.temp_dir,
+                'recursive': True,
+                'local_histograms': True
+            }]
+        }
+
+        self.run_check(config)
+
+        dir_tags = ["name:%s" % self.temp_dir]
+        for mname in (self.DIRECTORY_METRICS + self.COMMON_METRICS):
+            self.assertMetric(mname, tags=dir_tags, count=1)
+        self.assertMetric("system.disk.directory.file.bytes.count", tags=dir_tags, count=1, value=17)
+
+        self.coverage_report()
+
+    def test_dir_cache(self):
+        """
+        Unchanged directories are not listed again
+        """
+        config = {
+            'instances': [{
+                'directory': self.temp_dir,
+                'recursive': True,
+                'countonly': True,
+                'dir_cache': True
+            }]
+        }
+        dir_tags = ["name:%s" % self.temp_dir]
+
+        # Listings of directories modified within the last second are not cached
+        time.sleep(1)
+        self.run_check(config)
+        self.assertMetric("system.disk.directory.files", tags=dir_tags, count=1, value=17)
+
+        list_directory = self.check._list_directory
+        listed = []
+
+        def mock_list_directory(path, *args):
+            listed.append(path)
+            return list_directory(path, *args)
+
+        self.run_check(config, mocks={'_list_directory': mock_list_directory})
+        self.assertMetric("system.disk.directory.files", tags=dir_tags, count=1, value=17)
+        self.assertEqual(listed, [])
+
+        open(self.temp_dir + "/subfolder/file_5", 'a').close()
+        self.run_check(config, mocks={'_list_directory': mock_list_directory})
+        self.assertMetric("system.disk.directory.files", tags=dir_tags, count=1, value=18)
+        self.assertEqual(listed, [self.temp_dir + "/subfolder"])
+
+
+@attr(requires='directory')
+class DirectoryBenchmark(AgentCheckTest):
+    CHECK_NAME = 'directory'
+
+    DIR_COUNT = 1000
+    FILES_PER_DIR = 1000
+
+    def setUp(self):
+        """
+        Generate a tree of 1M files
+        """
+        self.temp_dir = tempfile.mkdtemp()
+        for i in xrange(self.DIR_COUNT):
+            subfolder = os.path.join(self.temp_dir, "dir_%s" % i)
+            os.makedirs(subfolder)
+            for j in xrange(self.FILES_PER_DIR):
+                open(os.path.join(subfolder, "file_%s.log" % j), 'a').close()
+        # directories modified within the last second are not cached
+        time.sleep(1)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _timed_run(self, config):
+        start = time.time()
+        self.run_check(config, force_reload=True)
+        return time.time() - start
+
+    def test_benchmark(self):
+        file_count = self.DIR_COUNT * self.FILES_PER_DIR
+        dir_tags = ["name:%s" % self.temp_dir]
+        instance = {
+            'directory': self.temp_dir,
+            'recursive': True,
+            'pattern': '*.log',
+        }
+
+        histograms = self._timed_run({'instances': [instance]})
+        self.assertMetric("system.disk.directory.files", tags=dir_tags, count=1, value=file_count)
+
+        local_histograms = self._timed_run({'instances': [dict(instance, local_histograms=True)]})
+        self.assertMetric("system.disk.directory.file.bytes.count", tags=dir_tags, count=1, value=file_count)
+
+        config = {'instances': [dict(instance, countonly=True, dir_cache=True)]}
+        self.load_check(config)
+        start = time.time()
+        self.run_check(config)
+        countonly = time.time() - start
+        start = time.time()
+        self.run_check(config)
+        countonly_cached = time.time() - start
+        self.assertMetric("system.disk.directory.files", tags=dir_tags, count=1, value=file_count)
+
+        print "%s files: histograms %.2fs, local histograms %.2fs, countonly %.2fs, countonly cached %.2fs" % (
+            file_count, histograms, local_histograms, countonly, countonly_cached)
+        self.assertLess(local_histograms, histograms)
+        self.assertLess(countonly_cached, countonly)
@@ -28,6 +28,8 @@ SERVICE_CHECK_NAME = 'docker.service_up'
 HEALTHCHECK_SERVICE_CHECK_NAME = 'docker.container_health'
 SIZE_REFRESH_RATE = 5  # Collect container sizes every 5 iterations of the check
 CONTAINER_ID_RE = re.compile('[0-9a-f]{64}')
+# Marks pids running in a container cgroup that doesn't contain a container id
+CUSTOM_CGROUP_PID = ''
 
 GAUGE = AgentCheck.gauge
 RATE = AgentCheck.rate
@@ -174,6 +176,11 @@ class DockerDaemon(AgentCheck):
             self._filtered_containers = set()
             self._disable_net_metrics = False
 
+            # pid -> container id index of /proc and its reverse mapping, kept across runs
+            self._pid_index = {}
+            self._container_pids = defaultdict(set)
+            self._unmatched_containers = set()
+
             # Set tagging options
             self.custom_tags = instance.get("tags", [])
             self.collect_labels_as_tags = instance.get("collect_labels_as_tags", DEFAULT_LABELS_AS_TAGS)
@@ -913,9 +920,14 @@ class DockerDaemon(AgentCheck):
 
     # proc files
     def _crawl_container_pids(self, container_dict, custom_cgroups=False):
-        """Crawl `/proc` to find container PIDs and add them to `containers_by_id`."""
+        """Find container PIDs in `/proc` and add them to `containers_by_id`.
+
+        `/proc` is listed once per run but only pids that appeared since the
+        previous run get their cgroup file read, see `_update_pid_index`, plus
+        the pid picked for each container, see `_get_container_pid`.
+        """
         proc_path = os.path.join(self.docker_util._docker_root, 'proc')
-        pid_dirs = [_dir for _dir in os.listdir(proc_path) if _dir.isdigit()]
+        pid_dirs = set(_dir for _dir in os.listdir(proc_path) if _dir.isdigit())
 
         if len(pid_dirs) == 0:
             self.warning("Unable to find any pid directory in {0}. "
@@ -928,50 +940,106 @@ class DockerDaemon(AgentCheck):
 
         self._disable_net_metrics = False
 
-        for folder in pid_dirs:
+        full_scan = not self._pid_index
+        self._update_pid_index(proc_path, pid_dirs)
+
+        # A pid can die and be reused by a new container between two runs, in which
+        # case the index still has it under its previous owner. Rebuild the index
+        # once when a container we have never seen before has no pid in it.
+        unmatched = set(c_id for c_id in container_dict if c_id not in self._container_pids)
+        if not full_scan and unmatched - self._unmatched_containers:
+            self._pid_index = {}
+            self._container_pids = defaultdict(set)
+            self._update_pid_index(proc_path, pid_dirs)
+            unmatched = set(c_id for c_id in container_dict if c_id not in self._container_pids)
+        self._unmatched_containers = unmatched
+
+        for container_id, container in container_dict.iteritems():
+            folder = self._get_container_pid(proc_path, container_id)
+            if folder is not None:
+                container['_pid'] = folder
+                container['_proc_root'] = os.path.join(proc_path, folder)
+            elif custom_cgroups and container.get('_pid'):
+                # the pid comes from the API, we only need to know it runs in a container cgroup
+                folder = str(container['_pid'])
+                if self._reindex_pid(proc_path, folder) == CUSTOM_CGROUP_PID:
+                    container['_proc_root'] = os.path.join(proc_path, folder)
 
-            try:
-                path = os.path.join(proc_path, folder, 'cgroup')
-                with open(path, 'r') as f:
-                    content = [line.strip().split(':') for line in f.readlines()]
-
-                selinux_policy = ''
-                path = os.path.join(proc_path, folder, 'attr', 'current')
-                if os.path.exists(path):
-                    with open(path, 'r') as f:
-                        selinux_policy = f.readlines()[0]
-            except IOError, e:
-                #  Issue #2074
-                self.log.debug("Cannot read %s, "
-                               "process likely raced to finish : %s" %
-                               (path, str(e)))
-            except Exception as e:
-                self.warning("Cannot read %s : %s" % (path, str(e)))
-                continue
+        return container_dict
 
-            try:
-                for line in content:
-                    if self._is_container_cgroup(line, selinux_policy):
-                        cpuacct = line[2]
-                        break
-                else:
-                    continue
+    def _update_pid_index(self, proc_path, pid_dirs):
+        """Sync the pid -> container id index with the pids currently in `/proc`.
 
-                matches = re.findall(CONTAINER_ID_RE, cpuacct)
-                if matches:
-                    container_id = matches[-1]
-                    if container_id not in container_dict:
-                        self.log.debug("Container %s not in container_dict, it's likely excluded", container_id)
-                        continue
-                    container_dict[container_id]['_pid'] = folder
-                    container_dict[container_id]['_proc_root'] = os.path.join(proc_path, folder)
-                elif custom_cgroups: # if we match by pid that should be enough (?) - O(n) ugh!
-                    for _, container in container_dict.iteritems():
-                        if container.get('_pid') == int(folder):
-                            container['_proc_root'] = os.path.join(proc_path, folder)
-                            break
-
-            except Exception, e:
-                self.warning("Cannot parse %s content: %s" % (path, str(e)))
-                continue
-        return container_dict
+        Dead pids are dropped and new pids are resolved, the others are kept as is.
+        """
+        for pid in set(self._pid_index).difference(pid_dirs):
+            self._unindex_pid(pid)
+
+        for pid in pid_dirs.difference(self._pid_index):
+            self._index_pid(proc_path, pid)
+
+    def _get_container_pid(self, proc_path, container_id):
+        """Return the lowest pid of a container, or None if it has none.
+
+        A pid can be reused by another process between two runs without the
+        index noticing, so the cgroup file of the chosen pid is read again.
+        """
+        pids = self._container_pids.get(container_id)
+        while pids:
+            pid = min(pids, key=int)
+            if self._reindex_pid(proc_path, pid) == container_id:
+                return pid
+            pids = self._container_pids.get(container_id)
+        return None
+
+    def _reindex_pid(self, proc_path, pid):
+        """Resolve the container id of a pid again and return it."""
+        self._unindex_pid(pid)
+        self._index_pid(proc_path, pid)
+        return self._pid_index.get(pid)
+
+    def _index_pid(self, proc_path, pid):
+        try:
+            container_id = self._get_pid_container_id(proc_path, pid)
+        except IOError as e:
+            #  Issue #2074
+            self.log.debug("Cannot read %s, "
+                           "process likely raced to finish : %s" %
+                           (os.path.join(proc_path, pid), str(e)))
+            return
+        except Exception as e:
+            self.warning("Cannot parse %s content: %s" % (os.path.join(proc_path, pid), str(e)))
+            return
+
+        self._pid_index[pid] = container_id
+        if container_id:
+            self._container_pids[container_id].add(pid)
+
+    def _unindex_pid(self, pid):
+        container_id = self._pid_index.pop(pid, None)
+        if container_id:
+            pids = self._container_pids[container_id]
+            pids.discard(pid)
+            if not pids:
+                del self._container_pids[container_id]
+
+    def _get_pid_container_id(self, proc_path, pid):
+        """Return the id of the container a pid runs in.
+
+        Returns `CUSTOM_CGROUP_PID` if the pid is in a container cgroup that doesn't
+        contain a container id and None if it is not in a container.
+        """
+        with open(os.path.join(proc_path, pid, 'cgroup'), 'r') as f:
+            content = [line.strip().split(':') for line in f]
+
+        try:
+            with open(os.path.join(proc_path, pid, 'attr', 'current'), 'r') as f:
+                selinux_policy = f.readline()
+        except IOError:
+            selinux_policy = ''
+
+        for line in content:
+            if self._is_container_cgroup(line, selinux_policy):
+                matches = re.findall(CONTAINER_ID_RE, line[2])
+                return matches[-1] if matches else CUSTOM_CGROUP_PID
+        return None
@@ -5,6 +5,11 @@
 # stdlib
 import logging
 import mock
+import os
+import random
+import shutil
+import tempfile
+import time
 
 # 3p
 from nose.plugins.attrib import attr
@@ -652,3 +657,85 @@ class TestCheckDockerDaemon(AgentCheckTest):
         ]
         for co in containers:
             self.assertEqual(DockerUtil.container_name_extractor(co[0]), co[1])
+
+
+@attr(requires='docker_daemon')
+class TestDockerDaemonPidIndex(AgentCheckTest):
+    """Benchmark the /proc pid index against a synthetic /proc tree."""
+    CHECK_NAME = 'docker_daemon'
+
+    PID_COUNT = 50000
+    CONTAINER_COUNT = 100
+    PIDS_PER_CONTAINER = 10
+
+    def _write_pid(self, pid, cgroup_path):
+        pid_dir = os.path.join(self.proc_path, str(pid))
+        os.makedirs(pid_dir)
+        with open(os.path.join(pid_dir, 'cgroup'), 'w') as f:
+            f.write("4:memory:%s\n3:cpu,cpuacct:%s\n2:blkio:/\n" % (cgroup_path, cgroup_path))
+
+    def setUp(self):
+        self.docker_root = tempfile.mkdtemp()
+        self.proc_path = os.path.join(self.docker_root, 'proc')
+
+        self.container_ids = ['%064x' % random.getrandbits(256) for _ in xrange(self.CONTAINER_COUNT)]
+        pids = random.sample(xrange(1, self.PID_COUNT + 1), self.CONTAINER_COUNT * self.PIDS_PER_CONTAINER)
+        self.container_pids = {}
+        for i, container_id in enumerate(self.container_ids):
+            self.container_pids[container_id] = pids[i * self.PIDS_PER_CONTAINER:(i + 1) * self.PIDS_PER_CONTAINER]
+
+        container_pids = set(pids)
+        for pid in xrange(1, self.PID_COUNT + 1):
+            if pid not in container_pids:
+                self._write_pid(pid, '/user.slice')
+        for container_id, c_pids in self.container_pids.iteritems():
+            for pid in c_pids:
+                self._write_pid(pid, '/docker/%s' % container_id)
+
+    def tearDown(self):
+        shutil.rmtree(self.docker_root)
+
+    def _crawl(self):
+        containers = dict((c_id, {'Id': c_id}) for c_id in self.container_ids)
+        start = time.time()
+        with mock.patch.object(self.check.docker_util, '_docker_root', self.docker_root):
+            self.check._crawl_container_pids(containers)
+        return containers, time.time() - start
+
+    def test_pid_index_benchmark(self):
+        self.load_check(MOCK_CONFIG)
+
+        containers, full_scan = self._crawl()
+        for container_id, container in containers.iteritems():
+            self.assertEqual(container['_pid'], str(min(self.container_pids[container_id])))
+            self.assertEqual(container['_proc_root'], os.path.join(self.proc_path, container['_pid']))
+
+        containers, incremental_scan = self._crawl()
+        log.info("Crawled %s pids: full scan %.3fs, incremental scan %.3fs",
+                 self.PID_COUNT, full_scan, incremental_scan)
+        self.assertLess(incremental_scan, full_scan)
+        self.assertEqual(len(self.check._pid_index), self.PID_COUNT)
+
+        # the main pid of a container dies and a new process starts in it
+        container_id = self.container_ids[0]
+        dead_pid = min(self.container_pids[container_id])
+        shutil.rmtree(os.path.join(self.proc_path, str(dead_pid)))
+        self._write_pid(self.PID_COUNT + 1, '/docker/%s' % container_id)
+
+        containers, _ = self._crawl()
+        self.assertNotIn(str(dead_pid), self.check._pid_index)
+        self.assertIn(str(self.PID_COUNT + 1), self.check._container_pids[container_id])
+        alive_pids = [pid for pid in self.container_pids[container_id] if pid != dead_pid]
+        self.assertEqual(containers[container_id]['_pid'], str(min(alive_pids + [self.PID_COUNT + 1])))
+
+        # the main pid of a container is reused by a host process between two runs
+        container_id = self.container_ids[1]
+        reused_pid = min(self.container_pids[container_id])
+        shutil.rmtree(os.path.join(self.proc_path, str(reused_pid)))
+        self._write_pid(reused_pid, '/user.slice')
+
+        containers, _ = self._crawl()
+        self.assertIsNone(self.check._pid_index[str(reused_pid)])
+        self.assertNotIn(str(reused_pid), self.check._container_pids[container_id])
+        alive_pids = [pid for pid in self.container_pids[container_id] if pid != reused_pid]
+        self.assertEqual(containers[container_id]['_pid'], str(min(alive_pids)))
@@ -12,6 +12,7 @@ import requests
 
 # project
 from checks import AgentCheck
+from checks.libs.thread_pool import Pool
 from config import _is_affirmative
 from util import headers
 
@@ -42,6 +43,13 @@ class ESCheck(AgentCheck):
     SERVICE_CHECK_CLUSTER_STATUS = 'elasticsearch.cluster_health'
 
     DEFAULT_TIMEOUT = 5
+    DEFAULT_THREADS_COUNT = 1
+    DEFAULT_VERSION_CACHE_TTL = 300
+
+    # Node stats fields requested with `filter_path`, on top of the first
+    # levels of the metric paths
+    STATS_FILTER_PATH_FIELDS = ['cluster_name', 'nodes.*.name', 'nodes.*.host', 'nodes.*.hostname']
+    STATS_FILTER_PATH_DEPTH = 2
 
     # Clusterwise metrics, pre aggregated on ES, compatible with all ES versions
     PRIMARY_SHARD_METRICS = {
@@ -340,6 +348,31 @@ class ESCheck(AgentCheck):
         # Host status needs to persist across all checks
         self.cluster_status = {}
 
+        # Endpoints of an instance are fetched concurrently when there's more than one thread
+        self.pool = None
+        self.threads_count = int(init_config.get('threads_count', self.DEFAULT_THREADS_COUNT))
+        if self.threads_count > 1:
+            self.pool = Pool(self.threads_count)
+
+        # HTTP sessions, kept alive across runs, by URL and credentials of the instance
+        self._sessions = {}
+
+        # Versions of the clusters, by URL, with the time they expire at
+        self.version_cache_ttl = int(init_config.get('version_cache_ttl', self.DEFAULT_VERSION_CACHE_TTL))
+        self._es_versions = {}
+
+        # URLs and compiled metrics, by version and `cluster_stats`
+        self._params = {}
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        for session in self._sessions.itervalues():
+            session.close()
+        self._sessions = {}
+
     def get_instance_config(self, instance):
         url = instance.get('url')
         if url is None:
@@ -398,14 +431,22 @@ class ESCheck(AgentCheck):
         version = self._get_es_version(config)
 
         health_url, stats_url, pshard_stats_url, pending_tasks_url, stats_metrics, \
-            pshard_stats_metrics = self._define_params(version, config.cluster_stats)
+            pshard_stats_metrics = self._get_params(version, config.cluster_stats)
+
+        # Every endpoint is requested at once, their data is processed in order below
+        stats_url = urlparse.urljoin(config.url, stats_url)
+        urls = [stats_url]
+        if config.pshard_stats:
+            urls.append(urlparse.urljoin(config.url, pshard_stats_url))
+        urls.append(urlparse.urljoin(config.url, health_url))
+        if config.pending_task_stats:
+            urls.append(urlparse.urljoin(config.url, pending_tasks_url))
+        data_getters = self._prefetch_data(urls, config)
 
         # Load stats data.
         # This must happen before other URL processing as the cluster name
         # is retreived here, and added to the tag list.
-
-        stats_url = urlparse.urljoin(config.url, stats_url)
-        stats_data = self._get_data(stats_url, config)
+        stats_data = data_getters.pop(0)()
         if stats_data['cluster_name']:
             # retreive the cluster name from the data, and append it to the
             # master tag list.
@@ -414,20 +455,17 @@ class ESCheck(AgentCheck):
 
         # Load clusterwise data
         if config.pshard_stats:
-            pshard_stats_url = urlparse.urljoin(config.url, pshard_stats_url)
-            pshard_stats_data = self._get_data(pshard_stats_url, config)
+            pshard_stats_data = data_getters.pop(0)()
             self._process_pshard_stats_data(pshard_stats_data, config, pshard_stats_metrics)
 
 
         # Load the health data.
-        health_url = urlparse.urljoin(config.url, health_url)
-        health_data = self._get_data(health_url, config)
+        health_data = data_getters.pop(0)()
         self._process_health_data(health_data, config)
 
         if config.pending_task_stats:
             # Load the pending_tasks data.
-            pending_tasks_url = urlparse.urljoin(config.url, pending_tasks_url)
-            pending_tasks_data = self._get_data(pending_tasks_url, config)
+            pending_tasks_data = data_getters.pop(0)()
             self._process_pending_tasks_data(pending_tasks_data, config)
 
         # If we're here we did not have any ES conn issues
@@ -438,21 +476,26 @@ class ESCheck(AgentCheck):
         )
 
     def _get_es_version(self, config):
-        """ Get the running version of elasticsearch.
+        """ Get the running version of elasticsearch, cached for
+            `version_cache_ttl` seconds.
         """
-        try:
-            data = self._get_data(config.url, config, send_sc=False)
-            # pre-release versions of elasticearch are suffixed with -rcX etc..
-            # peel that off so that the map below doesn't error out
-            version = data['version']['number'].split('-')[0]
-            version = map(int, version.split('.')[0:3])
-        except Exception as e:
-            self.warning(
-                "Error while trying to get Elasticsearch version "
-                "from %s %s"
-                % (config.url, str(e))
-            )
-            version = [1, 0, 0]
+        now = time.time()
+        version, expires_at = self._es_versions.get(config.url, (None, 0))
+        if expires_at <= now:
+            try:
+                data = self._get_data(config.url, config, send_sc=False)
+                # pre-release versions of elasticearch are suffixed with -rcX etc..
+                # peel that off so that the map below doesn't error out
+                version = data['version']['number'].split('-')[0]
+                version = map(int, version.split('.')[0:3])
+                self._es_versions[config.url] = (version, now + self.version_cache_ttl)
+            except Exception as e:
+                self.warning(
+                    "Error while trying to get Elasticsearch version "
+                    "from %s %s"
+                    % (config.url, str(e))
+                )
+                version = [1, 0, 0]
 
 
         self.service_metadata('version', version)
@@ -546,50 +589,131 @@ class ESCheck(AgentCheck):
         return health_url, stats_url, pshard_stats_url, pending_tasks_url, \
             stats_metrics, pshard_stats_metrics
 
-    def _get_data(self, url, config, send_sc=True):
-        """ Hit a given URL and return the parsed json
+    def _get_params(self, version, cluster_stats):
+        """ Memoized `_define_params`, with the metrics compiled into
+            extraction trees and the node stats filtered down to the fields
+            they use.
+        """
+        key = (tuple(version), cluster_stats)
+        if key not in self._params:
+            health_url, stats_url, pshard_stats_url, pending_tasks_url, stats_metrics, \
+                pshard_stats_metrics = self._define_params(version, cluster_stats)
+
+            if version >= [1, 6, 0]:
+                # `filter_path` is supported from ES 1.6
+                fields = set(self.STATS_FILTER_PATH_FIELDS)
+                for desc in stats_metrics.itervalues():
+                    path = desc[1].split('.')[:self.STATS_FILTER_PATH_DEPTH]
+                    fields.add('nodes.*.' + '.'.join(path))
+                stats_url += '&' if '?' in stats_url else '?'
+                stats_url += 'filter_path=' + ','.join(sorted(fields))
+
+            self._params[key] = (
+                health_url, stats_url, pshard_stats_url, pending_tasks_url,
+                self._compile_metrics(stats_metrics), self._compile_metrics(pshard_stats_metrics)
+            )
+
+        return self._params[key]
+
+    @staticmethod
+    def _compile_metrics(metrics):
+        """ Compile metric descriptions into a tree of the keys of their
+            paths, e.g. {'jvm': ({'mem': ({...}, leaves, paths)}, leaves, paths)}.
+            `leaves` are the (metric, type, xform) found at a key, `paths` the
+            (metric, path) found at or under it.
+        """
+        tree = {}
+        for metric, desc in metrics.iteritems():
+            xtype, path = desc[:2]
+            xform = desc[2] if len(desc) > 2 else None
+
+            children = tree
+            for key in path.split('.'):
+                node = children.setdefault(key, ({}, [], []))
+                node[2].append((metric, path))
+                children = node[0]
+            node[1].append((metric, xtype, xform))
+
+        return tree
+
+    def _prefetch_data(self, urls, config):
+        """ Start fetching the given URLs on the thread pool, and return a
+            function per URL that returns its parsed json. Without a thread
+            pool, each URL is fetched when its function is called.
         """
+        if self.pool is None:
+            return [lambda url=url: self._get_data(url, config) for url in urls]
+
+        def getter(url, result):
+            def get_data():
+                try:
+                    return result.get()
+                except Exception as e:
+                    # Reported from the check's thread, in the order the data is processed
+                    self._connect_failed(url, config, e)
+                    raise
+            return get_data
+
+        return [
+            getter(url, self.pool.apply_async(self._get_data, (url, config), {'send_sc': False}))
+            for url in urls
+        ]
+
+    def _get_session(self, config):
+        """ Return the HTTP session of an instance, created along with its
+            authentication and SSL parameters the first time.
+        """
+        key = (config.url, config.username, config.password,
+               config.ssl_verify, config.ssl_cert, config.ssl_key)
+        session = self._sessions.get(key)
+        if session is not None:
+            return session
+
+        session = requests.Session()
+        # Keep a connection per thread that may request the instance at once
+        adapter = requests.adapters.HTTPAdapter(
+            pool_maxsize=max(self.threads_count, requests.adapters.DEFAULT_POOLSIZE))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update(headers(self.agentConfig))
+
         # Load basic authentication configuration, if available.
         if config.username and config.password:
-            auth = (config.username, config.password)
-        else:
-            auth = None
+            session.auth = (config.username, config.password)
 
         # Load SSL configuration, if available.
         # ssl_verify can be a bool or a string (http://docs.python-requests.org/en/latest/user/advanced/#ssl-cert-verification)
         if isinstance(config.ssl_verify, bool) or isinstance(config.ssl_verify, str):
-            verify = config.ssl_verify
-        else:
-            verify = None
+            session.verify = config.ssl_verify
         if config.ssl_cert and config.ssl_key:
-            cert = (config.ssl_cert, config.ssl_key)
+            session.cert = (config.ssl_cert, config.ssl_key)
         elif config.ssl_cert:
-            cert = config.ssl_cert
-        else:
-            cert = None
+            session.cert = config.ssl_cert
+
+        self._sessions[key] = session
+        return session
 
+    def _get_data(self, url, config, send_sc=True):
+        """ Hit a given URL and return the parsed json
+        """
         try:
-            resp = requests.get(
-                url,
-                timeout=config.timeout,
-                headers=headers(self.agentConfig),
-                auth=auth,
-                verify=verify,
-                cert=cert
-            )
+            resp = self._get_session(config).get(url, timeout=config.timeout)
             resp.raise_for_status()
         except Exception as e:
             if send_sc:
-                self.service_check(
-                    self.SERVICE_CHECK_CONNECT_NAME,
-                    AgentCheck.CRITICAL,
-                    message="Error {0} when hitting {1}".format(e, url),
-                    tags=config.service_check_tags
-                )
+                self._connect_failed(url, config, e)
             raise
 
         return resp.json()
 
+    def _connect_failed(self, url, config, e):
+        self.service_check(
+            self.SERVICE_CHECK_CONNECT_NAME,
+            AgentCheck.CRITICAL,
+            message="Error {0} when hitting {1}".format(e, url),
+            tags=config.service_check_tags
+        )
+
     def _process_pending_tasks_data(self, data, config):
         p_tasks = defaultdict(int)
 
@@ -627,15 +751,37 @@ class ESCheck(AgentCheck):
                         metric_hostname = node_data[k]
                         break
 
-            for metric, desc in stats_metrics.iteritems():
-                self._process_metric(
-                    node_data, metric, *desc,
-                    tags=metrics_tags, hostname=metric_hostname
-                )
+            self._process_metrics(node_data, stats_metrics, metrics_tags, metric_hostname)
 
     def _process_pshard_stats_data(self, data, config, pshard_stats_metrics):
-        for metric, desc in pshard_stats_metrics.iteritems():
-            self._process_metric(data, metric, *desc, tags=config.tags)
+        self._process_metrics(data, pshard_stats_metrics, config.tags)
+
+    def _process_metrics(self, data, tree, tags=None, hostname=None):
+        """ Submit the metrics of a tree compiled by `_compile_metrics`,
+            walking `data` once.
+        """
+        for key, (children, leaves, paths) in tree.iteritems():
+            value = data.get(key)
+            if value is None:
+                for metric, path in paths:
+                    self._metric_not_found(metric, path)
+                continue
+
+            for metric, xtype, xform in leaves:
+                metric_value = xform(value) if xform else value
+                if xtype == "gauge":
+                    self.gauge(metric, metric_value, tags=tags, hostname=hostname)
+                else:
+                    self.rate(metric, metric_value, tags=tags, hostname=hostname)
+
+            if not children:
+                continue
+            if isinstance(value, dict):
+                self._process_metrics(value, children, tags, hostname)
+            else:
+                for _, _, child_paths in children.itervalues():
+                    for metric, path in child_paths:
+                        self._metric_not_found(metric, path)
 
     def _process_metric(self, data, metric, xtype, path, xform=None,
                         tags=None, hostname=None):
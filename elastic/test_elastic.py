@@ -3,6 +3,7 @@
 # Licensed under Simplified BSD License (see LICENSE)
 
 # stdlib
+import json
 import os
 import time
 import socket
@@ -13,7 +14,9 @@ import requests
 
 # project
 from config import get_version
-from tests.checks.common import AgentCheckTest, load_check
+from tests.checks.common import AgentCheckTest, Fixtures, load_check
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'ci')
 
 # Clusterwise metrics, pre aggregated on ES, compatible with all ES versions
 PRIMARY_SHARD_METRICS = {
@@ -591,3 +594,103 @@ class TestElastic(AgentCheckTest):
         # Note: please make sure you don't install Maven on the CI for future
         # elastic search CI integrations. It would make the line below fail :/
         self.assertMetric('elasticsearch.primaries.docs.count', value=2)
+
+    def test_threads_count(self):
+        """ Endpoints are fetched concurrently, over a session kept across runs """
+        config = {
+            'init_config': {'threads_count': 4},
+            'instances': [
+                {'url': 'http://localhost:9200', 'pshard_stats': True},
+                {'url': 'http://localhost:9405'},
+            ]
+        }
+
+        self.assertRaises(requests.exceptions.ConnectionError, self.run_check, config)
+        self.assertMetric('elasticsearch.primaries.docs.count', count=1)
+        self.assertMetric('elasticsearch.pending_tasks_total', count=1)
+        self.assertServiceCheckOK('elasticsearch.can_connect',
+                                  tags=['host:localhost', 'port:9200'], count=1)
+        self.assertServiceCheckCritical('elasticsearch.can_connect',
+                                        tags=['host:localhost', 'port:9405'], count=1)
+
+        sessions = dict(self.check._sessions)
+        self.assertRaises(requests.exceptions.ConnectionError, self.run_check, config)
+        self.assertEquals(self.check._sessions, sessions)
+
+        self.check.stop()
+
+    def test_version_cache(self):
+        """ The version of a cluster is only requested once per `version_cache_ttl` """
+        config = {'instances': [{'url': 'http://localhost:9200'}]}
+        self.run_check(config)
+
+        instance_config = self.check.get_instance_config(config['instances'][0])
+        version, expires_at = self.check._es_versions['http://localhost:9200']
+        self.assertEquals(version, get_es_version())
+        self.assertTrue(expires_at > time.time())
+
+        # Version of a cluster that isn't reachable anymore, until it expires
+        instance_config = instance_config._replace(url='http://localhost:9405')
+        self.check._es_versions['http://localhost:9405'] = ([2, 0, 0], time.time() + 60)
+        self.assertEquals(self.check._get_es_version(instance_config), [2, 0, 0])
+
+        self.check._es_versions['http://localhost:9405'] = ([2, 0, 0], time.time() - 1)
+        self.assertEquals(self.check._get_es_version(instance_config), [1, 0, 0])
+
+
+@attr(requires='elastic')
+class TestElasticLargeNodesStats(AgentCheckTest):
+    CHECK_NAME = "elastic"
+    NODE_COUNT = 300
+
+    def setUp(self):
+        self.load_check({'instances': [{'url': 'http://localhost:9200', 'cluster_stats': True}]})
+        self.config = self.check.get_instance_config(self.check.instances[0])
+
+        # Recorded stats of a data node, repeated for every node of the cluster
+        data = json.loads(Fixtures.read_file('nodes_stats.json', sdk_dir=FIXTURE_DIR))
+        node_id, node = data['nodes'].items()[0]
+        for i in xrange(self.NODE_COUNT):
+            node = dict(node, name="es-data-%s" % i, host="10.0.%s.%s" % (i / 256, i % 256))
+            data['nodes']['%s%s' % (node_id, i)] = node
+        del data['nodes'][node_id]
+        self.payload = json.dumps(data)
+
+    def test_stats_url_filter_path(self):
+        stats_url = self.check._get_params([5, 0, 0], True)[1]
+        self.assertTrue(stats_url.startswith('/_nodes/stats?filter_path=cluster_name,'))
+        self.assertIn('nodes.*.name', stats_url)
+        self.assertIn('nodes.*.jvm.mem', stats_url)
+        self.assertTrue(len(stats_url) < 4096)
+
+        stats_url = self.check._get_params([1, 6, 0], False)[1]
+        self.assertTrue(stats_url.startswith('/_nodes/_local/stats?all=true&filter_path='))
+
+        self.assertNotIn('filter_path', self.check._get_params([1, 5, 0], False)[1])
+
+    def test_large_nodes_stats(self):
+        stats_metrics = self.check._get_params([5, 0, 0], True)[4]
+
+        durations = []
+        for _ in xrange(3):
+            start = time.time()
+            self.check._process_stats_data(json.loads(self.payload), stats_metrics, self.config)
+            durations.append(time.time() - start)
+            self.metrics = self.check.get_metrics()
+
+        print "Processed the stats of %s nodes in %.2fs (first run), %.2fs (best run)" % (
+            self.NODE_COUNT, durations[0], min(durations))
+
+        # Every metric of every node is found at the same path as before
+        raw_metrics = self.check._define_params([5, 0, 0], True)[4]
+        node_data = json.loads(self.payload)['nodes'].values()[0]
+        tags = self.config.tags + [u"node_name:{}".format(node_data['name'])]
+        for metric, desc in raw_metrics.iteritems():
+            value = node_data
+            for key in desc[1].split('.'):
+                value = value.get(key) if value is not None else None
+            if value is not None:
+                value = desc[2](value) if len(desc) > 2 else value
+                self.assertMetric(metric, value=value, tags=tags, hostname=node_data['host'], count=1)
+            else:
+                self.assertMetric(metric, count=0)
@@ -68,6 +68,15 @@ class HAProxy(AgentCheck):
         # Host status needs to persist across all checks
         self.host_status = defaultdict(lambda: defaultdict(lambda: None))
 
+        # Columns used by the check, resolved once per stats header
+        self._columns = {}
+
+        # Filtering decisions per service name, indexed by (include filter, exclude filter)
+        self._service_filter_cache = {}
+
+        # Metric types and names per back_or_front
+        self._metric_names = {}
+
     METRICS = {
         "qcur": ("gauge", "queue.current"),
         "scur": ("gauge", "session.current"),
@@ -97,6 +106,10 @@ class HAProxy(AgentCheck):
         "lastchg": ("gauge", "uptime")
     }
 
+    # Stats fields used by the check besides `METRICS`; `STRING_FIELDS` are kept as strings
+    STRING_FIELDS = ('pxname', 'svname', 'status')
+    EXTRA_FIELDS = ('lastchg', 'slim', 'scur')
+
     SERVICE_CHECK_NAME = 'haproxy.backend_up'
 
     def check(self, instance):
@@ -198,10 +211,7 @@ class HAProxy(AgentCheck):
         ''' Main data-processing loop. For each piece of useful data, we'll
         either save a metric, save an event or both. '''
 
-        # Split the first line into an index of fields
-        # The line looks like:
-        # "# pxname,svname,qcur,qmax,scur,smax,slim,stot,bin,bout,dreq,dresp,ereq,econ,eresp,wretr,wredis,status,weight,act,bck,chkfail,chkdown,lastchg,downtime,qlimit,pid,iid,sid,throttle,lbtot,tracked,type,rate,rate_lim,rate_max,"
-        fields = [f.strip() for f in data[0][2:].split(',') if f]
+        columns = self._get_columns(data[0])
 
         self.hosts_statuses = defaultdict(int)
 
@@ -213,7 +223,7 @@ class HAProxy(AgentCheck):
                 continue
 
             # Store each line's values in a dictionary
-            data_dict = self._line_to_dict(fields, line)
+            data_dict = self._line_to_dict(columns, line)
 
             if self._is_aggregate(data_dict):
                 back_or_front = data_dict['svname']
@@ -268,16 +278,40 @@ class HAProxy(AgentCheck):
 
         return data
 
-    def _line_to_dict(self, fields, line):
+    def _get_columns(self, header):
+        """
+        Resolve the columns used by the check from the stats header, once per header.
+        Returns a list of (index, field, is_numeric).
+        """
+        if header not in self._columns:
+            # Split the first line into an index of fields
+            # The line looks like:
+            # "# pxname,svname,qcur,qmax,scur,smax,slim,stot,bin,bout,dreq,dresp,ereq,econ,eresp,wretr,wredis,status,weight,act,bck,chkfail,chkdown,lastchg,downtime,qlimit,pid,iid,sid,throttle,lbtot,tracked,type,rate,rate_lim,rate_max,"
+            fields = [f.strip() for f in header[2:].split(',') if f]
+            columns = []
+            for i, field in enumerate(fields):
+                if field in self.STRING_FIELDS:
+                    columns.append((i, field, False))
+                elif field in self.EXTRA_FIELDS or field in HAProxy.METRICS:
+                    columns.append((i, field, True))
+            self._columns[header] = columns
+        return self._columns[header]
+
+    def _line_to_dict(self, columns, line):
         data_dict = {}
-        for i, val in enumerate(line.split(',')[:]):
+        values = line.split(',')
+        nb_values = len(values)
+        for i, field, is_numeric in columns:
+            if i >= nb_values:
+                continue
+            val = values[i]
             if val:
-                try:
-                    # Try converting to a long, if failure, just leave it
-                    val = float(val)
-                except Exception:
-                    pass
-                data_dict[fields[i]] = val
+                if is_numeric:
+                    try:
+                        val = float(val)
+                    except ValueError:
+                        pass
+                data_dict[field] = val
 
         if 'status' in data_dict:
             data_dict['status'] = self._normalize_status(data_dict['status'])
@@ -326,11 +360,17 @@ class HAProxy(AgentCheck):
 
     def _is_service_excl_filtered(self, service_name, services_incl_filter,
                                   services_excl_filter):
-        if self._tag_match_patterns(service_name, services_excl_filter):
-            if self._tag_match_patterns(service_name, services_incl_filter):
-                return False
-            return True
-        return False
+        filters_key = (tuple(services_incl_filter or ()), tuple(services_excl_filter or ()))
+        decisions = self._service_filter_cache.get(filters_key)
+        if decisions is None:
+            decisions = self._service_filter_cache[filters_key] = {}
+
+        if service_name not in decisions:
+            excluded = False
+            if self._tag_match_patterns(service_name, services_excl_filter):
+                excluded = not self._tag_match_patterns(service_name, services_incl_filter)
+            decisions[service_name] = excluded
+        return decisions[service_name]
 
     def _tag_match_patterns(self, tag, filters):
         if not filters:
@@ -471,15 +511,27 @@ class HAProxy(AgentCheck):
         if back_or_front == Services.BACKEND:
             tags.append('backend:%s' % hostname)
 
-        for key, value in data.items():
-            if HAProxy.METRICS.get(key):
-                suffix = HAProxy.METRICS[key][1]
-                name = "haproxy.%s.%s" % (back_or_front.lower(), suffix)
-                if HAProxy.METRICS[key][0] == 'rate':
+        metric_names = self._get_metric_names(back_or_front)
+        for key, value in data.iteritems():
+            if key in metric_names:
+                metric_type, name = metric_names[key]
+                if metric_type == 'rate':
                     self.rate(name, value, tags=tags)
                 else:
                     self.gauge(name, value, tags=tags)
 
+    def _get_metric_names(self, back_or_front):
+        """
+        Map each stats field in `METRICS` to its metric type and name for
+        `back_or_front`, built once per type.
+        """
+        if back_or_front not in self._metric_names:
+            self._metric_names[back_or_front] = dict(
+                (key, (metric_type, "haproxy.%s.%s" % (back_or_front.lower(), suffix)))
+                for key, (metric_type, suffix) in HAProxy.METRICS.iteritems()
+            )
+        return self._metric_names[back_or_front]
+
     def _process_event(self, data, url, services_incl_filter=None,
                        services_excl_filter=None, custom_tags=[]):
         '''
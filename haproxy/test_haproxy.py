@@ -6,6 +6,7 @@
 from collections import defaultdict
 import copy
 import os
+import time
 
 # 3p
 import mock
@@ -229,6 +230,60 @@ b,BACKEND,0,0,1,2,0,421,1,0,0,0,,0,0,0,0,UP,6,6,0,,0,1,0,,1,3,0,,421,,1,0,,1,,,,
         self.assertServiceCheck('haproxy.backend_up', tags=['service:a', 'new-tag', 'my:new:tag', 'backend:BACKEND'])
 
 
+def _build_large_stats(nb_backends=100, nb_servers=198):
+    """
+    Build a `show stat` dump with a frontend and a backend line per service,
+    20k rows with the defaults
+    """
+    lines = [MOCK_DATA.splitlines()[0]]
+    for i in xrange(nb_backends):
+        service = "service-%s" % i
+        lines.append("%s,FRONTEND,,,1,2,12,1,11,11,0,0,0,,,,,OPEN,,,,,,,,,1,1,0,,,,0,1,0,2,,,,0,1,0,0,0,0,,1,1,1,,," % service)
+        for j in xrange(nb_servers):
+            status = "UP" if j % 10 else "DOWN"
+            lines.append("%s,i-%s,0,0,0,1,,1,1,0,,0,,0,0,0,0,%s,1,1,0,0,1,1,30,,1,3,1,,70,,2,0,,1,1,,0,,,,,,,0,,,,0,0," % (service, j, status))
+        lines.append("%s,BACKEND,0,0,1,2,0,421,1,0,0,0,,0,0,0,0,UP,6,6,0,,0,1,0,,1,3,0,,421,,1,0,,1,,,,,,,,,,,,,,0,0," % service)
+    return lines
+
+
+@attr(requires='haproxy')
+class TestHAProxyLargeStats(AgentCheckTest):
+    CHECK_NAME = 'haproxy'
+
+    def setUp(self):
+        self.load_check({'instances': [{'url': 'http://localhost/admin?stats'}]})
+        self.data = _build_large_stats()
+
+    def test_large_stats_dump(self):
+        services_excl_filter = ['service-1.*']
+        services_incl_filter = ['service-1$']
+
+        durations = []
+        for _ in xrange(3):
+            start = time.time()
+            self.check._process_data(self.data, False, False, collect_status_metrics=True,
+                                     services_incl_filter=services_incl_filter,
+                                     services_excl_filter=services_excl_filter)
+            durations.append(time.time() - start)
+            self.check.get_metrics()
+            self.check.get_service_checks()
+
+        print "Processed %s rows in %.2fs (first run), %.2fs (best run)" % (
+            len(self.data) - 1, durations[0], min(durations))
+
+        self.assertEquals(sum(self.check.hosts_statuses.values()), 100 * 198 + 100)
+
+        # Filtering decisions are made once per service, not once per row
+        decisions = self.check._service_filter_cache[(tuple(services_incl_filter), tuple(services_excl_filter))]
+        self.assertEquals(len(decisions), 100)
+        self.assertFalse(decisions['service-1'])
+        self.assertTrue(decisions['service-12'])
+        self.assertFalse(decisions['service-2'])
+
+        # The header is only parsed once
+        self.assertEquals(len(self.check._columns), 1)
+
+
 @attr(requires='haproxy')
 class HaproxyTest(AgentCheckTest):
     CHECK_NAME = 'haproxy'
@@ -11,6 +11,14 @@ from xml.etree.ElementTree import ElementTree
 
 # project
 from checks import AgentCheck
+from checks.libs.thread_pool import Pool
+
+# Number of threads scanning the jobs, jobs are scanned in the check's thread by default
+DEFAULT_THREADS_COUNT = 1
+
+# A builds directory modified less than this many seconds ago could change again
+# without its mtime changing, so the job is not considered settled
+MTIME_RESOLUTION = 1
 
 class Skip(Exception):
     """
@@ -29,6 +37,21 @@ class Jenkins(AgentCheck):
         AgentCheck.__init__(self, name, init_config, agentConfig, instances)
         self.high_watermarks = {}
 
+        # Per instance and job name: mtime of the `builds` directory, sort key
+        # of the latest build seen and whether there is nothing left to process
+        self.job_index = {}
+
+        self.pool = None
+        threads_count = int(init_config.get('threads_count', DEFAULT_THREADS_COUNT))
+        if threads_count > 1:
+            self.pool = Pool(threads_count)
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
     def _timestamp_from_build_file(self, dir_name, tree):
         timestamp = tree.find('timestamp')
         if timestamp is None or not timestamp.text:
@@ -93,51 +116,108 @@ class Jenkins(AgentCheck):
                 pass
             return d
 
+    @staticmethod
+    def _list_build_dirs(builds_dir):
+        """
+        List the build directory names of a job with their sort key,
+        skipping the symlinks and files Jenkins keeps next to them.
+        """
+        names = [name for name in os.listdir(builds_dir) if not name.startswith('.')]
+        # Before Jenkins v1.597 the build folders were named with a timestamp (eg: 2015-03-10_19-59-29)
+        # Starting from Jenkins v1.597 they are named after the build ID (1, 2, 3...)
+        # So we need try both format when trying to find the latest build and parsing build.xml
+        build_names = [name for name in names if '_' in name]
+        if not build_names:
+            build_names = [name for name in names if name[0].isdigit()]
+
+        # versions of Jenkins > 1.597 need to be sorted by build number (integer)
+        try:
+            return [(int(name), name) for name in build_names]
+        except ValueError:
+            return [(name, name) for name in build_names]
+
     def _get_build_results(self, instance_key, job_dir):
         job_name = os.path.basename(job_dir)
+        builds_dir = os.path.join(job_dir, 'builds')
+        job_index = self.job_index.setdefault(instance_key, {})
         try:
-            dirs = glob(os.path.join(job_dir, 'builds', '*_*'))
-            # Before Jenkins v1.597 the build folders were named with a timestamp (eg: 2015-03-10_19-59-29)
-            # Starting from Jenkins v1.597 they are named after the build ID (1, 2, 3...)
-            # So we need try both format when trying to find the latest build and parsing build.xml
-            if len(dirs) == 0:
-                dirs = glob(os.path.join(job_dir, 'builds', '[0-9]*'))
-            if len(dirs) > 0:
-                # versions of Jenkins > 1.597 need to be sorted by build number (integer)
+            try:
+                builds_mtime = os.stat(builds_dir).st_mtime
+            except OSError:
+                return
+
+            job_state = job_index.get(job_name)
+            if job_state is not None and job_state['settled'] and job_state['mtime'] == builds_mtime:
+                # No build was added or removed since everything was processed
+                return
+
+            last_build = job_state['last_build'] if job_state is not None else None
+            job_state = {
+                'mtime': builds_mtime,
+                'last_build': last_build,
+                'settled': time.time() - builds_mtime >= MTIME_RESOLUTION,
+            }
+            job_index[job_name] = job_state
+
+            dirs = self._list_build_dirs(builds_dir)
+            if dirs and type(last_build) != type(dirs[0][0]):
+                # The naming scheme of the builds changed
+                last_build = job_state['last_build'] = None
+            # Only look at the builds above the latest one seen
+            if last_build is not None:
+                dirs = [build_dir for build_dir in dirs if build_dir[0] > last_build]
+
+            # We try to get the last valid build
+            for sort_key, name in sorted(dirs, reverse=True):
+                dir_name = os.path.join(builds_dir, name)
+                watermark = self.high_watermarks[instance_key][job_name]
                 try:
-                    dirs = sorted(dirs, key=lambda x: int(x.split('/')[-1]), reverse=True)
-                except ValueError:
-                    dirs = sorted(dirs, reverse=True)
-                # We try to get the last valid build
-                for dir_name in dirs:
-                    watermark = self.high_watermarks[instance_key][job_name]
-                    try:
-                        build_metadata = self._get_build_metadata(dir_name, watermark)
-                    except Exception:
-                        build_metadata = None
-                    if build_metadata is not None:
-                        build_result = build_metadata.get('result')
-                        if build_result is None:
-                            break
-
-                        output = {
-                            'job_name':     job_name,
-                            'event_type':   'build result'
-                        }
-
-                        output.update(build_metadata)
-                        if 'number' not in output:
-                            output['number'] = dir_name.split('/')[-1]
-                        self.high_watermarks[instance_key][job_name] = output.get('timestamp')
-                        self.log.debug("Processing %s results '%s'" % (job_name, output))
-                        yield output
-
-                    # If it not a new build, stop here
-                    else:
+                    build_metadata = self._get_build_metadata(dir_name, watermark)
+                except Skip:
+                    self._mark_build_seen(job_state, sort_key)
+                    build_metadata = None
+                except Exception:
+                    # build.xml may not be written yet, look at it again next time
+                    job_state['settled'] = False
+                    build_metadata = None
+                else:
+                    if build_metadata is None:
+                        self._mark_build_seen(job_state, sort_key)
+                if build_metadata is not None:
+                    build_result = build_metadata.get('result')
+                    if build_result is None:
+                        # The build is still running
+                        job_state['settled'] = False
                         break
+
+                    output = {
+                        'job_name':     job_name,
+                        'event_type':   'build result'
+                    }
+
+                    output.update(build_metadata)
+                    if 'number' not in output:
+                        output['number'] = name
+                    self.high_watermarks[instance_key][job_name] = output.get('timestamp')
+                    self._mark_build_seen(job_state, sort_key)
+                    self.log.debug("Processing %s results '%s'" % (job_name, output))
+                    yield output
+
+                # If it not a new build, stop here
+                else:
+                    break
         except Exception as e:
+            job_index.pop(job_name, None)
             self.log.error("Error while working on job %s, exception: %s" % (job_name, e))
 
+    @staticmethod
+    def _mark_build_seen(job_state, sort_key):
+        if job_state['last_build'] is None or sort_key > job_state['last_build']:
+            job_state['last_build'] = sort_key
+
+    def _get_job_results(self, instance_key, job_dir):
+        return list(self._get_build_results(instance_key, job_dir))
+
     def check(self, instance, create_event=True):
         """
         DEPRECATED:
@@ -174,8 +254,13 @@ class Jenkins(AgentCheck):
             raise Exception('No jobs found in `%s`! '
                             'Check `jenkins_home` in your config' % (jenkins_jobs_dir))
 
-        for job_dir in job_dirs:
-            for output in self._get_build_results(instance.get('name'), job_dir):
+        if self.pool is not None:
+            job_results = self.pool.map(lambda job_dir: self._get_job_results(instance.get('name'), job_dir), job_dirs)
+        else:
+            job_results = (self._get_build_results(instance.get('name'), job_dir) for job_dir in job_dirs)
+
+        for results in job_results:
+            for output in results:
                 output['host'] = self.hostname
                 if create_event:
                     self.log.debug("Creating event for job: %s" % output['job_name'])
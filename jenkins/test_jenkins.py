@@ -5,6 +5,7 @@ import logging
 import os
 import shutil
 import tempfile
+import time
 
 # 3p
 import xml.etree.ElementTree as ET
@@ -79,6 +80,12 @@ class TestJenkins(AgentCheckTest):
         # Create the jenkins check
         self.load_check(self.config)
 
+    def _populate_numbered_build_dir(self, job, number, metadata):
+        # Starting from Jenkins v1.597 the build folders are named after the build ID
+        build_dir = os.path.join(self.tmp_dir, 'jobs', job, 'builds', str(number))
+        os.makedirs(build_dir)
+        write_file(os.path.join(build_dir, 'build.xml'), metadata)
+
     def _populate_build_dir(self, metadata, time=None):
         # The jenkins dd agent requires the build metadata file and a log file of results
         time = time or datetime.datetime.now()
@@ -177,3 +184,59 @@ class TestJenkins(AgentCheckTest):
         # The check method does not return anything, so this testcase passes
         # if the high_watermark was NOT updated and no exceptions were raised.
         assert self.check.high_watermarks[self.instance['name']]['foo'] == 0
+
+    def testUnchangedJobsAreSkipped(self):
+        """
+        Test that the builds of a job are only parsed again when a build is added.
+        """
+        for number in xrange(1, 11):
+            build = dict(SUCCESSFUL_BUILD, number=str(number), timestamp=str(number * 1000))
+            self._populate_numbered_build_dir('bar', number, dict_to_xml(build))
+        # A builds directory modified within the last second could change unnoticed
+        time.sleep(1)
+
+        self._create_check()
+        self.run_check(self.config)
+        self.assertEqual(self.check.job_index['default']['bar']['last_build'], 10)
+
+        get_build_metadata = self.check._get_build_metadata
+        parsed = []
+
+        def mock_get_build_metadata(dir_name, watermark):
+            job_dir, build = os.path.split(os.path.dirname(dir_name))[0], os.path.basename(dir_name)
+            if os.path.basename(job_dir) == 'bar':
+                parsed.append(build)
+            return get_build_metadata(dir_name, watermark)
+
+        self.run_check(self.config, mocks={'_get_build_metadata': mock_get_build_metadata})
+        self.assertEqual(parsed, [])
+
+        # Only the new build gets parsed
+        build = dict(SUCCESSFUL_BUILD, number='11', timestamp=str(int(time.time() * 1000)))
+        self._populate_numbered_build_dir('bar', 11, dict_to_xml(build))
+        self.run_check(self.config, mocks={'_get_build_metadata': mock_get_build_metadata})
+        self.assertEqual(parsed, ['11'])
+        self.assertMetric('jenkins.job.success', count=1, tags=['job_name:bar', 'result:SUCCESS', 'build_number:11'])
+
+    def testThreadPool(self):
+        """
+        Test that scanning the jobs on a thread pool creates the same metrics.
+        """
+        metadata = dict_to_xml(SUCCESSFUL_BUILD)
+
+        self._populate_build_dir(metadata)
+        self.config['init_config']['threads_count'] = 4
+        self._create_check()
+
+        # Set the high_water mark so that the next check will create events
+        self.check.high_watermarks['default'] = defaultdict(lambda: 0)
+
+        try:
+            self.run_check(self.config)
+        finally:
+            self.check.stop()
+
+        metrics_names = [m[0] for m in self.metrics]
+        assert len(metrics_names) == 2
+        assert 'jenkins.job.success' in metrics_names
+        assert 'jenkins.job.duration' in metrics_names
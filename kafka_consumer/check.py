@@ -3,7 +3,7 @@
 # Licensed under Simplified BSD License (see LICENSE)
 
 # stdlib
-from collections import defaultdict
+from collections import defaultdict, deque
 
 # 3p
 from kafka import KafkaClient
@@ -16,6 +16,7 @@ from checks import AgentCheck
 
 DEFAULT_KAFKA_TIMEOUT = 5
 DEFAULT_ZK_TIMEOUT = 5
+DEFAULT_ZK_MAX_INFLIGHT_REQUESTS = 100
 
 
 class KafkaCheck(AgentCheck):
@@ -28,64 +29,39 @@ class KafkaCheck(AgentCheck):
             init_config.get('zk_timeout', DEFAULT_ZK_TIMEOUT))
         self.kafka_timeout = int(
             init_config.get('kafka_timeout', DEFAULT_KAFKA_TIMEOUT))
+        self.zk_max_inflight_requests = int(
+            init_config.get('zk_max_inflight_requests', DEFAULT_ZK_MAX_INFLIGHT_REQUESTS))
+
+        # ZooKeeper and Kafka clients are kept across runs, indexed by connect string
+        self._zk_clients = {}
+        self._kafka_clients = {}
+
+    def stop(self):
+        for zk_connect_str in self._zk_clients.keys():
+            self._reset_zk_client(zk_connect_str)
+        for kafka_host_ports in self._kafka_clients.keys():
+            self._reset_kafka_client(kafka_host_ports)
 
     def check(self, instance):
         consumer_groups = self.read_config(instance, 'consumer_groups',
                                            cast=self._validate_consumer_groups)
         zk_connect_str = self.read_config(instance, 'zk_connect_str')
         kafka_host_ports = self.read_config(instance, 'kafka_connect_str')
-
-        # Construct the Zookeeper path pattern
         zk_prefix = instance.get('zk_prefix', '')
-        zk_path_tmpl = zk_prefix + '/consumers/%s/offsets/%s/%s'
 
-        # Connect to Zookeeper
-        zk_conn = KazooClient(zk_connect_str, timeout=self.zk_timeout)
-        zk_conn.start()
+        # Query Zookeeper for consumer offsets
+        zk_conn = self._get_zk_client(zk_connect_str)
+        consumer_offsets, topics = self._get_zk_consumer_offsets(zk_conn, consumer_groups, zk_prefix)
 
+        # Query Kafka for the broker offsets
+        kafka_conn = self._get_kafka_client(kafka_host_ports)
         try:
-            # Query Zookeeper for consumer offsets
-            consumer_offsets = {}
-            topics = defaultdict(set)
-            for consumer_group, topic_partitions in consumer_groups.iteritems():
-                for topic, partitions in topic_partitions.iteritems():
-                    # Remember the topic partitions that we've see so that we can
-                    # look up their broker offsets later
-                    topics[topic].update(set(partitions))
-                    for partition in partitions:
-                        zk_path = zk_path_tmpl % (consumer_group, topic, partition)
-                        try:
-                            consumer_offset = int(zk_conn.get(zk_path)[0])
-                            key = (consumer_group, topic, partition)
-                            consumer_offsets[key] = consumer_offset
-                        except NoNodeError:
-                            self.log.warn('No zookeeper node at %s' % zk_path)
-                        except Exception:
-                            self.log.exception('Could not read consumer offset from %s' % zk_path)
-        finally:
-            try:
-                zk_conn.stop()
-                zk_conn.close()
-            except Exception:
-                self.log.exception('Error cleaning up Zookeeper connection')
-
-        # Connect to Kafka
-        kafka_conn = KafkaClient(kafka_host_ports, timeout=self.kafka_timeout)
-
-        try:
-            # Query Kafka for the broker offsets
-            broker_offsets = {}
-            for topic, partitions in topics.items():
-                offset_responses = kafka_conn.send_offset_request([
-                    OffsetRequest(topic, p, -1, 1) for p in partitions])
-
-                for resp in offset_responses:
-                    broker_offsets[(resp.topic, resp.partition)] = resp.offsets[0]
-        finally:
-            try:
-                kafka_conn.close()
-            except Exception:
-                self.log.exception('Error cleaning up Kafka connection')
+            broker_offsets = self._get_broker_offsets(kafka_conn, topics)
+        except Exception:
+            # The client may hold stale connections or partition leaders,
+            # start over with a new one on the next run
+            self._reset_kafka_client(kafka_host_ports)
+            raise
 
         # Report the broker data
         for (topic, partition), broker_offset in broker_offsets.items():
@@ -106,6 +82,104 @@ class KafkaCheck(AgentCheck):
             self.gauge('kafka.consumer_lag', broker_offset - consumer_offset,
                        tags=tags)
 
+    def _get_zk_consumer_offsets(self, zk_conn, consumer_groups, zk_prefix):
+        """
+        Fetch the consumer offsets from Zookeeper, keeping up to
+        `zk_max_inflight_requests` requests in flight.
+        Returns the offsets and the partitions seen for each topic.
+        """
+        # Construct the Zookeeper path pattern
+        zk_path_tmpl = zk_prefix + '/consumers/%s/offsets/%s/%s'
+
+        consumer_offsets = {}
+        topics = defaultdict(set)
+        in_flight = deque()
+
+        def collect_oldest_request():
+            key, zk_path, async_result = in_flight.popleft()
+            try:
+                consumer_offsets[key] = int(async_result.get(timeout=self.zk_timeout)[0])
+            except NoNodeError:
+                self.log.warn('No zookeeper node at %s' % zk_path)
+            except Exception:
+                self.log.exception('Could not read consumer offset from %s' % zk_path)
+
+        for consumer_group, topic_partitions in consumer_groups.iteritems():
+            for topic, partitions in topic_partitions.iteritems():
+                # Remember the topic partitions that we've see so that we can
+                # look up their broker offsets later
+                topics[topic].update(set(partitions))
+                for partition in partitions:
+                    zk_path = zk_path_tmpl % (consumer_group, topic, partition)
+                    key = (consumer_group, topic, partition)
+                    in_flight.append((key, zk_path, zk_conn.get_async(zk_path)))
+                    if len(in_flight) >= self.zk_max_inflight_requests:
+                        collect_oldest_request()
+
+        while in_flight:
+            collect_oldest_request()
+
+        return consumer_offsets, topics
+
+    def _get_broker_offsets(self, kafka_conn, topics):
+        """
+        Fetch the latest offsets of all the partitions in a single call,
+        the client sends one request per partition leader.
+        """
+        broker_offsets = {}
+        offset_responses = kafka_conn.send_offset_request([
+            OffsetRequest(topic, p, -1, 1) for topic, partitions in topics.iteritems() for p in partitions])
+
+        for resp in offset_responses:
+            broker_offsets[(resp.topic, resp.partition)] = resp.offsets[0]
+
+        return broker_offsets
+
+    # Client management
+
+    @staticmethod
+    def _client_key(connect_str):
+        # Connect strings can be lists of hosts
+        if isinstance(connect_str, list):
+            return tuple(connect_str)
+        return connect_str
+
+    def _get_zk_client(self, zk_connect_str):
+        key = self._client_key(zk_connect_str)
+        if key in self._zk_clients and not self._zk_clients[key].connected:
+            # The connection was lost, start over with a new client
+            self._reset_zk_client(zk_connect_str)
+        if key not in self._zk_clients:
+            zk_conn = KazooClient(zk_connect_str, timeout=self.zk_timeout)
+            zk_conn.start()
+            self._zk_clients[key] = zk_conn
+        return self._zk_clients[key]
+
+    def _reset_zk_client(self, zk_connect_str):
+        zk_conn = self._zk_clients.pop(self._client_key(zk_connect_str), None)
+        if zk_conn is None:
+            return
+        try:
+            zk_conn.stop()
+            zk_conn.close()
+        except Exception:
+            self.log.exception('Error cleaning up Zookeeper connection')
+
+    def _get_kafka_client(self, kafka_host_ports):
+        key = self._client_key(kafka_host_ports)
+        if key not in self._kafka_clients:
+            self._kafka_clients[key] = KafkaClient(kafka_host_ports, timeout=self.kafka_timeout)
+        return self._kafka_clients[key]
+
+    def _reset_kafka_client(self, kafka_host_ports):
+        kafka_conn = self._kafka_clients.pop(self._client_key(kafka_host_ports), None)
+        if kafka_conn is None:
+            return
+        try:
+            kafka_conn.close()
+        except Exception:
+            self.log.exception('Error cleaning up Kafka connection')
+
     # Private config validation/marshalling functions
 
     def _validate_consumer_groups(self, val):
@@ -3,9 +3,14 @@
 # Licensed under Simplified BSD License (see LICENSE)
 
 # stdlib
-from nose.plugins.attrib import attr
+from collections import namedtuple
+import sys
+import threading
+import time
 
 # 3p
+from mock import patch
+from nose.plugins.attrib import attr
 
 # project
 from tests.checks.common import AgentCheckTest
@@ -45,3 +50,121 @@ class TestKafka(AgentCheckTest):
             self.assertMetric(mname, at_least=1)
 
         self.coverage_report()
+
+
+# Fake ZooKeeper and Kafka clients, every request takes FAKE_LATENCY seconds
+FAKE_LATENCY = 0.02
+FAKE_LEADERS = 3
+
+OffsetResponse = namedtuple('OffsetResponse', ['topic', 'partition', 'error', 'offsets'])
+
+
+class FakeAsyncResult(object):
+    def __init__(self, value):
+        self._value = value
+        self._ready = threading.Event()
+        timer = threading.Timer(FAKE_LATENCY, self._ready.set)
+        timer.daemon = True
+        timer.start()
+
+    def get(self, block=True, timeout=None):
+        self._ready.wait(timeout)
+        return self._value
+
+
+class FakeKazooClient(object):
+    instances = 0
+
+    def __init__(self, hosts, timeout=None):
+        FakeKazooClient.instances += 1
+        self.connected = False
+
+    def start(self):
+        self.connected = True
+
+    def stop(self):
+        self.connected = False
+
+    def close(self):
+        pass
+
+    def get(self, path):
+        time.sleep(FAKE_LATENCY)
+        return ('10', None)
+
+    def get_async(self, path):
+        return FakeAsyncResult(('10', None))
+
+
+class FakeKafkaClient(object):
+    instances = 0
+
+    def __init__(self, hosts, timeout=None):
+        FakeKafkaClient.instances += 1
+
+    def close(self):
+        pass
+
+    def send_offset_request(self, payloads, fail_on_error=True, callback=None):
+        # one round trip per partition leader
+        leaders = set(payload.partition % FAKE_LEADERS for payload in payloads)
+        time.sleep(FAKE_LATENCY * len(leaders))
+        return [OffsetResponse(payload.topic, payload.partition, 0, [15]) for payload in payloads]
+
+
+@attr(requires='kafka_consumer')
+class TestKafkaFakeClients(AgentCheckTest):
+    """Per-run latency against fake ZooKeeper and Kafka clients."""
+    CHECK_NAME = 'kafka_consumer'
+
+    def _timed_run(self, partition_count):
+        config = {
+            'init_config': {'zk_max_inflight_requests': 1000},
+            'instances': [{
+                'kafka_connect_str': 'localhost:9092',
+                'zk_connect_str': 'localhost:2181',
+                'consumer_groups': {
+                    'my_consumer': {
+                        'test': range(partition_count)
+                    }
+                }
+            }]
+        }
+        self.load_check(config)
+        check_module = sys.modules[self.check.__class__.__module__]
+        with patch.object(check_module, 'KazooClient', FakeKazooClient), \
+                patch.object(check_module, 'KafkaClient', FakeKafkaClient):
+            start = time.time()
+            self.run_check(config)
+            return time.time() - start
+
+    def test_latency_constant_in_partition_count(self):
+        small = self._timed_run(10)
+        large = self._timed_run(500)
+
+        # 500 sequential reads would take 10s
+        self.assertLess(large, 10 * small)
+        self.assertLess(large, 50 * FAKE_LATENCY)
+
+        self.assertMetric('kafka.consumer_lag', value=5, count=500)
+        self.assertMetric('kafka.broker_offset', value=15, count=500)
+
+    def test_clients_kept_across_runs(self):
+        FakeKazooClient.instances = 0
+        FakeKafkaClient.instances = 0
+        config = {
+            'instances': instance
+        }
+        self.load_check(config)
+        check_module = sys.modules[self.check.__class__.__module__]
+        with patch.object(check_module, 'KazooClient', FakeKazooClient), \
+                patch.object(check_module, 'KafkaClient', FakeKafkaClient):
+            self.run_check(config)
+            self.run_check(config)
+            self.assertEqual(FakeKazooClient.instances, 1)
+            self.assertEqual(FakeKafkaClient.instances, 1)
+
+            # A disconnected ZooKeeper client gets replaced on the next run
+            self.check._zk_clients.values()[0].stop()
+            self.run_check(config)
+            self.assertEqual(FakeKazooClient.instances, 2)
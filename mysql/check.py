@@ -5,6 +5,7 @@
 
 # stdlib
 import re
+import time
 import traceback
 from contextlib import closing, contextmanager
 from collections import defaultdict
@@ -26,6 +27,121 @@ RATE = "rate"
 COUNT = "count"
 MONOTONIC = "monotonic_count"
 
+# Seconds a connection is kept open between two runs of its instance
+DEFAULT_CONNECTION_MAX_IDLE = 300
+
+# Seconds between two collections of the schema sizes, re-emitted in between
+DEFAULT_SCHEMA_SIZE_REFRESH_INTERVAL = 300
+# Seconds a schema size query may run on the server (MySQL >= 5.7.8)
+DEFAULT_SCHEMA_SIZE_TIMEOUT = 60
+
+INNODB_ENGINE_QUERY = """\
+SELECT engine FROM information_schema.ENGINES
+WHERE engine = 'InnoDB' AND support != 'no' AND support != 'disabled'"""
+
+# Global status, variables and InnoDB availability, in a single round trip
+STATS_BATCH_QUERY = "SHOW /*!50002 GLOBAL */ STATUS; SHOW GLOBAL VARIABLES; " + INNODB_ENGINE_QUERY
+
+# Statement digests that ran since a given time, oldest first
+DIGEST_STATS_QUERY = """\
+SELECT schema_name, digest, count_star, sum_timer_wait, last_seen
+FROM performance_schema.events_statements_summary_by_digest
+WHERE last_seen >= %s
+ORDER BY last_seen"""
+DIGEST_STATS_START = '1970-01-01 00:00:00'
+
+# The optimizer hint is a comment for the servers that don't support it
+SCHEMA_SIZE_QUERY = """\
+SELECT {hint} table_schema, SUM(data_length+index_length)/1024/1024 AS total_mb
+FROM information_schema.tables
+GROUP BY table_schema"""
+SCHEMA_LIST_QUERY = "SELECT schema_name FROM information_schema.schemata"
+SINGLE_SCHEMA_SIZE_QUERY = """\
+SELECT {hint} SUM(data_length+index_length)/1024/1024 AS total_mb
+FROM information_schema.tables
+WHERE table_schema = %s"""
+
+# Section headers of SHOW ENGINE INNODB STATUS, e.g.
+# ----------
+# SEMAPHORES
+# ----------
+INNODB_SECTION_HEADER = re.compile(r"^-+\n([A-Z][A-Z/ ]*[A-Z])\n-+$", re.M)
+
+# Lines parsed in each section, as (name, prefix) pairs: the prefix is matched
+# against the line once stripped of its leading whitespace, other lines of the
+# section are skipped without being tokenized
+INNODB_SECTION_LINES = {
+    'SEMAPHORES': [
+        ('mutex_spin_waits', r"Mutex spin waits"),
+        ('rw_shared_spins', r"RW-shared spins"),
+        ('rw_excl_spins', r"RW-excl spins"),
+        ('semaphore_wait', r"--Thread [^\n]*seconds the semaphore:"),
+    ],
+    'TRANSACTIONS': [
+        ('history_list_length', r"History list length"),
+        ('transaction', r"---TRANSACTION"),
+        ('trx_lock_wait', r"------- TRX HAS BEEN"),
+        ('tables_in_use', r"mysql tables in use"),
+        ('lock_structs', r"(?:LOCK WAIT |ROLLING BACK )?\d+ lock struct\(s\)"),
+        ('read_views', r"\d+ read views open inside InnoDB"),
+    ],
+    'FILE I/O': [
+        ('os_file_reads', r"\d+ OS file reads, "),
+        ('pending_normal_aio_reads', r"Pending normal aio reads:"),
+        ('ibuf_aio_reads', r"ibuf aio reads"),
+        ('pending_flushes', r"Pending flushes \(fsync\)"),
+    ],
+    'INSERT BUFFER AND ADAPTIVE HASH INDEX': [
+        ('ibuf_for_space', r"Ibuf for space 0: size "),
+        ('ibuf_size', r"Ibuf: size "),
+        # The counters are on the line following "merged operations:"
+        ('merged_operations', r"merged operations:\n[ \t]*[^\n]*, delete mark "),
+        ('merged_recs', r"\d+ inserts, \d+ merged recs, "),
+        ('hash_table_size', r"Hash table size "),
+    ],
+    'LOG': [
+        ('log_ios_done', r"\d+ log i/o's done, "),
+        ('pending_log_writes', r"\d+ pending log writes, "),
+        ('log_sequence_number', r"Log sequence number"),
+        ('log_flushed_up_to', r"Log flushed up to"),
+        ('last_checkpoint_at', r"Last checkpoint at"),
+    ],
+    'BUFFER POOL AND MEMORY': [
+        ('total_memory_allocated', r"Total memory allocated [^\n]*in additional pool allocated"),
+        ('adaptive_hash_index', r"Adaptive hash index "),
+        ('page_hash', r"Page hash           "),
+        ('dictionary_cache', r"Dictionary cache    "),
+        ('file_system', r"File system         "),
+        ('lock_system', r"Lock system         "),
+        ('recovery_system', r"Recovery system     "),
+        ('threads', r"Threads             "),
+        ('buffer_pool_size', r"Buffer pool size "),
+        ('free_buffers', r"Free buffers"),
+        ('database_pages', r"Database pages"),
+        ('modified_db_pages', r"Modified db pages"),
+        # Not "Pages read ahead 0.00/s, evicted without access 0.06/s"
+        ('pages_read', r"Pages read (?!ahead)"),
+    ],
+    'ROW OPERATIONS': [
+        ('rows_inserted', r"Number of rows inserted"),
+        ('queries_inside', r"\d+ queries inside InnoDB, "),
+        ('read_views', r"\d+ read views open inside InnoDB"),
+    ],
+}
+INNODB_SECTION_PATTERNS = dict(
+    (section, re.compile(
+        r"\n[ \t]*(?:%s)[^\n]*" % "|".join("(?P<%s>%s)" % line for line in lines)
+    ))
+    for section, lines in INNODB_SECTION_LINES.iteritems()
+)
+INNODB_ROW_SEPARATOR = re.compile(" +")
+# Lines repeated for each transaction only need their leading fields tokenized
+INNODB_ROW_MAXSPLIT = {
+    'trx_lock_wait': 6,
+    'tables_in_use': 7,
+    'lock_structs': 3,
+}
+
 # Vars found in "SHOW STATUS;"
 STATUS_VARS = {
     # Command Metrics
@@ -284,20 +400,41 @@ class MySql(AgentCheck):
         self.mysql_version = {}
         self.qcache_stats = {}
 
+        # Connections kept across runs, by host key: (connection, last use, max idle time)
+        self._connections = {}
+
+        # Hosts that can't run the statements of STATS_BATCH_QUERY in a single batch
+        self._unbatched_hosts = set()
+
+        # Metrics to submit, by the groups of variables that are enabled
+        self._metric_maps = {}
+
+        # Statement digests, by host key: (last seen, {(schema, digest): (count, total time)})
+        self._digest_stats = {}
+
+        # Schema sizes, by host key: (sizes, time of the next refresh)
+        self._schema_sizes = {}
+
+    def stop(self):
+        for host_key in self._connections.keys():
+            self._close_connection(host_key)
+
     def get_library_versions(self):
         return {"pymysql": pymysql.__version__}
 
     def check(self, instance):
         host, port, user, password, mysql_sock, defaults_file, tags, options, queries, ssl, connect_timeout = \
             self._get_config(instance)
+        connection_max_idle = float(instance.get('connection_max_idle', DEFAULT_CONNECTION_MAX_IDLE))
 
         self._set_qcache_stats()
+        self._close_idle_connections()
 
         if (not host or not user) and not defaults_file:
             raise Exception("Mysql host and user are needed.")
 
-        with self._connect(host, port, mysql_sock, user,
-                           password, defaults_file, ssl, connect_timeout) as db:
+        with self._connect(host, port, mysql_sock, user, password, defaults_file,
+                           ssl, connect_timeout, tags, connection_max_idle) as db:
             try:
                 # Metadata collection
                 self._collect_metadata(db, host)
@@ -357,73 +494,161 @@ class MySql(AgentCheck):
 
         return hostkey
 
+    def _close_connection(self, host_key):
+        db = self._connections.pop(host_key)[0]
+        try:
+            db.close()
+        except Exception:
+            # Already closed, or the server is gone
+            pass
+
+    def _close_idle_connections(self):
+        """
+        Close the connections of the instances that haven't run for longer than their max idle time
+        """
+        now = time.time()
+        for host_key, (_, last_used, max_idle) in self._connections.items():
+            if now - last_used > max_idle:
+                self.log.debug("Closing the idle connection to %s", host_key)
+                self._close_connection(host_key)
+
     @contextmanager
-    def _connect(self, host, port, mysql_sock, user, password, defaults_file, ssl, connect_timeout):
-        self.service_check_tags = [
-            'server:%s' % (mysql_sock if mysql_sock != '' else host),
-            'port:%s' % ('unix_socket' if port == 0 else port)
-        ]
+    def _connect(self, host, port, mysql_sock, user, password, defaults_file, ssl, connect_timeout,
+                 tags=None, connection_max_idle=DEFAULT_CONNECTION_MAX_IDLE):
+        """
+        Yield the connection of the instance, kept open across runs. It's checked with a ping,
+        which reconnects if it was closed, and opened when there's none.
+        """
+        if defaults_file == '' and mysql_sock != '':
+            self.service_check_tags = [
+                'server:{0}'.format(mysql_sock),
+                'port:unix_socket'
+            ]
+        else:
+            self.service_check_tags = [
+                'server:%s' % (mysql_sock if mysql_sock != '' else host),
+                'port:%s' % ('unix_socket' if port == 0 else port)
+            ]
 
-        db = None
+        host_key = self._get_host_key()
         try:
-            ssl = dict(ssl) if ssl else None
-
-            if defaults_file != '':
-                db = pymysql.connect(
-                    read_default_file=defaults_file,
-                    ssl=ssl,
-                    connect_timeout=connect_timeout
-                )
-            elif mysql_sock != '':
-                self.service_check_tags = [
-                    'server:{0}'.format(mysql_sock),
-                    'port:unix_socket'
-                ]
-                db = pymysql.connect(
-                    unix_socket=mysql_sock,
-                    user=user,
-                    passwd=password,
-                    connect_timeout=connect_timeout
-                )
-            elif port:
-                db = pymysql.connect(
-                    host=host,
-                    port=port,
-                    user=user,
-                    passwd=password,
-                    ssl=ssl,
-                    connect_timeout=connect_timeout
-                )
+            if host_key in self._connections:
+                db = self._connections[host_key][0]
+                thread_id = db.server_thread_id
+                start = time.time()
+                db.ping(reconnect=True)
+                if db.server_thread_id != thread_id:
+                    self.log.debug("Reconnected to MySQL")
+                    self.count('datadog.agent.mysql.connection.reconnects', 1, tags=tags)
+                    self.gauge('datadog.agent.mysql.connection.handshake_time', time.time() - start, tags=tags)
             else:
-                db = pymysql.connect(
-                    host=host,
-                    user=user,
-                    passwd=password,
-                    ssl=ssl,
-                    connect_timeout=connect_timeout
-                )
-            self.log.debug("Connected to MySQL")
+                start = time.time()
+                db = self._open_connection(host, port, mysql_sock, user, password,
+                                           defaults_file, ssl, connect_timeout)
+                self.gauge('datadog.agent.mysql.connection.handshake_time', time.time() - start, tags=tags)
+                self.log.debug("Connected to MySQL")
+
+            self._connections[host_key] = (db, time.time(), connection_max_idle)
             self.service_check(self.SERVICE_CHECK_NAME, AgentCheck.OK,
                                tags=self.service_check_tags)
             yield db
         except Exception:
             self.service_check(self.SERVICE_CHECK_NAME, AgentCheck.CRITICAL,
                                tags=self.service_check_tags)
+            # Start over with a new connection on the next run
+            if host_key in self._connections:
+                self._close_connection(host_key)
             raise
-        finally:
-            if db:
-                db.close()
+
+        if connection_max_idle <= 0:
+            self._close_connection(host_key)
+        else:
+            self._connections[host_key] = (db, time.time(), connection_max_idle)
+
+    def _open_connection(self, host, port, mysql_sock, user, password, defaults_file, ssl, connect_timeout):
+        # The connection is kept across runs: in autocommit mode each query gets a fresh
+        # snapshot instead of holding a read view open, which would block the purge
+        ssl = dict(ssl) if ssl else None
+
+        if defaults_file != '':
+            db = pymysql.connect(
+                read_default_file=defaults_file,
+                ssl=ssl,
+                connect_timeout=connect_timeout,
+                autocommit=True
+            )
+        elif mysql_sock != '':
+            db = pymysql.connect(
+                unix_socket=mysql_sock,
+                user=user,
+                passwd=password,
+                connect_timeout=connect_timeout,
+                autocommit=True
+            )
+        elif port:
+            db = pymysql.connect(
+                host=host,
+                port=port,
+                user=user,
+                passwd=password,
+                ssl=ssl,
+                connect_timeout=connect_timeout,
+                autocommit=True
+            )
+        else:
+            db = pymysql.connect(
+                host=host,
+                user=user,
+                passwd=password,
+                ssl=ssl,
+                connect_timeout=connect_timeout,
+                autocommit=True
+            )
+        return db
+
+    def _get_metric_map(self, extra_innodb=False, extra_status=False, above_566=False, galera=False,
+                        performance=False, schema=False, replication=False):
+        """
+        Variable name -> (metric name, metric type) of the metrics to submit, built once
+        for each set of enabled variable groups
+        """
+        key = (extra_innodb, extra_status, above_566, galera, performance, schema, replication)
+        if key in self._metric_maps:
+            return self._metric_maps[key]
+
+        metrics = dict(STATUS_VARS)
+        if extra_innodb:
+            metrics.update(OPTIONAL_INNODB_VARS)
+        metrics.update(VARIABLES_VARS)
+        metrics.update(INNODB_VARS)
+        metrics.update(BINLOG_VARS)
+        if extra_status:
+            metrics.update(OPTIONAL_STATUS_VARS)
+            if above_566:
+                metrics.update(OPTIONAL_STATUS_VARS_5_6_6)
+        if galera:
+            metrics.update(GALERA_VARS)
+        if performance:
+            metrics.update(PERFORMANCE_VARS)
+        if schema:
+            metrics.update(SCHEMA_VARS)
+        if replication:
+            metrics.update(REPLICA_VARS)
+        # Synthetic metrics that can't be computed are left out of the results
+        metrics.update(SYNTHETIC_VARS)
+
+        self._metric_maps[key] = metrics
+        return metrics
 
     def _collect_metrics(self, host, db, tags, options, queries):
 
-        # Get aggregate of all VARS we want to collect
-        metrics = STATUS_VARS
+        # Groups of variables to collect
+        metric_groups = {}
 
         # collect results from db
-        results = self._get_stats_from_status(db)
-        results.update(self._get_stats_from_variables(db))
+        results, innodb_enabled = self._get_stats(db)
 
-        if (not _is_affirmative(options.get('disable_innodb_metrics', False)) and self._is_innodb_engine_enabled(db)):
+        if not _is_affirmative(options.get('disable_innodb_metrics', False)) and innodb_enabled:
             results.update(self._get_stats_from_innodb_status(db))
 
             innodb_keys = [
@@ -470,7 +695,7 @@ class MySql(AgentCheck):
 
             if _is_affirmative(options.get('extra_innodb_metrics', False)):
                 self.log.debug("Collecting Extra Innodb Metrics")
-                metrics.update(OPTIONAL_INNODB_VARS)
+                metric_groups['extra_innodb'] = True
 
         # Binary log statistics
         if self._get_variable_enabled(results, 'log_bin'):
@@ -496,42 +721,36 @@ class MySql(AgentCheck):
         except TypeError as e:
             self.log.error("Not all Key metrics are available, unable to compute: {0}".format(e))
 
-        metrics.update(VARIABLES_VARS)
-        metrics.update(INNODB_VARS)
-        metrics.update(BINLOG_VARS)
-
         if _is_affirmative(options.get('extra_status_metrics', False)):
             self.log.debug("Collecting Extra Status Metrics")
-            metrics.update(OPTIONAL_STATUS_VARS)
-
-            if self._version_compatible(db, host, (5, 6, 6)):
-                metrics.update(OPTIONAL_STATUS_VARS_5_6_6)
+            metric_groups['extra_status'] = True
+            metric_groups['above_566'] = self._version_compatible(db, host, (5, 6, 6))
 
         if _is_affirmative(options.get('galera_cluster', False)):
             # already in result-set after 'SHOW STATUS' just add vars to collect
             self.log.debug("Collecting Galera Metrics.")
-            metrics.update(GALERA_VARS)
+            metric_groups['galera'] = True
 
         performance_schema_enabled = self._get_variable_enabled(results, 'performance_schema')
         above_560 = self._version_compatible(db, host, (5, 6, 0))
         if _is_affirmative(options.get('extra_performance_metrics', False)) and above_560 and \
                 performance_schema_enabled:
             # report avg query response time per schema to Datadog
-            results['perf_digest_95th_percentile_avg_us'] = self._get_query_exec_time_95th_us(db)
-            results['query_run_time_avg'] = self._query_exec_time_per_schema(db)
-            metrics.update(PERFORMANCE_VARS)
+            results['perf_digest_95th_percentile_avg_us'], results['query_run_time_avg'] = \
+                self._get_digest_stats(db)
+            metric_groups['performance'] = True
 
         if _is_affirmative(options.get('schema_size_metrics', False)):
-            # report avg query response time per schema to Datadog
-            results['information_schema_size'] = self._query_size_per_schema(db)
-            metrics.update(SCHEMA_VARS)
+            # report the size of each schema to Datadog
+            results['information_schema_size'] = self._get_schema_sizes(db, options)
+            metric_groups['schema'] = True
 
         if _is_affirmative(options.get('replication', False)):
             # Get replica stats
             results.update(self._get_replica_stats(db))
             nonblocking = _is_affirmative(options.get('replication_non_blocking_status', False))
             results.update(self._get_slave_status(db, above_560, nonblocking))
-            metrics.update(REPLICA_VARS)
+            metric_groups['replication'] = True
 
             # get slave running form global status page
             slave_running_status = AgentCheck.UNKNOWN
@@ -577,14 +796,8 @@ class MySql(AgentCheck):
             self.service_check(self.SLAVE_SERVICE_CHECK_NAME, slave_running_status, tags=self.service_check_tags)
 
         # "synthetic" metrics
-        metrics.update(SYNTHETIC_VARS)
         self._compute_synthetic_results(results)
 
-        # remove uncomputed metrics
-        for k in SYNTHETIC_VARS:
-            if k not in results:
-                metrics.pop(k, None)
-
         # add duped metrics - reporting some as both rate and gauge
         dupes = [('Table_locks_waited', 'Table_locks_waited_rate'),
                  ('Table_locks_immediate', 'Table_locks_immediate_rate')]
@@ -592,7 +805,7 @@ class MySql(AgentCheck):
             if src in results:
                 results[dst] = results[src]
 
-        self._submit_metrics(metrics, results, tags)
+        self._submit_metrics(self._get_metric_map(**metric_groups), results, tags)
 
         # Collect custom query metrics
         # Max of 20 queries allowed
@@ -686,11 +899,11 @@ class MySql(AgentCheck):
         return self._collect_type(key, dict, unicode)
 
     def _collect_type(self, key, dict, the_type):
-        self.log.debug("Collecting data with %s" % key)
+        self.log.debug("Collecting data with %s", key)
         if key not in dict:
-            self.log.debug("%s returned None" % key)
+            self.log.debug("%s returned None", key)
             return None
-        self.log.debug("Collecting done, value %s" % dict[key])
+        self.log.debug("Collecting done, value %s", dict[key])
         return the_type(dict[key])
 
     def _collect_dict(self, metric_type, field_metric_map, query, db, tags):
@@ -799,6 +1012,37 @@ class MySql(AgentCheck):
 
         return pid
 
+    def _get_stats(self, db):
+        """
+        Global status and variables, in a single dict, and whether InnoDB is enabled. They're
+        fetched with a single batch of statements, unless the host doesn't support it.
+        """
+        host_key = self._get_host_key()
+        if host_key not in self._unbatched_hosts:
+            try:
+                with closing(db.cursor()) as cursor:
+                    cursor.execute(STATS_BATCH_QUERY)
+                    results = dict(cursor.fetchall())
+                    cursor.nextset()
+                    results.update(cursor.fetchall())
+                    try:
+                        cursor.nextset()
+                        innodb_enabled = cursor.rowcount > 0
+                    except (pymysql.err.InternalError, pymysql.err.OperationalError,
+                            pymysql.err.NotSupportedError) as e:
+                        self.warning("Possibly innodb stats unavailable - error querying engines table: %s" % str(e))
+                        innodb_enabled = False
+                    return results, innodb_enabled
+            except (pymysql.err.ProgrammingError, pymysql.err.NotSupportedError) as e:
+                # e.g. proxies that don't support multiple statements
+                self.log.warning("Cannot fetch the status and variables of %s in a single batch, "
+                                 "running one statement at a time: %s", host_key, e)
+                self._unbatched_hosts.add(host_key)
+
+        results = self._get_stats_from_status(db)
+        results.update(self._get_stats_from_variables(db))
+        return results, self._is_innodb_engine_enabled(db)
+
     def _get_stats_from_status(self, db):
         with closing(db.cursor()) as cursor:
             cursor.execute("SHOW /*!50002 GLOBAL */ STATUS;")
@@ -834,10 +1078,7 @@ class MySql(AgentCheck):
         # table. Later is choosen because that involves no string parsing.
         try:
             with closing(db.cursor()) as cursor:
-                cursor.execute(
-                    "select engine from information_schema.ENGINES where engine='InnoDB' and \
-                    support != 'no' and support != 'disabled'"
-                )
+                cursor.execute(INNODB_ENGINE_QUERY)
 
                 return (cursor.rowcount > 0)
 
@@ -911,263 +1152,25 @@ class MySql(AgentCheck):
             return {}
 
         innodb_status = cursor.fetchone()
-        innodb_status_text = innodb_status[2]
+        return self._parse_innodb_status(innodb_status[2])
+
+    def _parse_innodb_status(self, innodb_status_text):
         results = defaultdict(int)
 
-        # Here we now parse InnoDB STATUS one line at a time
+        # Here we now parse InnoDB STATUS one section at a time, only looking
+        # at the lines that hold metrics: on a busy server most of the output
+        # is the list of transactions and their locks.
         # This is heavily inspired by the Percona monitoring plugins work
-        txn_seen = False
-        prev_line = ''
-
-        for line in innodb_status_text.splitlines():
-            line = line.strip()
-            row = re.split(" +", line)
-            row = [item.strip(',') for item in row]
-            row = [item.strip(';') for item in row]
-            row = [item.strip('[') for item in row]
-            row = [item.strip(']') for item in row]
-
-            # SEMAPHORES
-            if line.find('Mutex spin waits') == 0:
-                # Mutex spin waits 79626940, rounds 157459864, OS waits 698719
-                # Mutex spin waits 0, rounds 247280272495, OS waits 316513438
-                results['Innodb_mutex_spin_waits'] = long(row[3])
-                results['Innodb_mutex_spin_rounds'] = long(row[5])
-                results['Innodb_mutex_os_waits'] = long(row[8])
-            elif line.find('RW-shared spins') == 0 and line.find(';') > 0:
-                # RW-shared spins 3859028, OS waits 2100750; RW-excl spins
-                # 4641946, OS waits 1530310
-                results['Innodb_s_lock_spin_waits'] = long(row[2])
-                results['Innodb_x_lock_spin_waits'] = long(row[8])
-                results['Innodb_s_lock_os_waits'] = long(row[5])
-                results['Innodb_x_lock_os_waits'] = long(row[11])
-            elif line.find('RW-shared spins') == 0 and line.find('; RW-excl spins') == -1:
-                # Post 5.5.17 SHOW ENGINE INNODB STATUS syntax
-                # RW-shared spins 604733, rounds 8107431, OS waits 241268
-                results['Innodb_s_lock_spin_waits'] = long(row[2])
-                results['Innodb_s_lock_spin_rounds'] = long(row[4])
-                results['Innodb_s_lock_os_waits'] = long(row[7])
-            elif line.find('RW-excl spins') == 0:
-                # Post 5.5.17 SHOW ENGINE INNODB STATUS syntax
-                # RW-excl spins 604733, rounds 8107431, OS waits 241268
-                results['Innodb_x_lock_spin_waits'] = long(row[2])
-                results['Innodb_x_lock_spin_rounds'] = long(row[4])
-                results['Innodb_x_lock_os_waits'] = long(row[7])
-            elif line.find('seconds the semaphore:') > 0:
-                # --Thread 907205 has waited at handler/ha_innodb.cc line 7156 for 1.00 seconds the semaphore:
-                results['Innodb_semaphore_waits'] += 1
-                results[
-                    'Innodb_semaphore_wait_time'] += long(float(row[9])) * 1000
-
-            # TRANSACTIONS
-            elif line.find('Trx id counter') == 0:
-                # The beginning of the TRANSACTIONS section: start counting
-                # transactions
-                # Trx id counter 0 1170664159
-                # Trx id counter 861B144C
-                txn_seen = True
-            elif line.find('History list length') == 0:
-                # History list length 132
-                results['Innodb_history_list_length'] = long(row[3])
-            elif txn_seen and line.find('---TRANSACTION') == 0:
-                # ---TRANSACTION 0, not started, process no 13510, OS thread id 1170446656
-                results['Innodb_current_transactions'] += 1
-                if line.find('ACTIVE') > 0:
-                    results['Innodb_active_transactions'] += 1
-            elif txn_seen and line.find('------- TRX HAS BEEN') == 0:
-                # ------- TRX HAS BEEN WAITING 32 SEC FOR THIS LOCK TO BE GRANTED:
-                results['Innodb_row_lock_time'] += long(row[5]) * 1000
-            elif line.find('read views open inside InnoDB') > 0:
-                # 1 read views open inside InnoDB
-                results['Innodb_read_views'] = long(row[0])
-            elif line.find('mysql tables in use') == 0:
-                # mysql tables in use 2, locked 2
-                results['Innodb_tables_in_use'] += long(row[4])
-                results['Innodb_locked_tables'] += long(row[6])
-            elif txn_seen and line.find('lock struct(s)') > 0:
-                # 23 lock struct(s), heap size 3024, undo log entries 27
-                # LOCK WAIT 12 lock struct(s), heap size 3024, undo log entries 5
-                # LOCK WAIT 2 lock struct(s), heap size 368
-                if line.find('LOCK WAIT') == 0:
-                    results['Innodb_lock_structs'] += long(row[2])
-                    results['Innodb_locked_transactions'] += 1
-                elif line.find('ROLLING BACK') == 0:
-                    # ROLLING BACK 127539 lock struct(s), heap size 15201832,
-                    # 4411492 row lock(s), undo log entries 1042488
-                    results['Innodb_lock_structs'] += long(row[2])
-                else:
-                    results['Innodb_lock_structs'] += long(row[0])
-
-            # FILE I/O
-            elif line.find(' OS file reads, ') > 0:
-                # 8782182 OS file reads, 15635445 OS file writes, 947800 OS
-                # fsyncs
-                results['Innodb_os_file_reads'] = long(row[0])
-                results['Innodb_os_file_writes'] = long(row[4])
-                results['Innodb_os_file_fsyncs'] = long(row[8])
-            elif line.find('Pending normal aio reads:') == 0:
-                # Pending normal aio reads: 0, aio writes: 0,
-                # or Pending normal aio reads: 0 [0, 0] , aio writes: 0 [0, 0] ,
-                # or Pending normal aio reads: [0, 0, 0, 0] , aio writes: [0, 0, 0, 0] ,
-                # or Pending normal aio reads: 0 [0, 0, 0, 0] , aio writes: 0 [0, 0, 0, 0] ,
-                if len(row) == 14:
-                    results['Innodb_pending_normal_aio_reads'] = long(row[4])
-                    results['Innodb_pending_normal_aio_writes'] = long(row[10])
-                elif len(row) == 16:
-                    results['Innodb_pending_normal_aio_reads'] = (long(row[4]) + long(row[5]) +
-                                                                  long(row[6]) + long(row[7]))
-                    results['Innodb_pending_normal_aio_writes'] = (long(row[11]) + long(row[12]) +
-                                                                   long(row[13]) + long(row[14]))
-                elif len(row) == 18:
-                    results['Innodb_pending_normal_aio_reads'] = long(row[4])
-                    results['Innodb_pending_normal_aio_writes'] = long(row[12])
-                else:
-                    results['Innodb_pending_normal_aio_reads'] = long(row[4])
-                    results['Innodb_pending_normal_aio_writes'] = long(row[7])
-            elif line.find('ibuf aio reads') == 0:
-                #  ibuf aio reads: 0, log i/o's: 0, sync i/o's: 0
-                #  or ibuf aio reads:, log i/o's:, sync i/o's:
-                if len(row) == 10:
-                    results['Innodb_pending_ibuf_aio_reads'] = long(row[3])
-                    results['Innodb_pending_aio_log_ios'] = long(row[6])
-                    results['Innodb_pending_aio_sync_ios'] = long(row[9])
-                elif len(row) == 7:
-                    results['Innodb_pending_ibuf_aio_reads'] = 0
-                    results['Innodb_pending_aio_log_ios'] = 0
-                    results['Innodb_pending_aio_sync_ios'] = 0
-            elif line.find('Pending flushes (fsync)') == 0:
-                # Pending flushes (fsync) log: 0; buffer pool: 0
-                results['Innodb_pending_log_flushes'] = long(row[4])
-                results['Innodb_pending_buffer_pool_flushes'] = long(row[7])
-
-            # INSERT BUFFER AND ADAPTIVE HASH INDEX
-            elif line.find('Ibuf for space 0: size ') == 0:
-                # Older InnoDB code seemed to be ready for an ibuf per tablespace.  It
-                # had two lines in the output.  Newer has just one line, see below.
-                # Ibuf for space 0: size 1, free list len 887, seg size 889, is not empty
-                # Ibuf for space 0: size 1, free list len 887, seg size 889,
-                results['Innodb_ibuf_size'] = long(row[5])
-                results['Innodb_ibuf_free_list'] = long(row[9])
-                results['Innodb_ibuf_segment_size'] = long(row[12])
-            elif line.find('Ibuf: size ') == 0:
-                # Ibuf: size 1, free list len 4634, seg size 4636,
-                results['Innodb_ibuf_size'] = long(row[2])
-                results['Innodb_ibuf_free_list'] = long(row[6])
-                results['Innodb_ibuf_segment_size'] = long(row[9])
-
-                if line.find('merges') > -1:
-                    results['Innodb_ibuf_merges'] = long(row[10])
-            elif line.find(', delete mark ') > 0 and prev_line.find('merged operations:') == 0:
-                # Output of show engine innodb status has changed in 5.5
-                # merged operations:
-                # insert 593983, delete mark 387006, delete 73092
-                results['Innodb_ibuf_merged_inserts'] = long(row[1])
-                results['Innodb_ibuf_merged_delete_marks'] = long(row[4])
-                results['Innodb_ibuf_merged_deletes'] = long(row[6])
-                results['Innodb_ibuf_merged'] = results['Innodb_ibuf_merged_inserts'] + results[
-                    'Innodb_ibuf_merged_delete_marks'] + results['Innodb_ibuf_merged_deletes']
-            elif line.find(' merged recs, ') > 0:
-                # 19817685 inserts, 19817684 merged recs, 3552620 merges
-                results['Innodb_ibuf_merged_inserts'] = long(row[0])
-                results['Innodb_ibuf_merged'] = long(row[2])
-                results['Innodb_ibuf_merges'] = long(row[5])
-            elif line.find('Hash table size ') == 0:
-                # In some versions of InnoDB, the used cells is omitted.
-                # Hash table size 4425293, used cells 4229064, ....
-                # Hash table size 57374437, node heap has 72964 buffer(s) <--
-                # no used cells
-                results['Innodb_hash_index_cells_total'] = long(row[3])
-                results['Innodb_hash_index_cells_used'] = long(
-                    row[6]) if line.find('used cells') > 0 else 0
-
-            # LOG
-            elif line.find(" log i/o's done, ") > 0:
-                # 3430041 log i/o's done, 17.44 log i/o's/second
-                # 520835887 log i/o's done, 17.28 log i/o's/second, 518724686
-                # syncs, 2980893 checkpoints
-                results['Innodb_log_writes'] = long(row[0])
-            elif line.find(" pending log writes, ") > 0:
-                # 0 pending log writes, 0 pending chkp writes
-                results['Innodb_pending_log_writes'] = long(row[0])
-                results['Innodb_pending_checkpoint_writes'] = long(row[4])
-            elif line.find("Log sequence number") == 0:
-                # This number is NOT printed in hex in InnoDB plugin.
-                # Log sequence number 272588624
-                results['Innodb_lsn_current'] = long(row[3])
-            elif line.find("Log flushed up to") == 0:
-                # This number is NOT printed in hex in InnoDB plugin.
-                # Log flushed up to   272588624
-                results['Innodb_lsn_flushed'] = long(row[4])
-            elif line.find("Last checkpoint at") == 0:
-                # Last checkpoint at  272588624
-                results['Innodb_lsn_last_checkpoint'] = long(row[3])
-
-            # BUFFER POOL AND MEMORY
-            elif line.find("Total memory allocated") == 0 and line.find("in additional pool allocated") > 0:
-                # Total memory allocated 29642194944; in additional pool allocated 0
-                # Total memory allocated by read views 96
-                results['Innodb_mem_total'] = long(row[3])
-                results['Innodb_mem_additional_pool'] = long(row[8])
-            elif line.find('Adaptive hash index ') == 0:
-                #   Adaptive hash index 1538240664     (186998824 + 1351241840)
-                results['Innodb_mem_adaptive_hash'] = long(row[3])
-            elif line.find('Page hash           ') == 0:
-                #   Page hash           11688584
-                results['Innodb_mem_page_hash'] = long(row[2])
-            elif line.find('Dictionary cache    ') == 0:
-                #   Dictionary cache    145525560      (140250984 + 5274576)
-                results['Innodb_mem_dictionary'] = long(row[2])
-            elif line.find('File system         ') == 0:
-                #   File system         313848         (82672 + 231176)
-                results['Innodb_mem_file_system'] = long(row[2])
-            elif line.find('Lock system         ') == 0:
-                #   Lock system         29232616       (29219368 + 13248)
-                results['Innodb_mem_lock_system'] = long(row[2])
-            elif line.find('Recovery system     ') == 0:
-                #   Recovery system     0      (0 + 0)
-                results['Innodb_mem_recovery_system'] = long(row[2])
-            elif line.find('Threads             ') == 0:
-                #   Threads             409336         (406936 + 2400)
-                results['Innodb_mem_thread_hash'] = long(row[1])
-            elif line.find("Buffer pool size ") == 0:
-                # The " " after size is necessary to avoid matching the wrong line:
-                # Buffer pool size        1769471
-                # Buffer pool size, bytes 28991012864
-                results['Innodb_buffer_pool_pages_total'] = long(row[3])
-            elif line.find("Free buffers") == 0:
-                # Free buffers            0
-                results['Innodb_buffer_pool_pages_free'] = long(row[2])
-            elif line.find("Database pages") == 0:
-                # Database pages          1696503
-                results['Innodb_buffer_pool_pages_data'] = long(row[2])
-            elif line.find("Modified db pages") == 0:
-                # Modified db pages       160602
-                results['Innodb_buffer_pool_pages_dirty'] = long(row[3])
-            elif line.find("Pages read ahead") == 0:
-                # Must do this BEFORE the next test, otherwise it'll get fooled by this
-                # line from the new plugin:
-                # Pages read ahead 0.00/s, evicted without access 0.06/s
-                pass
-            elif line.find("Pages read") == 0:
-                # Pages read 15240822, created 1770238, written 21705836
-                results['Innodb_pages_read'] = long(row[2])
-                results['Innodb_pages_created'] = long(row[4])
-                results['Innodb_pages_written'] = long(row[6])
-
-            # ROW OPERATIONS
-            elif line.find('Number of rows inserted') == 0:
-                # Number of rows inserted 50678311, updated 66425915, deleted
-                # 20605903, read 454561562
-                results['Innodb_rows_inserted'] = long(row[4])
-                results['Innodb_rows_updated'] = long(row[6])
-                results['Innodb_rows_deleted'] = long(row[8])
-                results['Innodb_rows_read'] = long(row[10])
-            elif line.find(" queries inside InnoDB, ") > 0:
-                # 0 queries inside InnoDB, 0 queries in queue
-                results['Innodb_queries_inside'] = long(row[0])
-                results['Innodb_queries_queued'] = long(row[4])
-
-            prev_line = line
+        headers = list(INNODB_SECTION_HEADER.finditer(innodb_status_text))
+        for i, header in enumerate(headers):
+            pattern = INNODB_SECTION_PATTERNS.get(header.group(1))
+            if pattern is None:
+                # e.g. LATEST DETECTED DEADLOCK or INDIVIDUAL BUFFER POOL INFO,
+                # whose lines would be counted twice
+                continue
+            end = headers[i + 1].start() if i + 1 < len(headers) else len(innodb_status_text)
+            for match in pattern.finditer(innodb_status_text, header.end(), end):
+                self._parse_innodb_status_line(match.lastgroup, match.group(0).strip(), results)
 
         # We need to calculate this metric separately
         try:
@@ -1183,88 +1186,338 @@ class MySql(AgentCheck):
 
         return results
 
+    def _parse_innodb_status_line(self, name, line, results):
+        # TRANSACTIONS
+        # Most of the lines of a busy server, counted without being tokenized
+        if name == 'transaction':
+            # ---TRANSACTION 0, not started, process no 13510, OS thread id 1170446656
+            results['Innodb_current_transactions'] += 1
+            if line.find('ACTIVE') > 0:
+                results['Innodb_active_transactions'] += 1
+            return
+
+        if name == 'merged_operations':
+            # Only keep the line following "merged operations:"
+            line = line[line.rfind('\n') + 1:].strip()
+
+        row = [
+            item.strip(',').strip(';').strip('[').strip(']')
+            for item in INNODB_ROW_SEPARATOR.split(line, INNODB_ROW_MAXSPLIT.get(name, 0))
+        ]
+
+        # SEMAPHORES
+        if name == 'mutex_spin_waits':
+            # Mutex spin waits 79626940, rounds 157459864, OS waits 698719
+            # Mutex spin waits 0, rounds 247280272495, OS waits 316513438
+            results['Innodb_mutex_spin_waits'] = long(row[3])
+            results['Innodb_mutex_spin_rounds'] = long(row[5])
+            results['Innodb_mutex_os_waits'] = long(row[8])
+        elif name == 'rw_shared_spins' and line.find(';') > 0:
+            # RW-shared spins 3859028, OS waits 2100750; RW-excl spins
+            # 4641946, OS waits 1530310
+            results['Innodb_s_lock_spin_waits'] = long(row[2])
+            results['Innodb_x_lock_spin_waits'] = long(row[8])
+            results['Innodb_s_lock_os_waits'] = long(row[5])
+            results['Innodb_x_lock_os_waits'] = long(row[11])
+        elif name == 'rw_shared_spins':
+            # Post 5.5.17 SHOW ENGINE INNODB STATUS syntax
+            # RW-shared spins 604733, rounds 8107431, OS waits 241268
+            results['Innodb_s_lock_spin_waits'] = long(row[2])
+            results['Innodb_s_lock_spin_rounds'] = long(row[4])
+            results['Innodb_s_lock_os_waits'] = long(row[7])
+        elif name == 'rw_excl_spins':
+            # Post 5.5.17 SHOW ENGINE INNODB STATUS syntax
+            # RW-excl spins 604733, rounds 8107431, OS waits 241268
+            results['Innodb_x_lock_spin_waits'] = long(row[2])
+            results['Innodb_x_lock_spin_rounds'] = long(row[4])
+            results['Innodb_x_lock_os_waits'] = long(row[7])
+        elif name == 'semaphore_wait':
+            # --Thread 907205 has waited at handler/ha_innodb.cc line 7156 for 1.00 seconds the semaphore:
+            results['Innodb_semaphore_waits'] += 1
+            results[
+                'Innodb_semaphore_wait_time'] += long(float(row[9])) * 1000
+
+        # TRANSACTIONS
+        elif name == 'history_list_length':
+            # History list length 132
+            results['Innodb_history_list_length'] = long(row[3])
+        elif name == 'trx_lock_wait':
+            # ------- TRX HAS BEEN WAITING 32 SEC FOR THIS LOCK TO BE GRANTED:
+            results['Innodb_row_lock_time'] += long(row[5]) * 1000
+        elif name == 'read_views':
+            # 1 read views open inside InnoDB
+            results['Innodb_read_views'] = long(row[0])
+        elif name == 'tables_in_use':
+            # mysql tables in use 2, locked 2
+            results['Innodb_tables_in_use'] += long(row[4])
+            results['Innodb_locked_tables'] += long(row[6])
+        elif name == 'lock_structs':
+            # 23 lock struct(s), heap size 3024, undo log entries 27
+            # LOCK WAIT 12 lock struct(s), heap size 3024, undo log entries 5
+            # LOCK WAIT 2 lock struct(s), heap size 368
+            if line.find('LOCK WAIT') == 0:
+                results['Innodb_lock_structs'] += long(row[2])
+                results['Innodb_locked_transactions'] += 1
+            elif line.find('ROLLING BACK') == 0:
+                # ROLLING BACK 127539 lock struct(s), heap size 15201832,
+                # 4411492 row lock(s), undo log entries 1042488
+                results['Innodb_lock_structs'] += long(row[2])
+            else:
+                results['Innodb_lock_structs'] += long(row[0])
+
+        # FILE I/O
+        elif name == 'os_file_reads':
+            # 8782182 OS file reads, 15635445 OS file writes, 947800 OS
+            # fsyncs
+            results['Innodb_os_file_reads'] = long(row[0])
+            results['Innodb_os_file_writes'] = long(row[4])
+            results['Innodb_os_file_fsyncs'] = long(row[8])
+        elif name == 'pending_normal_aio_reads':
+            # Pending normal aio reads: 0, aio writes: 0,
+            # or Pending normal aio reads: 0 [0, 0] , aio writes: 0 [0, 0] ,
+            # or Pending normal aio reads: [0, 0, 0, 0] , aio writes: [0, 0, 0, 0] ,
+            # or Pending normal aio reads: 0 [0, 0, 0, 0] , aio writes: 0 [0, 0, 0, 0] ,
+            if len(row) == 14:
+                results['Innodb_pending_normal_aio_reads'] = long(row[4])
+                results['Innodb_pending_normal_aio_writes'] = long(row[10])
+            elif len(row) == 16:
+                results['Innodb_pending_normal_aio_reads'] = (long(row[4]) + long(row[5]) +
+                                                              long(row[6]) + long(row[7]))
+                results['Innodb_pending_normal_aio_writes'] = (long(row[11]) + long(row[12]) +
+                                                               long(row[13]) + long(row[14]))
+            elif len(row) == 18:
+                results['Innodb_pending_normal_aio_reads'] = long(row[4])
+                results['Innodb_pending_normal_aio_writes'] = long(row[12])
+            else:
+                results['Innodb_pending_normal_aio_reads'] = long(row[4])
+                results['Innodb_pending_normal_aio_writes'] = long(row[7])
+        elif name == 'ibuf_aio_reads':
+            #  ibuf aio reads: 0, log i/o's: 0, sync i/o's: 0
+            #  or ibuf aio reads:, log i/o's:, sync i/o's:
+            if len(row) == 10:
+                results['Innodb_pending_ibuf_aio_reads'] = long(row[3])
+                results['Innodb_pending_aio_log_ios'] = long(row[6])
+                results['Innodb_pending_aio_sync_ios'] = long(row[9])
+            elif len(row) == 7:
+                results['Innodb_pending_ibuf_aio_reads'] = 0
+                results['Innodb_pending_aio_log_ios'] = 0
+                results['Innodb_pending_aio_sync_ios'] = 0
+        elif name == 'pending_flushes':
+            # Pending flushes (fsync) log: 0; buffer pool: 0
+            results['Innodb_pending_log_flushes'] = long(row[4])
+            results['Innodb_pending_buffer_pool_flushes'] = long(row[7])
+
+        # INSERT BUFFER AND ADAPTIVE HASH INDEX
+        elif name == 'ibuf_for_space':
+            # Older InnoDB code seemed to be ready for an ibuf per tablespace.  It
+            # had two lines in the output.  Newer has just one line, see below.
+            # Ibuf for space 0: size 1, free list len 887, seg size 889, is not empty
+            # Ibuf for space 0: size 1, free list len 887, seg size 889,
+            results['Innodb_ibuf_size'] = long(row[5])
+            results['Innodb_ibuf_free_list'] = long(row[9])
+            results['Innodb_ibuf_segment_size'] = long(row[12])
+        elif name == 'ibuf_size':
+            # Ibuf: size 1, free list len 4634, seg size 4636,
+            results['Innodb_ibuf_size'] = long(row[2])
+            results['Innodb_ibuf_free_list'] = long(row[6])
+            results['Innodb_ibuf_segment_size'] = long(row[9])
+
+            if line.find('merges') > -1:
+                results['Innodb_ibuf_merges'] = long(row[10])
+        elif name == 'merged_operations':
+            # Output of show engine innodb status has changed in 5.5
+            # merged operations:
+            # insert 593983, delete mark 387006, delete 73092
+            results['Innodb_ibuf_merged_inserts'] = long(row[1])
+            results['Innodb_ibuf_merged_delete_marks'] = long(row[4])
+            results['Innodb_ibuf_merged_deletes'] = long(row[6])
+            results['Innodb_ibuf_merged'] = results['Innodb_ibuf_merged_inserts'] + results[
+                'Innodb_ibuf_merged_delete_marks'] + results['Innodb_ibuf_merged_deletes']
+        elif name == 'merged_recs':
+            # 19817685 inserts, 19817684 merged recs, 3552620 merges
+            results['Innodb_ibuf_merged_inserts'] = long(row[0])
+            results['Innodb_ibuf_merged'] = long(row[2])
+            results['Innodb_ibuf_merges'] = long(row[5])
+        elif name == 'hash_table_size':
+            # In some versions of InnoDB, the used cells is omitted.
+            # Hash table size 4425293, used cells 4229064, ....
+            # Hash table size 57374437, node heap has 72964 buffer(s) <--
+            # no used cells
+            results['Innodb_hash_index_cells_total'] = long(row[3])
+            results['Innodb_hash_index_cells_used'] = long(
+                row[6]) if line.find('used cells') > 0 else 0
+
+        # LOG
+        elif name == 'log_ios_done':
+            # 3430041 log i/o's done, 17.44 log i/o's/second
+            # 520835887 log i/o's done, 17.28 log i/o's/second, 518724686
+            # syncs, 2980893 checkpoints
+            results['Innodb_log_writes'] = long(row[0])
+        elif name == 'pending_log_writes':
+            # 0 pending log writes, 0 pending chkp writes
+            results['Innodb_pending_log_writes'] = long(row[0])
+            results['Innodb_pending_checkpoint_writes'] = long(row[4])
+        elif name == 'log_sequence_number':
+            # This number is NOT printed in hex in InnoDB plugin.
+            # Log sequence number 272588624
+            results['Innodb_lsn_current'] = long(row[3])
+        elif name == 'log_flushed_up_to':
+            # This number is NOT printed in hex in InnoDB plugin.
+            # Log flushed up to   272588624
+            results['Innodb_lsn_flushed'] = long(row[4])
+        elif name == 'last_checkpoint_at':
+            # Last checkpoint at  272588624
+            results['Innodb_lsn_last_checkpoint'] = long(row[3])
+
+        # BUFFER POOL AND MEMORY
+        elif name == 'total_memory_allocated':
+            # Total memory allocated 29642194944; in additional pool allocated 0
+            # Total memory allocated by read views 96
+            results['Innodb_mem_total'] = long(row[3])
+            results['Innodb_mem_additional_pool'] = long(row[8])
+        elif name == 'adaptive_hash_index':
+            #   Adaptive hash index 1538240664     (186998824 + 1351241840)
+            results['Innodb_mem_adaptive_hash'] = long(row[3])
+        elif name == 'page_hash':
+            #   Page hash           11688584
+            results['Innodb_mem_page_hash'] = long(row[2])
+        elif name == 'dictionary_cache':
+            #   Dictionary cache    145525560      (140250984 + 5274576)
+            results['Innodb_mem_dictionary'] = long(row[2])
+        elif name == 'file_system':
+            #   File system         313848         (82672 + 231176)
+            results['Innodb_mem_file_system'] = long(row[2])
+        elif name == 'lock_system':
+            #   Lock system         29232616       (29219368 + 13248)
+            results['Innodb_mem_lock_system'] = long(row[2])
+        elif name == 'recovery_system':
+            #   Recovery system     0      (0 + 0)
+            results['Innodb_mem_recovery_system'] = long(row[2])
+        elif name == 'threads':
+            #   Threads             409336         (406936 + 2400)
+            results['Innodb_mem_thread_hash'] = long(row[1])
+        elif name == 'buffer_pool_size':
+            # The " " after size is necessary to avoid matching the wrong line:
+            # Buffer pool size        1769471
+            # Buffer pool size, bytes 28991012864
+            results['Innodb_buffer_pool_pages_total'] = long(row[3])
+        elif name == 'free_buffers':
+            # Free buffers            0
+            results['Innodb_buffer_pool_pages_free'] = long(row[2])
+        elif name == 'database_pages':
+            # Database pages          1696503
+            results['Innodb_buffer_pool_pages_data'] = long(row[2])
+        elif name == 'modified_db_pages':
+            # Modified db pages       160602
+            results['Innodb_buffer_pool_pages_dirty'] = long(row[3])
+        elif name == 'pages_read':
+            # Pages read 15240822, created 1770238, written 21705836
+            results['Innodb_pages_read'] = long(row[2])
+            results['Innodb_pages_created'] = long(row[4])
+            results['Innodb_pages_written'] = long(row[6])
+
+        # ROW OPERATIONS
+        elif name == 'rows_inserted':
+            # Number of rows inserted 50678311, updated 66425915, deleted
+            # 20605903, read 454561562
+            results['Innodb_rows_inserted'] = long(row[4])
+            results['Innodb_rows_updated'] = long(row[6])
+            results['Innodb_rows_deleted'] = long(row[8])
+            results['Innodb_rows_read'] = long(row[10])
+        elif name == 'queries_inside':
+            # 0 queries inside InnoDB, 0 queries in queue
+            results['Innodb_queries_inside'] = long(row[0])
+            results['Innodb_queries_queued'] = long(row[4])
+
     def _get_variable_enabled(self, results, var):
         enabled = self._collect_string(var, results)
         return (enabled and enabled.lower().strip() == 'on')
 
-    def _get_query_exec_time_95th_us(self, db):
-        # Fetches the 95th percentile query execution time and returns the value
-        # in microseconds
-
-        sql_95th_percentile = """SELECT s2.avg_us avg_us,
-                IFNULL(SUM(s1.cnt)/NULLIF((SELECT COUNT(*) FROM performance_schema.events_statements_summary_by_digest), 0), 0) percentile
-            FROM (SELECT COUNT(*) cnt, ROUND(avg_timer_wait/1000000) AS avg_us
-                    FROM performance_schema.events_statements_summary_by_digest
-                    GROUP BY avg_us) AS s1
-            JOIN (SELECT COUNT(*) cnt, ROUND(avg_timer_wait/1000000) AS avg_us
-                    FROM performance_schema.events_statements_summary_by_digest
-                    GROUP BY avg_us) AS s2
-            ON s1.avg_us <= s2.avg_us
-            GROUP BY s2.avg_us
-            HAVING percentile > 0.95
-            ORDER BY percentile
-            LIMIT 1"""
+    def _get_digest_stats(self, db):
+        # Fetches the statement digests that ran since the previous run. Returns
+        # the 95th percentile of the avg execution time of the digests over their
+        # new executions, and the avg execution time per schema since the
+        # summary was reset, both in microseconds (the timers are in picoseconds)
+        host_key = self._get_host_key()
+        last_seen, digests = self._digest_stats.get(host_key, (None, None))
 
         try:
             with closing(db.cursor()) as cursor:
-                cursor.execute(sql_95th_percentile)
-
-                if cursor.rowcount < 1:
-                    self.warning("Failed to fetch records from the perf schema 'events_statements_summary_by_digest' table.")
-                    return None
-
-                row = cursor.fetchone()
-                query_exec_time_95th_per = row[0]
-
-                return query_exec_time_95th_per
+                cursor.execute(DIGEST_STATS_QUERY, (last_seen or DIGEST_STATS_START,))
+                rows = cursor.fetchall()
         except (pymysql.err.InternalError, pymysql.err.OperationalError) as e:
-            self.warning("95th percentile performance metrics unavailable at this time: %s" % str(e))
-            return None
-
-    def _query_exec_time_per_schema(self, db):
-        # Fetches the avg query execution time per schema and returns the
-        # value in microseconds
-
-        sql_avg_query_run_time = """SELECT schema_name, ROUND((SUM(sum_timer_wait) / SUM(count_star)) / 1000000) AS avg_us
-            FROM performance_schema.events_statements_summary_by_digest
-            WHERE schema_name IS NOT NULL
-            GROUP BY schema_name"""
-
-        try:
-            with closing(db.cursor()) as cursor:
-                cursor.execute(sql_avg_query_run_time)
-
-                if cursor.rowcount < 1:
-                    self.warning("Failed to fetch records from the perf schema 'events_statements_summary_by_digest' table.")
-                    return None
+            self.warning("Digest performance metrics unavailable at this time: %s" % str(e))
+            return None, None
+
+        first_run = digests is None
+        if first_run or any(row[2] < digests.get((row[0], row[1]), (0, 0))[0] for row in rows):
+            # The summary table was truncated since the previous run: the digests
+            # it holds all ran since then
+            digests = {}
+
+        if rows:
+            # Digests last seen at the same second are read again on the next
+            # run, without new executions if they didn't run since then
+            last_seen = rows[-1][4]
+        self._digest_stats[host_key] = (last_seen, digests)
+
+        digest_avg_us = []
+        for schema_name, digest, count, timer_wait, _ in rows:
+            previous_count, previous_timer_wait = digests.get((schema_name, digest), (0, 0))
+            digests[(schema_name, digest)] = (count, timer_wait)
+            if count > previous_count:
+                digest_avg_us.append(
+                    round(float(timer_wait - previous_timer_wait) / (count - previous_count) / 1000000)
+                )
 
-                schema_query_avg_run_time = {}
-                for row in cursor.fetchall():
-                    schema_name = str(row[0])
-                    avg_us = long(row[1])
+        query_exec_time_95th_per = None
+        if digest_avg_us and not first_run:
+            # Smallest avg time with more than 95% of the digests at or below it
+            digest_avg_us.sort()
+            query_exec_time_95th_per = digest_avg_us[int(len(digest_avg_us) * 0.95)]
+
+        schema_totals = defaultdict(lambda: [0, 0])
+        for (schema_name, _), (count, timer_wait) in digests.iteritems():
+            if schema_name is not None:
+                schema_totals[schema_name][0] += count
+                schema_totals[schema_name][1] += timer_wait
+
+        schema_query_avg_run_time = {}
+        for schema_name, (count, timer_wait) in schema_totals.iteritems():
+            if count:
+                # set the tag as the dictionary key
+                schema_query_avg_run_time["schema:{0}".format(schema_name)] = \
+                    long(round(float(timer_wait) / count / 1000000))
+
+        return query_exec_time_95th_per, schema_query_avg_run_time
+
+    def _get_schema_sizes(self, db, options):
+        # Schema sizes are refreshed every `schema_size_refresh_interval` seconds,
+        # the last ones are reported in between
+        host_key = self._get_host_key()
+        schema_size, next_refresh = self._schema_sizes.get(host_key, ({}, 0))
+        now = time.time()
+        if now < next_refresh:
+            return schema_size
 
-                    # set the tag as the dictionary key
-                    schema_query_avg_run_time["schema:{0}".format(schema_name)] = avg_us
+        refresh_interval = float(options.get('schema_size_refresh_interval', DEFAULT_SCHEMA_SIZE_REFRESH_INTERVAL))
+        timeout = float(options.get('schema_size_timeout', DEFAULT_SCHEMA_SIZE_TIMEOUT))
+        hint = "/*+ MAX_EXECUTION_TIME({0}) */".format(int(timeout * 1000)) if timeout > 0 else ""
 
-                return schema_query_avg_run_time
-        except (pymysql.err.InternalError, pymysql.err.OperationalError) as e:
-            self.warning("Avg exec time performance metrics unavailable at this time: %s" % str(e))
-            return None
+        if _is_affirmative(options.get('schema_size_per_schema', False)):
+            schema_size = self._query_size_of_each_schema(db, hint, schema_size)
+        else:
+            schema_size = self._query_size_per_schema(db, hint) or schema_size
 
-    def _query_size_per_schema(self, db):
-        # Fetches the avg query execution time per schema and returns the
-        # value in microseconds
+        self._schema_sizes[host_key] = (schema_size, now + refresh_interval)
+        return schema_size
 
-        sql_query_schema_size = """
-        SELECT   table_schema,
-                 SUM(data_length+index_length)/1024/1024 AS total_mb
-                 FROM     information_schema.tables
-                 GROUP BY table_schema;
-        """
+    def _query_size_per_schema(self, db, hint=""):
+        # Fetches the size of each schema and returns the value in megabytes
 
         try:
             with closing(db.cursor()) as cursor:
-                cursor.execute(sql_query_schema_size)
+                cursor.execute(SCHEMA_SIZE_QUERY.format(hint=hint))
 
                 if cursor.rowcount < 1:
                     self.warning("Failed to fetch records from the information schema 'tables' table.")
@@ -1280,10 +1533,45 @@ class MySql(AgentCheck):
 
                 return schema_size
         except (pymysql.err.InternalError, pymysql.err.OperationalError) as e:
-            self.warning("Avg exec time performance metrics unavailable at this time: %s" % str(e))
+            self.warning("Schema size metrics unavailable at this time: %s" % str(e))
 
         return {}
 
+    def _query_size_of_each_schema(self, db, hint, previous_schema_size):
+        # Fetches the size of the schemas one at a time, so that a schema whose
+        # query times out keeps its previous size, and returns the values in megabytes
+        try:
+            with closing(db.cursor()) as cursor:
+                cursor.execute(SCHEMA_LIST_QUERY)
+                schema_names = [str(row[0]) for row in cursor.fetchall()]
+        except (pymysql.err.InternalError, pymysql.err.OperationalError) as e:
+            self.warning("Schema size metrics unavailable at this time: %s" % str(e))
+            return previous_schema_size
+
+        schema_size = {}
+        failed_schemas = []
+        for schema_name in schema_names:
+            tag = "schema:{0}".format(schema_name)
+            try:
+                with closing(db.cursor()) as cursor:
+                    cursor.execute(SINGLE_SCHEMA_SIZE_QUERY.format(hint=hint), (schema_name,))
+                    row = cursor.fetchone()
+            except (pymysql.err.InternalError, pymysql.err.OperationalError) as e:
+                self.log.debug("Unable to fetch the size of schema %s: %s", schema_name, e)
+                failed_schemas.append(schema_name)
+                if tag in previous_schema_size:
+                    schema_size[tag] = previous_schema_size[tag]
+                continue
+
+            # Schemas without tables have no size
+            if row is not None and row[0] is not None:
+                schema_size[tag] = long(row[0])
+
+        if failed_schemas:
+            self.warning("Size unavailable at this time for schemas: %s" % ", ".join(failed_schemas))
+
+        return schema_size
+
     def _compute_synthetic_results(self, results):
         if ('Qcache_hits' in results) and ('Qcache_inserts' in results) and ('Qcache_not_cached' in results):
             if not int(results['Qcache_hits']):
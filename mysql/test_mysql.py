@@ -3,13 +3,21 @@
 # Licensed under Simplified BSD License (see LICENSE)
 
 # stdlib
+import os
+import time
+
+# 3p
+import mock
 from nose.plugins.attrib import attr
+import pymysql
 
 # project
 from checks import AgentCheck
 from utils.platform import Platform
 from tests.checks.common import AgentCheckTest
 
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'ci', 'fixtures')
+
 
 @attr(requires='mysql')
 class TestMySql(AgentCheckTest):
@@ -407,3 +415,269 @@ class TestMySql(AgentCheckTest):
         self.assertServiceCheck('mysql.can_connect', status=AgentCheck.CRITICAL,
                                 tags=self.SC_FAILURE_TAGS, count=1)
         self.coverage_report()
+
+    def test_connection_reuse(self):
+        """
+        The connection of an instance is kept across runs, and pinged before it's used
+        """
+        instance = self.MYSQL_MINIMAL_CONFIG[0]
+        self.load_check({'instances': [instance]})
+
+        def connect(instance, max_idle=300):
+            host, port, user, password, mysql_sock, defaults_file, tags, _, _, ssl, connect_timeout = \
+                self.check._get_config(instance)
+            with self.check._connect(host, port, mysql_sock, user, password, defaults_file,
+                                     ssl, connect_timeout, tags, max_idle) as db:
+                return db
+
+        with mock.patch('pymysql.connect') as connect_mock:
+            db = connect_mock.return_value
+            db.server_thread_id = (1,)
+
+            self.assertTrue(connect(instance) is db)
+            self.assertTrue(connect(instance) is db)
+            self.assertEquals(connect_mock.call_count, 1)
+            db.ping.assert_called_once_with(reconnect=True)
+            self.metrics = self.check.get_metrics()
+            self.assertMetric('datadog.agent.mysql.connection.handshake_time', count=1)
+            self.assertMetric('datadog.agent.mysql.connection.reconnects', count=0)
+
+            # The server closed the connection, the ping opens a new one
+            def ping(reconnect=True):
+                db.server_thread_id = (2,)
+            db.ping.side_effect = ping
+            self.assertTrue(connect(instance) is db)
+            self.assertEquals(connect_mock.call_count, 1)
+            self.metrics = self.check.get_metrics()
+            self.assertMetric('datadog.agent.mysql.connection.reconnects', value=1, count=1)
+            self.assertMetric('datadog.agent.mysql.connection.handshake_time', count=1)
+
+            # Dropped when the ping fails, opened again on the next run
+            db.ping.side_effect = pymysql.err.OperationalError(2003, "Can't connect to MySQL server")
+            self.assertRaises(pymysql.err.OperationalError, connect, instance)
+            self.assertEquals(self.check._connections, {})
+            db.close.assert_called_once_with()
+            self.service_checks = self.check.get_service_checks()
+            self.assertServiceCheck('mysql.can_connect', status=AgentCheck.CRITICAL, count=1)
+
+            db.ping.side_effect = None
+            self.assertTrue(connect(instance) is db)
+            self.assertEquals(connect_mock.call_count, 2)
+
+            # Closed when the instance didn't run for longer than its max idle time
+            connect(instance, max_idle=0.1)
+            self.assertEquals(len(self.check._connections), 1)
+            time.sleep(0.2)
+            self.check._close_idle_connections()
+            self.assertEquals(self.check._connections, {})
+
+            # Or right away without a max idle time
+            connect(instance, max_idle=0)
+            self.assertEquals(self.check._connections, {})
+
+    def test_autocommit(self):
+        """
+        Connections are opened in autocommit mode, so that no snapshot is held across runs
+        """
+        self.load_check({'instances': self.MYSQL_MINIMAL_CONFIG})
+        configs = [
+            ('localhost', 13306, '', '', {}),
+            ('localhost', 0, '', '', {}),
+            ('localhost', 0, '/var/run/mysqld/mysqld.sock', '', {}),
+            ('', 0, '', '/etc/mysql/my.cnf', {}),
+        ]
+        with mock.patch('pymysql.connect') as connect_mock:
+            for host, port, mysql_sock, defaults_file, ssl in configs:
+                self.check._open_connection(host, port, mysql_sock, 'dog', 'dog', defaults_file, ssl, 10)
+                self.assertTrue(connect_mock.call_args[1]['autocommit'])
+            self.assertEquals(connect_mock.call_count, len(configs))
+
+    def test_stats_batch(self):
+        """
+        Global status, variables and InnoDB availability are fetched in a single round trip
+        """
+        instance = self.MYSQL_MINIMAL_CONFIG[0]
+        self.load_check({'instances': [instance]})
+        self.check._get_config(instance)
+
+        db = mock.Mock()
+        cursor = db.cursor.return_value
+        cursor.fetchall.side_effect = [
+            [('Uptime', '10'), ('Threads_connected', '3')],
+            [('max_connections', '151')],
+        ]
+        cursor.rowcount = 1
+
+        results, innodb_enabled = self.check._get_stats(db)
+        self.assertEquals(results, {'Uptime': '10', 'Threads_connected': '3', 'max_connections': '151'})
+        self.assertTrue(innodb_enabled)
+        self.assertEquals(cursor.execute.call_count, 1)
+        self.assertEquals(cursor.nextset.call_count, 2)
+
+        # One statement at a time when the server doesn't support batches
+        cursor.reset_mock()
+        cursor.execute.side_effect = [
+            pymysql.err.ProgrammingError(1064, "You have an error in your SQL syntax"), None, None, None
+        ]
+        cursor.fetchall.side_effect = [[('Uptime', '20')], [('max_connections', '151')]]
+        cursor.rowcount = 0
+
+        results, innodb_enabled = self.check._get_stats(db)
+        self.assertEquals(results, {'Uptime': '20', 'max_connections': '151'})
+        self.assertFalse(innodb_enabled)
+        self.assertEquals(cursor.execute.call_count, 4)
+
+        cursor.reset_mock()
+        cursor.execute.side_effect = None
+        cursor.fetchall.side_effect = [[('Uptime', '30')], [('max_connections', '151')]]
+        self.check._get_stats(db)
+        self.assertEquals(cursor.execute.call_count, 3)
+
+    def test_metric_map(self):
+        """
+        Metric maps are built once for each set of enabled groups, without changing the defaults
+        """
+        self.load_check({'instances': self.MYSQL_MINIMAL_CONFIG})
+
+        metrics = self.check._get_metric_map(extra_status=True, galera=True)
+        self.assertTrue(self.check._get_metric_map(extra_status=True, galera=True) is metrics)
+        self.assertEquals(metrics['wsrep_cluster_size'], ('mysql.galera.wsrep_cluster_size', 'gauge'))
+        self.assertEquals(metrics['Qcache_utilization'], ('mysql.performance.qcache.utilization', 'gauge'))
+
+        default_metrics = self.check._get_metric_map()
+        self.assertFalse(any(name in default_metrics for name in ('Binlog_cache_disk_use', 'wsrep_cluster_size')))
+
+    def test_digest_stats(self):
+        """
+        Statement digests are read incrementally, the percentile covers the executions since the previous run
+        """
+        instance = self.MYSQL_MINIMAL_CONFIG[0]
+        self.load_check({'instances': [instance]})
+        self.check._get_config(instance)
+
+        db = mock.Mock()
+        cursor = db.cursor.return_value
+        cursor.fetchall.return_value = [
+            ('testdb', 'a', 10, 10 * 10 ** 6, '2016-11-08 10:00:00'),
+            ('testdb', 'b', 10, 30 * 10 ** 6, '2016-11-08 10:00:05'),
+        ]
+        self.assertEquals(self.check._get_digest_stats(db), (None, {'schema:testdb': 2}))
+        self.assertEquals(cursor.execute.call_args[0][1], ('1970-01-01 00:00:00',))
+
+        cursor.fetchall.return_value = [
+            ('testdb', 'b', 10, 30 * 10 ** 6, '2016-11-08 10:00:05'),
+            ('testdb', 'a', 20, 60 * 10 ** 6, '2016-11-08 10:00:12'),
+            (None, 'c', 1, 7 * 10 ** 6, '2016-11-08 10:00:14'),
+        ]
+        self.assertEquals(self.check._get_digest_stats(db), (7, {'schema:testdb': 3}))
+        self.assertEquals(cursor.execute.call_args[0][1], ('2016-11-08 10:00:05',))
+
+        # Truncated summary
+        cursor.fetchall.return_value = [
+            ('testdb', 'a', 2, 8 * 10 ** 6, '2016-11-08 10:01:02'),
+        ]
+        self.assertEquals(self.check._get_digest_stats(db), (4, {'schema:testdb': 4}))
+        self.assertEquals(cursor.execute.call_args[0][1], ('2016-11-08 10:00:14',))
+
+    def test_schema_sizes(self):
+        """
+        Schema sizes are cached between refreshes, and a schema that times out keeps its previous size
+        """
+        instance = self.MYSQL_MINIMAL_CONFIG[0]
+        self.load_check({'instances': [instance]})
+        self.check._get_config(instance)
+
+        db = mock.Mock()
+        cursor = db.cursor.return_value
+        cursor.rowcount = 2
+        cursor.fetchall.return_value = [('testdb', 12), ('mysql', 1)]
+        options = {'schema_size_refresh_interval': 60, 'schema_size_timeout': 5}
+
+        self.assertEquals(self.check._get_schema_sizes(db, options), {'schema:testdb': 12, 'schema:mysql': 1})
+        self.assertTrue('MAX_EXECUTION_TIME(5000)' in cursor.execute.call_args[0][0])
+        self.assertEquals(self.check._get_schema_sizes(db, options), {'schema:testdb': 12, 'schema:mysql': 1})
+        self.assertEquals(cursor.execute.call_count, 1)
+
+        # One query per schema
+        options = {'schema_size_per_schema': True, 'schema_size_timeout': 0}
+        cursor.fetchall.return_value = [('testdb',), ('mysql',), ('empty',)]
+        cursor.fetchone.side_effect = [(13,), (None,)]
+        cursor.execute.side_effect = [
+            None, None, pymysql.err.OperationalError(3024, "maximum statement execution time exceeded"), None
+        ]
+        self.check._schema_sizes[self.check._get_host_key()] = ({'schema:mysql': 1}, 0)
+        self.assertEquals(self.check._get_schema_sizes(db, options), {'schema:testdb': 13, 'schema:mysql': 1})
+        self.assertFalse('MAX_EXECUTION_TIME' in cursor.execute.call_args[0][0])
+
+
+class TestMySqlInnodbStatus(AgentCheckTest):
+    CHECK_NAME = 'mysql'
+
+    INNODB_STATUS = os.path.join(FIXTURE_DIR, 'innodb_status.txt')
+
+    def setUp(self):
+        self.load_check({'instances': [{'server': 'localhost', 'user': 'dog', 'pass': 'dog'}]})
+        with open(self.INNODB_STATUS) as f:
+            self.innodb_status = f.read()
+
+    def test_innodb_status(self):
+        results = self.check._parse_innodb_status(self.innodb_status)
+
+        self.assertEquals(results['Innodb_mutex_spin_waits'], '7987212')
+        self.assertEquals(results['Innodb_s_lock_os_waits'], '1117207')
+        self.assertEquals(results['Innodb_x_lock_spin_rounds'], '34155340')
+        self.assertEquals(results['Innodb_semaphore_waits'], '2')
+        self.assertEquals(results['Innodb_semaphore_wait_time'], '3000')
+        self.assertEquals(results['Innodb_history_list_length'], '1032')
+        self.assertEquals(results['Innodb_current_transactions'], '4')
+        self.assertEquals(results['Innodb_active_transactions'], '2')
+        self.assertEquals(results['Innodb_locked_transactions'], '1')
+        self.assertEquals(results['Innodb_lock_structs'], '5')
+        self.assertEquals(results['Innodb_row_lock_time'], '32000')
+        self.assertEquals(results['Innodb_pending_normal_aio_writes'], '2')
+        self.assertEquals(results['Innodb_pending_log_flushes'], '1')
+        self.assertEquals(results['Innodb_os_file_fsyncs'], '947800')
+        self.assertEquals(results['Innodb_ibuf_merges'], '338')
+        self.assertEquals(results['Innodb_ibuf_merged'], '1054081')
+        self.assertEquals(results['Innodb_hash_index_cells_total'], '4425293')
+        self.assertEquals(results['Innodb_log_writes'], '520835887')
+        self.assertEquals(results['Innodb_checkpoint_age'], '14217241')
+        self.assertEquals(results['Innodb_mem_total'], '29642194944')
+        self.assertEquals(results['Innodb_pages_written'], '21705836')
+        self.assertEquals(results['Innodb_rows_read'], '454561562')
+        self.assertEquals(results['Innodb_read_views'], '1')
+
+        # The deadlock and the individual buffer pools are not counted again
+        self.assertEquals(results['Innodb_tables_in_use'], '1')
+        self.assertEquals(results['Innodb_buffer_pool_pages_total'], '1769471')
+        self.assertEquals(results['Innodb_buffer_pool_pages_dirty'], '160602')
+
+
+@attr(requires='mysql')
+class MySqlInnodbStatusBenchmark(AgentCheckTest):
+    CHECK_NAME = 'mysql'
+
+    INNODB_STATUS = os.path.join(FIXTURE_DIR, 'innodb_status.txt')
+    # Size of the replayed status of a server with thousands of open transactions
+    LARGE_STATUS_SIZE = 5 * 1024 * 1024
+
+    def setUp(self):
+        self.load_check({'instances': [{'server': 'localhost', 'user': 'dog', 'pass': 'dog'}]})
+        with open(self.INNODB_STATUS) as f:
+            self.innodb_status = f.read()
+
+    def test_large_innodb_status(self):
+        """
+        Replay the recorded transactions up to a 5MB status
+        """
+        head, tail = self.innodb_status.split('--------\nFILE I/O\n', 1)
+        start = head.index('---TRANSACTION 1178477631')
+        transactions = head[start:]
+        replay_count = self.LARGE_STATUS_SIZE / len(transactions)
+        innodb_status = ''.join([head[:start], transactions * replay_count, '--------\nFILE I/O\n', tail])
+
+        results = self.check._parse_innodb_status(innodb_status)
+        self.assertEquals(results['Innodb_current_transactions'], str(2 + 2 * replay_count))
+        self.assertEquals(results['Innodb_locked_transactions'], str(replay_count))
+        self.assertEquals(results['Innodb_row_lock_time'], str(32000 * replay_count))
+        self.assertEquals(results['Innodb_rows_read'], '454561562')
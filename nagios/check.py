@@ -53,6 +53,15 @@ EVENT_FIELDS = {
 RE_LINE_REG = re.compile('^\[(\d+)\] EXTERNAL COMMAND: (\w+);(.*)$')
 RE_LINE_EXT = re.compile('^\[(\d+)\] ([^:]+): (.*)$')
 
+# Number of perfdata lines buffered before they're parsed at once
+PERFDATA_CHUNK_SIZE = 5000
+
+# Memoized metric names and tags are forgotten past this many entries
+PERFDATA_CACHE_SIZE = 100000
+
+# Leading value of a perfdata pair, once the label is removed
+RE_PERFDATA_VALUE = re.compile(r'[-0-9.]*')
+
 
 class Nagios(AgentCheck):
 
@@ -321,6 +330,17 @@ class NagiosPerfDataTailer(NagiosTailer):
         r"(;(?P<max>[-0-9.]*))?",
     ]))
 
+    def __init__(self, *args, **kwargs):
+        # Lines read since the last chunk was parsed
+        self._lines = []
+        # (service, label) -> (metric name, device name), None when the label isn't valid
+        self._metric_names = {}
+        # unit and thresholds of a pair -> tags
+        self._tags = {}
+        # Last value of each gauge context since the last submission
+        self._gauges = {}
+        super(NagiosPerfDataTailer, self).__init__(*args, **kwargs)
+
     @staticmethod
     def underscorize(s):
         return s.replace(' ', '_').lower()
@@ -328,52 +348,129 @@ class NagiosPerfDataTailer(NagiosTailer):
     def _get_metric_prefix(self, data):
         raise NotImplementedError()
 
+    def compile_file_template(self, file_template):
+        super(NagiosPerfDataTailer, self).compile_file_template(file_template)
+        try:
+            # Same as `line_pattern`, to match every line of a chunk at once.
+            # Fields are matched lazily up to the end of the line, greedy ones
+            # backtrack over each field separator of the line
+            regex = re.sub(r'[[\]*]', r'.', file_template)
+            regex = re.sub(r'\$([^\$]*)\$', r'(?P<\1>[^\$\\n]*?)', regex)
+            self.chunk_pattern = re.compile('^' + regex + '$', re.M)
+        except Exception as e:
+            raise InvalidDataTemplate("%s (%s)" % (file_template, e))
+
+    def check(self):
+        super(NagiosPerfDataTailer, self).check()
+        self._parse_lines()
+        self._submit_gauges()
+
     def _parse_line(self, line):
-        matched = self.line_pattern.match(line)
-        if matched:
-            self.log.debug("Matching line found %s" % line)
+        self._lines.append(line)
+        if len(self._lines) >= PERFDATA_CHUNK_SIZE:
+            self._parse_lines()
+
+    def _parse_lines(self):
+        """
+        Parse the lines buffered since the last chunk with a single pass of the template
+        """
+        if not self._lines:
+            return
+        chunk = '\n'.join(self._lines)
+        self._line_parsed += len(self._lines)
+        self._lines = []
+
+        if len(self._metric_names) > PERFDATA_CACHE_SIZE:
+            self._metric_names = {}
+        if len(self._tags) > PERFDATA_CACHE_SIZE:
+            self._tags = {}
+
+        groups = self.chunk_pattern.groupindex
+        if self.perfdata_field not in groups:
+            return
+        has_timestamp = 'TIMET' in groups
+        has_host_name = 'HOSTNAME' in groups
+
+        last_timet = timestamp = None
+        for matched in self.chunk_pattern.finditer(chunk):
             data = matched.groupdict()
-            metric_prefix = self._get_metric_prefix(data)
+            service = data.get('SERVICEDESC')
+
+            if has_timestamp:
+                timet = data['TIMET']
+                # Lines are written in order, most of them share the timestamp of the previous one
+                if timet != last_timet:
+                    timestamp = (int(float(timet)) / self._freq) * self._freq
+                    last_timet = timet
+            host_name = data['HOSTNAME'] if has_host_name else self.hostname
 
             # Parse the prefdata values, which are a space-delimited list of:
             #   'label'=value[UOM];[warn];[crit];[min];[max]
-            perf_data = data.get(self.perfdata_field, '').split(' ')
-            for pair in perf_data:
-                pair_match = self.pair_pattern.match(pair)
-                if not pair_match:
+            for pair in data[self.perfdata_field].split(' '):
+                label, _, value = pair.partition('=')
+                raw_value = RE_PERFDATA_VALUE.match(value).group()
+                try:
+                    value, suffix = float(raw_value), value[len(raw_value):]
+                except ValueError:
                     continue
-                else:
-                    pair_data = pair_match.groupdict()
-
-                label = pair_data['label']
-                timestamp = data.get('TIMET', None)
-                if timestamp is not None:
-                    timestamp = (int(float(timestamp)) / self._freq) * self._freq
-                value = float(pair_data['value'])
-                device_name = None
-
-                if '/' in label:
-                    # Special case: if the label begins
-                    # with a /, treat the label as the device
-                    # and use the metric prefix as the metric name
-                    metric = '.'.join(metric_prefix)
-                    device_name = label
-
-                else:
-                    # Otherwise, append the label to the metric prefix
-                    # and use that as the metric name
-                    metric = '.'.join(metric_prefix + [label])
-
-                host_name = data.get('HOSTNAME', self.hostname)
-
-                optional_keys = ['unit', 'warn', 'crit', 'min', 'max']
-                tags = []
-                for key in optional_keys:
-                    attr_val = pair_data.get(key, None)
-                    if attr_val is not None and attr_val != '':
-                        tags.append("{0}:{1}".format(key, attr_val))
-
-                self._gauge(metric, value, tags, host_name, device_name, timestamp)
+
+                key = (service, label)
+                if key not in self._metric_names:
+                    self._metric_names[key] = self._get_metric_name(self._get_metric_prefix(data), label)
+                names = self._metric_names[key]
+                if names is None:
+                    # Not a valid label
+                    continue
+                metric, device_name = names
+
+                tags = self._tags.get(suffix)
+                if tags is None:
+                    tags = self._tags[suffix] = self._get_tags(suffix)
+
+                self._gauges[(metric, tags[1], host_name, device_name)] = (value, tags[0], timestamp)
+
+    def _get_tags(self, suffix):
+        """
+        Tags of the unit and thresholds of a pair, with the tuple of the tags
+        """
+        pair_match = self.pair_pattern.match('x=0' + suffix)
+        pair_data = pair_match.groupdict()
+
+        optional_keys = ['unit', 'warn', 'crit', 'min', 'max']
+        tags = []
+        for key in optional_keys:
+            attr_val = pair_data.get(key, None)
+            if attr_val is not None and attr_val != '':
+                tags.append("{0}:{1}".format(key, attr_val))
+        return tags, tuple(tags)
+
+    def _get_metric_name(self, metric_prefix, label):
+        """
+        Metric name and device name of a pair, None if the label isn't valid
+        """
+        pair_match = self.pair_pattern.match(label + '=0')
+        if not pair_match:
+            return None
+        label = pair_match.group('label')
+
+        if '/' in label:
+            # Special case: if the label begins
+            # with a /, treat the label as the device
+            # and use the metric prefix as the metric name
+            return '.'.join(metric_prefix), label
+
+        # Otherwise, append the label to the metric prefix
+        # and use that as the metric name
+        return '.'.join(metric_prefix + [label]), None
+
+    def _submit_gauges(self):
+        """
+        Submit the last value of each gauge since the last submission, the
+        aggregator would only keep that one anyway
+        """
+        gauges, self._gauges = self._gauges, {}
+        for (metric, _, host_name, device_name), (value, tags, timestamp) in gauges.iteritems():
+            self._gauge(metric, value, tags, host_name, device_name, timestamp)
 
 
 class NagiosHostPerfDataTailer(NagiosPerfDataTailer):
@@ -404,3 +404,62 @@ class PerfDataTailerTestCase(NagiosTestCase):
             self.compare_metric(actual, expected)
 
         self.coverage_report()
+
+    def test_service_perfdata_invalid_values(self):
+        """
+        Skip the PerfData values that aren't numbers and keep tailing the file
+        """
+        self.log_file = tempfile.NamedTemporaryFile()
+        config = self.get_config(
+            '\n'.join(["service_perfdata_file=%s" % self.log_file.name, "service_perfdata_file_template=%s" % self.NAGIOS_TEST_SVC_TEMPLATE]),
+            service_perf=True)
+        self.run_check(config)
+
+        self._write_log([
+            "[SERVICEPERFDATA]\t%s\tmyhost3\tPing\t0.1\t0.1\tPING OK\trta=- pl=1.2.3 ok=5%%;80;100" % self.POINT_TIME,
+            "[SERVICEPERFDATA]\t%s\tmyhost3\tPing\t0.1\t0.1\tPING OK\trta=0.4ms pl=0%%" % self.POINT_TIME,
+        ])
+        self.run_check(config)
+
+        self.assertMetric('nagios.ping.ok', value=5.0, tags=['unit:%', 'warn:80', 'crit:100'], count=1)
+        self.assertMetric('nagios.ping.rta', value=0.4, tags=['unit:ms'], count=1)
+        self.assertMetric('nagios.ping.pl', value=0.0, tags=['unit:%'], count=1)
+
+        self.coverage_report()
+
+
+@attr('unix')
+class PerfDataTailerLargeFileTestCase(NagiosTestCase):
+    REPLAY_COUNT = 10000
+
+    def test_replay_service_perfdata(self):
+        """
+        Replay the recorded service PerfData over many hosts, and time the check
+        """
+        perfdata_file = tempfile.NamedTemporaryFile()
+        config = self.get_config(
+            '\n'.join(["service_perfdata_file=%s" % perfdata_file.name, "service_perfdata_file_template=%s" % self.NAGIOS_TEST_SVC_TEMPLATE]),
+            service_perf=True)
+        self.run_check(config)
+
+        with open(self.NAGIOS_TEST_SVC, "r") as f:
+            recorded = [line.rstrip('\n').split('\t') for line in f if line.strip()]
+
+        lines = 0
+        for i in xrange(self.REPLAY_COUNT):
+            for fields in recorded:
+                fields = list(fields)
+                fields[2] = "host%d" % (i % 100)
+                perfdata_file.write('\t'.join(fields) + '\n')
+                lines += 1
+        perfdata_file.flush()
+
+        start = time.time()
+        self.run_check(config)
+        duration = time.time() - start
+
+        print "Parsed %s perfdata lines in %.2fs" % (lines, duration)
+
+        # Only the last value of each gauge is submitted
+        self.assertMetric('nagios.current_users.users', hostname='host0', count=1)
+        self.assertEquals(len(set(m[3]['hostname'] for m in self.metrics)), 100)
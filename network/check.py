@@ -6,8 +6,11 @@
 Collects network metrics.
 """
 # stdlib
+import io
+import os
 import re
 import socket
+import struct
 from collections import defaultdict
 
 # project
@@ -31,6 +34,147 @@ SOLARIS_TCP_METRICS = [
     (re.compile("\s*tcpInSegs\s*=\s*(\d+)\s*"), 'system.net.tcp.out_segs')
 ]
 
+# TCP states of the kernel, as numbered in the `st` column of /proc/net/tcp and
+# in the sock_diag messages, with their `netstat` names
+LINUX_TCP_STATES = {
+    1: "ESTABLISHED",
+    2: "SYN_SENT",
+    3: "SYN_RECV",
+    4: "FIN_WAIT1",
+    5: "FIN_WAIT2",
+    6: "TIME_WAIT",
+    7: "CLOSE",
+    8: "CLOSE_WAIT",
+    9: "LAST_ACK",
+    10: "LISTEN",
+    11: "CLOSING",
+}
+
+# Sources of the connection states: (protocol, address family, IP protocol, /proc/net file)
+LINUX_CX_STATE_SOURCES = [
+    ('tcp4', socket.AF_INET, socket.IPPROTO_TCP, 'tcp'),
+    ('tcp6', socket.AF_INET6, socket.IPPROTO_TCP, 'tcp6'),
+    ('udp4', socket.AF_INET, socket.IPPROTO_UDP, 'udp'),
+    ('udp6', socket.AF_INET6, socket.IPPROTO_UDP, 'udp6'),
+]
+
+# Netlink sock_diag, see linux/netlink.h, linux/sock_diag.h and linux/inet_diag.h
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 0x2
+NLMSG_DONE = 0x3
+# struct nlmsghdr: length, type, flags, sequence number, port id
+NLMSG_HEADER = struct.Struct('=IHHII')
+# struct inet_diag_req_v2: family, protocol, extensions, padding, states, and a zeroed inet_diag_sockid
+INET_DIAG_REQUEST = struct.Struct('=BBBBI48x')
+INET_DIAG_ALL_STATES = 0xffffffff
+# Offset of the state in a message, past the nlmsghdr and the family of the inet_diag_msg
+INET_DIAG_STATE_OFFSET = NLMSG_HEADER.size + 1
+NETLINK_BUFFER_SIZE = 65536
+
+PROCFS_BUFFER_SIZE = 1 << 20
+
+# Initial size of the buffer /proc/net/{dev,snmp,netstat} are read into, grown as needed
+PROC_NET_BUFFER_SIZE = 64 * 1024
+
+# Columns of /proc/net/dev that are submitted: received bytes, packets, errs and drop,
+# then sent bytes, packets, errs and drop
+PROC_NET_DEV_RE = re.compile(
+    r'^ *([^:\s]+): *(\d+) +(\d+) +(\d+) +(\d+) +\d+ +\d+ +\d+ +\d+ +(\d+) +(\d+) +(\d+) +(\d+)', re.M
+)
+
+# Pairs of lines of /proc/net/snmp and /proc/net/netstat, with the names then the values of the counters
+# Tcp: RtoAlgorithm RtoMin RtoMax MaxConn ...
+# Tcp: 1 200 120000 -1 ...
+PROC_NET_COUNTERS_RE = re.compile(r'^(\w+): ([^\n]*)\n\1: ([^\n]*)$', re.M)
+
+# Counters submitted by file of /proc/net and line prefix
+PROC_NET_COUNTERS_METRICS = {
+    'snmp': {
+        'Tcp': {
+            'RetransSegs': 'system.net.tcp.retrans_segs',
+            'InSegs': 'system.net.tcp.in_segs',
+            'OutSegs': 'system.net.tcp.out_segs',
+        },
+        'Udp': {
+            'InDatagrams': 'system.net.udp.in_datagrams',
+            'NoPorts': 'system.net.udp.no_ports',
+            'InErrors': 'system.net.udp.in_errors',
+            'OutDatagrams': 'system.net.udp.out_datagrams',
+            'RcvbufErrors': 'system.net.udp.rcv_buf_errors',
+            'SndbufErrors': 'system.net.udp.snd_buf_errors',
+            'InCsumErrors': 'system.net.udp.in_csum_errors',
+        },
+    },
+    'netstat': {
+        'TcpExt': {
+            'ListenOverflows': 'system.net.tcp.listen_overflows',
+            'ListenDrops': 'system.net.tcp.listen_drops',
+            'TCPBacklogDrop': 'system.net.tcp.backlog_drops',
+            'TCPRetransFail': 'system.net.tcp.failed_retransmits',
+        },
+    },
+}
+
+# Interface exclusion decisions are forgotten past this many interfaces, containers
+# come and go with their own veth interfaces
+IFACE_EXCLUSION_CACHE_SIZE = 10000
+
+
+def netlink_cx_state_counts(family, protocol, buf):
+    """
+    Count the sockets of an address family and IP protocol by state with a
+    NETLINK_SOCK_DIAG dump. `buf` is a bytearray the messages are received into.
+    Returns a dict: kernel state -> number of sockets
+    """
+    counts = defaultdict(int)
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_SOCK_DIAG)
+    try:
+        sock.bind((0, 0))
+        request = INET_DIAG_REQUEST.pack(family, protocol, 0, 0, INET_DIAG_ALL_STATES)
+        sock.send(NLMSG_HEADER.pack(NLMSG_HEADER.size + len(request), SOCK_DIAG_BY_FAMILY,
+                                    NLM_F_REQUEST | NLM_F_DUMP, 1, 0) + request)
+
+        while True:
+            size = sock.recv_into(buf)
+            offset = 0
+            while offset < size:
+                msg_len, msg_type = struct.unpack_from('=IH', buf, offset)
+                if msg_type == NLMSG_DONE:
+                    return counts
+                if msg_type == NLMSG_ERROR:
+                    error = -struct.unpack_from('=i', buf, offset + NLMSG_HEADER.size)[0]
+                    raise socket.error(error, os.strerror(error))
+                counts[buf[offset + INET_DIAG_STATE_OFFSET]] += 1
+                # Messages are aligned on 4 bytes
+                offset += (msg_len + 3) & ~3
+    finally:
+        sock.close()
+
+
+def procfs_cx_state_counts(path):
+    """
+    Count the sockets listed in a /proc/net/{tcp,tcp6,udp,udp6} file by state,
+    only looking at the `st` column of each line.
+    Returns a dict: kernel state -> number of sockets
+    """
+    #   sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode
+    #    0: 0100007F:0CEA 00000000:0000 0A 00000000:00000000 00:00000000 00000000   112        0 17007 1 ...
+    counts = defaultdict(int)
+    with open(path, 'r', PROCFS_BUFFER_SIZE) as proc:
+        proc.readline()
+        state_offset = None
+        for line in proc:
+            sl_end = line.find(':')
+            if state_offset is None:
+                # The addresses have the same width on every line, the `sl` column doesn't
+                state_offset = line.index(' ', line.index(' ', sl_end + 2) + 1) + 1 - sl_end
+            counts[line[sl_end + state_offset:sl_end + state_offset + 2]] += 1
+
+    return dict((int(state, 16), count) for state, count in counts.iteritems())
+
 
 class Network(AgentCheck):
 
@@ -51,21 +195,39 @@ class Network(AgentCheck):
         if instances is not None and len(instances) > 1:
             raise Exception("Network check only supports one configured instance.")
 
+        # Sources for which sock_diag isn't available, e.g. the udp_diag module isn't loaded
+        self._netlink_unsupported = set()
+        self._netlink_buffer = None
+
+        self._proc_net_buffer = bytearray(PROC_NET_BUFFER_SIZE)
+        # Per line of names of counters: indexes of the counters submitted, with their metric
+        self._proc_net_columns = {}
+
+        self._excluded_ifaces = []
+        self._exclude_iface_re = None
+        self._iface_filters = None
+        # Interface name -> whether it's excluded
+        self._iface_exclusions = {}
+
     def check(self, instance):
         if instance is None:
             instance = {}
 
-        self._excluded_ifaces = instance.get('excluded_interfaces', [])
         self._collect_cx_state = instance.get('collect_connection_state', False)
 
         # This decides whether we should split or combine connection states, along with a few other things
         self._setup_metrics(instance)
 
-        self._exclude_iface_re = None
+        excluded_ifaces = instance.get('excluded_interfaces', [])
         exclude_re = instance.get('excluded_interface_re', None)
-        if exclude_re:
-            self.log.debug("Excluding network devices matching: %s" % exclude_re)
-            self._exclude_iface_re = re.compile(exclude_re)
+        if self._iface_filters != (excluded_ifaces, exclude_re):
+            self._iface_filters = (excluded_ifaces, exclude_re)
+            self._excluded_ifaces = excluded_ifaces
+            self._exclude_iface_re = None
+            if exclude_re:
+                self.log.debug("Excluding network devices matching: %s" % exclude_re)
+                self._exclude_iface_re = re.compile(exclude_re)
+            self._iface_exclusions = {}
 
         if Platform.is_linux():
             self._check_linux(instance)
@@ -213,8 +375,18 @@ class Network(AgentCheck):
                 }
             }
 
+    def _is_excluded_iface(self, iface):
+        excluded = self._iface_exclusions.get(iface)
+        if excluded is None:
+            excluded = iface in self._excluded_ifaces or \
+                bool(self._exclude_iface_re and self._exclude_iface_re.match(iface))
+            if len(self._iface_exclusions) >= IFACE_EXCLUSION_CACHE_SIZE:
+                self._iface_exclusions = {}
+            self._iface_exclusions[iface] = excluded
+        return excluded
+
     def _submit_devicemetrics(self, iface, vals_by_metric):
-        if iface in self._excluded_ifaces or (self._exclude_iface_re and self._exclude_iface_re.match(iface)):
+        if self._is_excluded_iface(iface):
             # Skip this network interface.
             return False
 
@@ -257,136 +429,186 @@ class Network(AgentCheck):
         proc_location = self.agentConfig.get('procfs_path', '/proc').rstrip('/')
         if self._collect_cx_state:
             try:
-                self.log.debug("Using `ss` to collect connection state")
-                # Try using `ss` for increased performance over `netstat`
-                for ip_version in ['4', '6']:
-                    # Call `ss` for each IP version because there's no built-in way of distinguishing
-                    # between the IP versions in the output
-                    output, _, _ = get_subprocess_output(["ss", "-n", "-u", "-t", "-a", "-{0}".format(ip_version)], self.log)
-                    lines = output.splitlines()
-                    # Netid  State      Recv-Q Send-Q     Local Address:Port       Peer Address:Port
-                    # udp    UNCONN     0      0              127.0.0.1:8125                  *:*
-                    # udp    ESTAB      0      0              127.0.0.1:37036         127.0.0.1:8125
-                    # udp    UNCONN     0      0        fe80::a00:27ff:fe1c:3c4:123          :::*
-                    # tcp    TIME-WAIT  0      0          90.56.111.177:56867        46.105.75.4:143
-                    # tcp    LISTEN     0      0       ::ffff:127.0.0.1:33217  ::ffff:127.0.0.1:7199
-                    # tcp    ESTAB      0      0       ::ffff:127.0.0.1:58975  ::ffff:127.0.0.1:2181
-
-                    metrics = self._parse_linux_cx_state(lines[1:], self.tcp_states['ss'], 1, ip_version=ip_version)
-                    # Only send the metrics which match the loop iteration's ip version
-                    for stat, metric in self.cx_state_gauge.iteritems():
-                        if stat[0].endswith(ip_version):
-                            self.gauge(metric, metrics.get(metric))
-
-            except OSError:
-                self.log.info("`ss` not found: using `netstat` as a fallback")
-                output, _, _ = get_subprocess_output(["netstat", "-n", "-u", "-t", "-a"], self.log)
-                lines = output.splitlines()
-                # Active Internet connections (w/o servers)
-                # Proto Recv-Q Send-Q Local Address           Foreign Address         State
-                # tcp        0      0 46.105.75.4:80          79.220.227.193:2032     SYN_RECV
-                # tcp        0      0 46.105.75.4:143         90.56.111.177:56867     ESTABLISHED
-                # tcp        0      0 46.105.75.4:50468       107.20.207.175:443      TIME_WAIT
-                # tcp6       0      0 46.105.75.4:80          93.15.237.188:58038     FIN_WAIT2
-                # tcp6       0      0 46.105.75.4:80          79.220.227.193:2029     ESTABLISHED
-                # udp        0      0 0.0.0.0:123             0.0.0.0:*
-                # udp6       0      0 :::41458                :::*
-
-                metrics = self._parse_linux_cx_state(lines[2:], self.tcp_states['netstat'], 5)
+                self.log.debug("Using sock_diag and %s/net to collect connection state", proc_location)
+                metrics = self._cx_state_linux(proc_location)
                 for metric, value in metrics.iteritems():
                     self.gauge(metric, value)
-            except SubprocessOutputEmptyError:
-                self.log.exception("Error collecting connection stats.")
+            except IOError:
+                self.log.info("Unable to read the connections from %s/net: using `ss` as a fallback", proc_location)
+                self._cx_state_linux_subprocess()
 
-        proc_dev_path = "{}/net/dev".format(proc_location)
-        proc = open(proc_dev_path, 'r')
-        try:
-            lines = proc.readlines()
-        finally:
-            proc.close()
         # Inter-|   Receive                                                 |  Transmit
         #  face |bytes     packets errs drop fifo frame compressed multicast|bytes       packets errs drop fifo colls carrier compressed
         #     lo:45890956   112797   0    0    0     0          0         0    45890956   112797    0    0    0     0       0          0
         #   eth0:631947052 1042233   0   19    0   184          0      1206  1208625538  1320529    0    0    0     0       0          0
         #   eth1:       0        0   0    0    0     0          0         0           0        0    0    0    0     0       0          0
-        for l in lines[2:]:
-            cols = l.split(':', 1)
-            x = cols[1].split()
+        proc_dev = self._read_proc_file("{}/net/dev".format(proc_location))
+        for match in PROC_NET_DEV_RE.finditer(proc_dev):
+            iface, bytes_rcvd, packets_in, errs_in, drop_in, bytes_sent, packets_out, errs_out, drop_out = match.groups()
             # Filter inactive interfaces
-            if self._parse_value(x[0]) or self._parse_value(x[8]):
-                iface = cols[0].strip()
-                metrics = {
-                    'bytes_rcvd': self._parse_value(x[0]),
-                    'bytes_sent': self._parse_value(x[8]),
-                    'packets_in.count': self._parse_value(x[1]),
-                    'packets_in.error': self._parse_value(x[2]) + self._parse_value(x[3]),
-                    'packets_out.count': self._parse_value(x[9]),
-                    'packets_out.error':self._parse_value(x[10]) + self._parse_value(x[11]),
-                }
-                self._submit_devicemetrics(iface, metrics)
-
-        try:
-            proc_snmp_path = "{}/net/snmp".format(proc_location)
-            proc = open(proc_snmp_path, 'r')
-
-            # IP:      Forwarding   DefaultTTL InReceives     InHdrErrors  ...
-            # IP:      2            64         377145470      0            ...
-            # Icmp:    InMsgs       InErrors   InDestUnreachs InTimeExcds  ...
-            # Icmp:    1644495      1238       1643257        0            ...
-            # IcmpMsg: InType3      OutType3
-            # IcmpMsg: 1643257      1643257
-            # Tcp:     RtoAlgorithm RtoMin     RtoMax         MaxConn      ...
-            # Tcp:     1            200        120000         -1           ...
-            # Udp:     InDatagrams  NoPorts    InErrors       OutDatagrams ...
-            # Udp:     24249494     1643257    0              25892947     ...
-            # UdpLite: InDatagrams  Noports    InErrors       OutDatagrams ...
-            # UdpLite: 0            0          0              0            ...
+            if bytes_rcvd == '0' and bytes_sent == '0':
+                continue
+            if self._is_excluded_iface(iface):
+                continue
+            metrics = {
+                'bytes_rcvd': long(bytes_rcvd),
+                'bytes_sent': long(bytes_sent),
+                'packets_in.count': long(packets_in),
+                'packets_in.error': long(errs_in) + long(drop_in),
+                'packets_out.count': long(packets_out),
+                'packets_out.error': long(errs_out) + long(drop_out),
+            }
+            self._submit_devicemetrics(iface, metrics)
+        proc_dev = None
+
+        # IP:      Forwarding   DefaultTTL InReceives     InHdrErrors  ...
+        # IP:      2            64         377145470      0            ...
+        # Icmp:    InMsgs       InErrors   InDestUnreachs InTimeExcds  ...
+        # Icmp:    1644495      1238       1643257        0            ...
+        # IcmpMsg: InType3      OutType3
+        # IcmpMsg: 1643257      1643257
+        # Tcp:     RtoAlgorithm RtoMin     RtoMax         MaxConn      ...
+        # Tcp:     1            200        120000         -1           ...
+        # Udp:     InDatagrams  NoPorts    InErrors       OutDatagrams ...
+        # Udp:     24249494     1643257    0              25892947     ...
+        # UdpLite: InDatagrams  Noports    InErrors       OutDatagrams ...
+        # UdpLite: 0            0          0              0            ...
+        #
+        # /proc/net/netstat has the same layout, with the TcpExt and IpExt counters
+        for proc_file in ('snmp', 'netstat'):
+            proc_path = "{}/net/{}".format(proc_location, proc_file)
             try:
-                lines = proc.readlines()
-            finally:
-                proc.close()
+                counters = self._read_proc_file(proc_path)
+            except IOError:
+                # On Openshift, /proc/net/snmp is only readable by root
+                self.log.debug("Unable to read %s.", proc_path)
+                continue
 
-            tcp_lines = [line for line in lines if line.startswith('Tcp:')]
-            udp_lines = [line for line in lines if line.startswith('Udp:')]
+            for metric, value in self._parse_proc_net_counters(counters, PROC_NET_COUNTERS_METRICS[proc_file]):
+                self.rate(metric, value)
+            counters = None
 
-            tcp_column_names = tcp_lines[0].strip().split()
-            tcp_values = tcp_lines[1].strip().split()
-            tcp_metrics = dict(zip(tcp_column_names, tcp_values))
+    def _read_proc_file(self, path):
+        """
+        Read a whole procfs file into the buffer reused between runs, growing it when needed.
+        Returns a read-only view of the content, to drop before reading another file.
+        """
+        buf = self._proc_net_buffer
+        size = 0
+        with io.open(path, 'rb', buffering=0) as proc:
+            # procfs hands out the content of the file a page or so at a time
+            while True:
+                if size == len(buf):
+                    buf.extend(bytearray(len(buf)))
+                read = proc.readinto(memoryview(buf)[size:])
+                if not read:
+                    return buffer(buf, 0, size)
+                size += read
+
+    def _parse_proc_net_counters(self, content, metrics_by_prefix):
+        """
+        Yield the (metric, value) of the counters of /proc/net/snmp or /proc/net/netstat
+        that are submitted, the position of the counters is computed once per line of names
+        """
+        for match in PROC_NET_COUNTERS_RE.finditer(content):
+            prefix, names, values = match.groups()
+            if prefix not in metrics_by_prefix:
+                continue
 
-            udp_column_names = udp_lines[0].strip().split()
-            udp_values = udp_lines[1].strip().split()
-            udp_metrics = dict(zip(udp_column_names, udp_values))
+            columns = self._proc_net_columns.get(names)
+            if columns is None:
+                metric_names = metrics_by_prefix[prefix]
+                columns = [(i, metric_names[name]) for i, name in enumerate(names.split())
+                           if name in metric_names]
+                self._proc_net_columns[names] = columns
 
-            # line start indicating what kind of metrics we're looking at
-            assert(tcp_metrics['Tcp:'] == 'Tcp:')
+            values = values.split()
+            for i, metric in columns:
+                yield metric, self._parse_value(values[i])
 
-            tcp_metrics_name = {
-                'RetransSegs': 'system.net.tcp.retrans_segs',
-                'InSegs'     : 'system.net.tcp.in_segs',
-                'OutSegs'    : 'system.net.tcp.out_segs'
-            }
+    def _cx_state_linux_subprocess(self):
+        try:
+            self.log.debug("Using `ss` to collect connection state")
+            # Try using `ss` for increased performance over `netstat`
+            for ip_version in ['4', '6']:
+                # Call `ss` for each IP version because there's no built-in way of distinguishing
+                # between the IP versions in the output
+                output, _, _ = get_subprocess_output(["ss", "-n", "-u", "-t", "-a", "-{0}".format(ip_version)], self.log)
+                lines = output.splitlines()
+                # Netid  State      Recv-Q Send-Q     Local Address:Port       Peer Address:Port
+                # udp    UNCONN     0      0              127.0.0.1:8125                  *:*
+                # udp    ESTAB      0      0              127.0.0.1:37036         127.0.0.1:8125
+                # udp    UNCONN     0      0        fe80::a00:27ff:fe1c:3c4:123          :::*
+                # tcp    TIME-WAIT  0      0          90.56.111.177:56867        46.105.75.4:143
+                # tcp    LISTEN     0      0       ::ffff:127.0.0.1:33217  ::ffff:127.0.0.1:7199
+                # tcp    ESTAB      0      0       ::ffff:127.0.0.1:58975  ::ffff:127.0.0.1:2181
+
+                metrics = self._parse_linux_cx_state(lines[1:], self.tcp_states['ss'], 1, ip_version=ip_version)
+                # Only send the metrics which match the loop iteration's ip version
+                for stat, metric in self.cx_state_gauge.iteritems():
+                    if stat[0].endswith(ip_version):
+                        self.gauge(metric, metrics.get(metric))
+
+        except OSError:
+            self.log.info("`ss` not found: using `netstat` as a fallback")
+            output, _, _ = get_subprocess_output(["netstat", "-n", "-u", "-t", "-a"], self.log)
+            lines = output.splitlines()
+            # Active Internet connections (w/o servers)
+            # Proto Recv-Q Send-Q Local Address           Foreign Address         State
+            # tcp        0      0 46.105.75.4:80          79.220.227.193:2032     SYN_RECV
+            # tcp        0      0 46.105.75.4:143         90.56.111.177:56867     ESTABLISHED
+            # tcp        0      0 46.105.75.4:50468       107.20.207.175:443      TIME_WAIT
+            # tcp6       0      0 46.105.75.4:80          93.15.237.188:58038     FIN_WAIT2
+            # tcp6       0      0 46.105.75.4:80          79.220.227.193:2029     ESTABLISHED
+            # udp        0      0 0.0.0.0:123             0.0.0.0:*
+            # udp6       0      0 :::41458                :::*
+
+            metrics = self._parse_linux_cx_state(lines[2:], self.tcp_states['netstat'], 5)
+            for metric, value in metrics.iteritems():
+                self.gauge(metric, value)
+        except SubprocessOutputEmptyError:
+            self.log.exception("Error collecting connection stats.")
+
+    def _cx_state_linux(self, proc_location):
+        """
+        Count the connections by state with sock_diag, and by reading /proc/net when
+        it isn't available or when the agent is configured to use another procfs
+        Returns a dict metric_name -> value
+        """
+        use_netlink = proc_location == '/proc'
+        tcp_states = self.tcp_states['netstat']
+        metrics = dict.fromkeys(self.cx_state_gauge.values(), 0)
 
-            for key, metric in tcp_metrics_name.iteritems():
-                self.rate(metric, self._parse_value(tcp_metrics[key]))
+        for protocol, family, ip_protocol, proc_file in LINUX_CX_STATE_SOURCES:
+            counts = None
+            if use_netlink and protocol not in self._netlink_unsupported:
+                if self._netlink_buffer is None:
+                    self._netlink_buffer = bytearray(NETLINK_BUFFER_SIZE)
+                try:
+                    counts = netlink_cx_state_counts(family, ip_protocol, self._netlink_buffer)
+                except socket.error as e:
+                    self.log.info("Unable to use sock_diag for %s connections, reading /proc/net/%s instead: %s",
+                                  protocol, proc_file, e)
+                    self._netlink_unsupported.add(protocol)
+
+            if counts is None:
+                proc_path = "{0}/net/{1}".format(proc_location, proc_file)
+                if family == socket.AF_INET6 and not os.path.exists(proc_path):
+                    # IPv6 is disabled
+                    counts = {}
+                else:
+                    counts = procfs_cx_state_counts(proc_path)
 
-            assert(udp_metrics['Udp:'] == 'Udp:')
+            if protocol.startswith('udp'):
+                metrics[self.cx_state_gauge[protocol, 'connections']] += sum(counts.itervalues())
+                continue
 
-            udp_metrics_name = {
-                'InDatagrams': 'system.net.udp.in_datagrams',
-                'NoPorts': 'system.net.udp.no_ports',
-                'InErrors': 'system.net.udp.in_errors',
-                'OutDatagrams': 'system.net.udp.out_datagrams',
-                'RcvbufErrors': 'system.net.udp.rcv_buf_errors',
-                'SndbufErrors': 'system.net.udp.snd_buf_errors',
-                'InCsumErrors': 'system.net.udp.in_csum_errors'
-            }
-            for key, metric in udp_metrics_name.iteritems():
-                if key in udp_metrics:
-                    self.rate(metric, self._parse_value(udp_metrics[key]))
+            for state, count in counts.iteritems():
+                state_name = LINUX_TCP_STATES.get(state)
+                if state_name in tcp_states:
+                    metrics[self.cx_state_gauge[protocol, tcp_states[state_name]]] += count
 
-        except IOError:
-            # On Openshift, /proc/net/snmp is only readable by root
-            self.log.debug("Unable to read %s.", proc_snmp_path)
+        return metrics
 
     # Parse the output of the command that retrieves the connection state (either `ss` or `netstat`)
     # Returns a dict metric_name -> value
@@ -4,17 +4,24 @@
 
 # stdlib
 from collections import namedtuple
+import errno
+import shutil
 import socket
 import os
+import tempfile
+import time
 
 # 3p
 import mock
 from nose.plugins.attrib import attr
 
 # project
-from tests.checks.common import AgentCheckTest, Fixtures
+from tests.checks.common import AgentCheckTest, Fixtures, load_class
 
 FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'ci')
+PROC_FIXTURE_DIR = os.path.join(FIXTURE_DIR, 'fixtures', 'proc')
+
+procfs_cx_state_counts = load_class('network', 'procfs_cx_state_counts')
 
 def ss_subprocess_mock(*args, **kwargs):
     if args[0][-1] == '-4':
@@ -59,9 +66,10 @@ class TestCheckNetwork(AgentCheckTest):
     }
 
     @attr('unix')
+    @mock.patch('_network.Network._cx_state_linux', side_effect=IOError)
     @mock.patch('_network.get_subprocess_output', side_effect=ss_subprocess_mock)
     @mock.patch('_network.Platform.is_linux', return_value=True)
-    def test_cx_state_linux_ss(self, mock_subprocess, mock_platform):
+    def test_cx_state_linux_ss(self, mock_subprocess, mock_platform, mock_cx_state):
         self.run_check({})
 
         # Assert metrics
@@ -69,15 +77,87 @@ class TestCheckNetwork(AgentCheckTest):
             self.assertMetric(metric, value=value)
 
     @attr('unix')
+    @mock.patch('_network.Network._cx_state_linux', side_effect=IOError)
     @mock.patch('_network.get_subprocess_output', side_effect=netstat_subprocess_mock)
     @mock.patch('_network.Platform.is_linux', return_value=True)
-    def test_cx_state_linux_netstat(self, mock_subprocess, mock_platform):
+    def test_cx_state_linux_netstat(self, mock_subprocess, mock_platform, mock_cx_state):
         self.run_check({})
 
         # Assert metrics
         for metric, value in self.CX_STATE_GAUGES_VALUES.iteritems():
             self.assertMetric(metric, value=value)
 
+    @attr('unix')
+    def test_cx_state_linux_procfs(self):
+        metrics = self.check._cx_state_linux(PROC_FIXTURE_DIR)
+        self.assertEqual(metrics, self.CX_STATE_GAUGES_VALUES)
+
+    @attr('unix')
+    def test_cx_state_linux_netlink(self):
+        def netlink_cx_state_counts(family, protocol, buf):
+            if protocol == socket.IPPROTO_UDP:
+                # The udp_diag module isn't loaded
+                raise socket.error(errno.ENOENT, os.strerror(errno.ENOENT))
+            return procfs_cx_state_counts(os.path.join(
+                PROC_FIXTURE_DIR, 'net', 'tcp' if family == socket.AF_INET else 'tcp6'))
+
+        def read_proc_fixture(path):
+            return procfs_cx_state_counts(path.replace('/proc', PROC_FIXTURE_DIR, 1))
+
+        with mock.patch('_network.netlink_cx_state_counts', side_effect=netlink_cx_state_counts) as netlink, \
+                mock.patch('_network.procfs_cx_state_counts', side_effect=read_proc_fixture) as procfs:
+            self.assertEqual(self.check._cx_state_linux('/proc'), self.CX_STATE_GAUGES_VALUES)
+            self.assertEqual(netlink.call_count, 4)
+            self.assertEqual(sorted(c[0][0] for c in procfs.call_args_list), ['/proc/net/udp', '/proc/net/udp6'])
+
+            # sock_diag isn't tried again for UDP
+            self.assertEqual(self.check._cx_state_linux('/proc'), self.CX_STATE_GAUGES_VALUES)
+            self.assertEqual(netlink.call_count, 6)
+            self.assertEqual(procfs.call_count, 4)
+
+    @attr('unix')
+    @mock.patch('_network.Platform.is_linux', return_value=True)
+    def test_proc_net_counters_linux(self, mock_platform):
+        config = {
+            "instances": [{
+                "excluded_interfaces": ["lo"],
+                "excluded_interface_re": "veth.*",
+            }]
+        }
+        self.load_check(config, {'procfs_path': PROC_FIXTURE_DIR})
+        self.run_check(config)
+
+        # eth1 is inactive
+        self.assertMetric('system.net.bytes_rcvd', value=631947052, device_name='eth0', count=1)
+        self.assertMetric('system.net.bytes_sent', value=1208625538, device_name='eth0', count=1)
+        self.assertMetric('system.net.packets_in.count', value=1042233, device_name='eth0', count=1)
+        self.assertMetric('system.net.packets_in.error', value=19, device_name='eth0', count=1)
+        self.assertMetric('system.net.packets_out.count', value=1320529, device_name='eth0', count=1)
+        self.assertMetric('system.net.packets_out.error', value=0, device_name='eth0', count=1)
+
+        self.assertMetric('system.net.tcp.retrans_segs', value=8411)
+        self.assertMetric('system.net.tcp.in_segs', value=350211374)
+        self.assertMetric('system.net.tcp.out_segs', value=343296584)
+        self.assertMetric('system.net.udp.in_datagrams', value=24249494)
+        self.assertMetric('system.net.udp.no_ports', value=1643257)
+        self.assertMetric('system.net.udp.in_errors', value=0)
+        self.assertMetric('system.net.udp.out_datagrams', value=25892947)
+        self.assertMetric('system.net.udp.rcv_buf_errors', value=0)
+        self.assertMetric('system.net.udp.snd_buf_errors', value=0)
+        self.assertMetric('system.net.udp.in_csum_errors', value=0)
+
+        self.assertMetric('system.net.tcp.listen_overflows', value=27)
+        self.assertMetric('system.net.tcp.listen_drops', value=31)
+        self.assertMetric('system.net.tcp.backlog_drops', value=5)
+        self.assertMetric('system.net.tcp.failed_retransmits', value=2)
+
+        self.assertEqual(len(self.metrics), 6 + 14)
+
+        # Exclusion decisions are cached per interface, until the filters change
+        self.assertEqual(self.check._iface_exclusions, {'lo': True, 'eth0': False, 'vethc3a6e1f': True})
+        self.check.check({"excluded_interfaces": ["lo"]})
+        self.assertEqual(self.check._iface_exclusions, {'lo': True, 'eth0': False, 'vethc3a6e1f': False})
+
     @mock.patch('_network.Platform.is_linux', return_value=False)
     @mock.patch('_network.Platform.is_bsd', return_value=False)
     @mock.patch('_network.Platform.is_solaris', return_value=False)
@@ -172,3 +252,89 @@ class TestCheckNetwork(AgentCheckTest):
         conn.family = socket.AF_INET
         protocol = self.check._parse_protocol_psutil(conn)
         self.assertEqual(protocol, 'udp4')
+
+
+def _write_large_proc_net(proc_dir, nb_rows=1000000):
+    """
+    Write /proc/net/{tcp,tcp6,udp,udp6} files with `nb_rows` TCP sockets over IPv4,
+    spread over 5 states, and a few thousands of UDP sockets
+    """
+    net_dir = os.path.join(proc_dir, 'net')
+    os.makedirs(net_dir)
+    states = ['01', '01', '01', '06', '06', '0A', '08', '02']
+
+    with open(os.path.join(net_dir, 'tcp'), 'w') as f:
+        f.write("  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode\n")
+        for i in xrange(nb_rows):
+            line = "%4d: 0100007F:%04X 0100007F:0050 %s 00000000:00000000 00:00000000 00000000  1000        0 %d 1 0000000000000000 20 4 30 10 -1" % (
+                i, i % 65536, states[i % len(states)], 10000 + i)
+            f.write(line.ljust(149) + "\n")
+
+    for name in ('tcp6', 'udp', 'udp6'):
+        with open(os.path.join(net_dir, name), 'w') as f:
+            f.write("  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode\n")
+            if name == 'udp':
+                for i in xrange(5000):
+                    f.write("%5d: 0100007F:%04X 00000000:0000 07 00000000:00000000 00:00000000 00000000     0        0 %d 2 0000000000000000 0\n" % (
+                        i, i, 20000 + i))
+
+
+@attr(requires='network')
+class TestCheckNetworkLargeProcNet(AgentCheckTest):
+    CHECK_NAME = 'network'
+
+    def setUp(self):
+        self.config = {"instances": [{"collect_connection_state": True}]}
+        self.load_check(self.config)
+        self.check._setup_metrics(self.config["instances"][0])
+        self.proc_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.proc_dir)
+
+    def test_large_proc_net(self):
+        _write_large_proc_net(self.proc_dir)
+
+        durations = []
+        for _ in xrange(3):
+            start = time.time()
+            metrics = self.check._cx_state_linux(self.proc_dir)
+            durations.append(time.time() - start)
+
+        print "Counted 1M connections in %.2fs (first run), %.2fs (best run)" % (durations[0], min(durations))
+
+        self.assertEqual(metrics['system.net.tcp4.established'], 375000)
+        self.assertEqual(metrics['system.net.tcp4.time_wait'], 250000)
+        self.assertEqual(metrics['system.net.tcp4.listening'], 125000)
+        self.assertEqual(metrics['system.net.tcp4.closing'], 125000)
+        self.assertEqual(metrics['system.net.tcp4.opening'], 125000)
+        self.assertEqual(metrics['system.net.udp4.connections'], 5000)
+        self.assertEqual(sum(metrics.itervalues()), 1005000)
+
+    @mock.patch('_network.Platform.is_linux', return_value=True)
+    def test_many_interfaces(self, mock_platform):
+        """
+        A Kubernetes node with 5000 veth interfaces, excluded from the check
+        """
+        net_dir = os.path.join(self.proc_dir, 'net')
+        os.makedirs(net_dir)
+        for name in ('snmp', 'netstat'):
+            shutil.copy(os.path.join(PROC_FIXTURE_DIR, 'net', name), net_dir)
+        with open(os.path.join(net_dir, 'dev'), 'w') as f:
+            f.write(Fixtures.read_file(os.path.join('proc', 'net', 'dev'), sdk_dir=FIXTURE_DIR))
+            for i in xrange(5000):
+                f.write("veth%05d: %d %d 1 2 0 0 0 0 %d %d 3 4 0 0 0 0\n" % (i, 1000 + i, 10 + i, 2000 + i, 20 + i))
+
+        config = {"instances": [{"excluded_interfaces": ["lo"], "excluded_interface_re": "veth.*"}]}
+        self.load_check(config, {'procfs_path': self.proc_dir})
+
+        durations = []
+        for _ in xrange(5):
+            start = time.time()
+            self.check.check(config["instances"][0])
+            durations.append(time.time() - start)
+            metrics = self.check.get_metrics()
+
+        print "Checked 5000 interfaces in %.3fs (first run), %.3fs (best run)" % (durations[0], min(durations))
+        self.assertEqual(len(metrics), 6 + 14)
+        self.assertEqual(len(self.check._iface_exclusions), 5000 + 3)
@@ -4,10 +4,12 @@
 
 # stdlib
 from datetime import datetime, timedelta
+import time
 from urlparse import urljoin
 
 # project
 from checks import AgentCheck
+from checks.libs.thread_pool import Pool
 
 # 3p
 import re
@@ -25,6 +27,13 @@ DEFAULT_NEUTRON_API_VERSION = 'v2.0'
 
 DEFAULT_API_REQUEST_TIMEOUT = 5 # seconds
 
+# Number of threads fetching the server and hypervisor stats, they are fetched
+# in the check's thread by default
+DEFAULT_THREADS_COUNT = 1
+
+# Number of servers requested per page when listing the servers
+DEFAULT_PAGINATED_SERVER_LIMIT = 1000
+
 NOVA_HYPERVISOR_METRICS = [
     'current_workload',
     'disk_available_least',
@@ -384,14 +393,41 @@ class OpenStackCheck(AgentCheck):
             [re.compile(ex) for ex in init_config.get('exclude_server_ids', [])]
         )
 
+        self.pool = None
+        threads_count = int(init_config.get('threads_count', DEFAULT_THREADS_COUNT))
+        if threads_count > 1:
+            self.pool = Pool(threads_count)
+
+        # Keep-alive connections to the OpenStack APIs, shared by all the instances
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(threads_count, requests.adapters.DEFAULT_POOLSIZE))
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+        self.paginated_server_limit = int(init_config.get('paginated_server_limit', DEFAULT_PAGINATED_SERVER_LIMIT))
+        # Seconds a check run can spend listing the servers, the listing
+        # resumes from where it stopped on the next run when it runs out
+        self.server_listing_time_budget = init_config.get('server_listing_time_budget')
+
+        # Per servers url and host: marker of the next page to fetch, server ids
+        # of the listing in progress and of the last complete listing
+        self._server_listings = {}
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        self._session.close()
+
     def _make_request_with_auth_fallback(self, url, headers=None, params=None):
         """
         Generic request handler for OpenStack API requests
         Raises specialized Exceptions for commonly encountered error codes
         """
         try:
-            resp = requests.get(url, headers=headers, verify=self._ssl_verify, params=params,
-                                timeout=DEFAULT_API_REQUEST_TIMEOUT, proxies=self.proxies)
+            resp = self._session.get(url, headers=headers, verify=self._ssl_verify, params=params,
+                                     timeout=DEFAULT_API_REQUEST_TIMEOUT, proxies=self.proxies)
             resp.raise_for_status()
         except requests.exceptions.HTTPError:
             if resp.status_code == 401:
@@ -418,7 +454,8 @@ class OpenStackCheck(AgentCheck):
         for i_key, scope in self.instance_map.items():
             if scope is scope_to_delete:
                 self.log.debug("Deleting current scope: %s", i_key)
-                del self.instance_map[i_key]
+                # Requests running on the thread pool may all hit the same 401
+                self.instance_map.pop(i_key, None)
 
     def get_scope_for_instance(self, instance):
         i_key = self._instance_key(instance)
@@ -634,21 +671,57 @@ class OpenStackCheck(AgentCheck):
                 self.gauge('openstack.nova.hypervisor_load.{0}'.format(avg), load_averages[i], tags=tags)
 
     def get_all_server_ids(self, filter_by_host=None):
-        query_params = {}
+        """
+        List the servers one page at a time. When `server_listing_time_budget` runs
+        out, the listing resumes from the last page fetched on the next run and the
+        servers of the last complete listing are returned along the ones fetched so far.
+        """
+        query_params = {"limit": self.paginated_server_limit}
         if filter_by_host:
             query_params["host"] = filter_by_host
 
         url = '{0}/servers'.format(self.get_nova_endpoint())
         headers = {'X-Auth-Token': self.get_auth_token()}
 
-        server_ids = []
-        try:
-            resp = self._make_request_with_auth_fallback(url, headers, params=query_params)
+        listing = self._server_listings.setdefault((url, filter_by_host), {
+            'marker': None,
+            'server_ids': [],
+            'last_server_ids': [],
+        })
 
-            server_ids = [s['id'] for s in resp['servers']]
+        deadline = None
+        if self.server_listing_time_budget:
+            deadline = time.time() + float(self.server_listing_time_budget)
+
+        try:
+            while True:
+                if listing['marker'] is not None:
+                    query_params["marker"] = listing['marker']
+                resp = self._make_request_with_auth_fallback(url, headers, params=query_params)
+
+                servers = resp['servers']
+                listing['server_ids'].extend(s['id'] for s in servers)
+                has_next = any(link.get('rel') == 'next' for link in resp.get('servers_links', []))
+                if not servers or not has_next:
+                    listing['last_server_ids'] = listing['server_ids']
+                    listing['server_ids'] = []
+                    listing['marker'] = None
+                    return listing['last_server_ids']
+
+                listing['marker'] = servers[-1]['id']
+                if deadline is not None and time.time() > deadline:
+                    self.log.info("Listing the servers took more than %ss, resuming after server %s on the next run",
+                                  self.server_listing_time_budget, listing['marker'])
+                    break
         except Exception as e:
             self.warning('Unable to get the list of all servers: {0}'.format(str(e)))
+            # The marker may not exist anymore, start over on the next run
+            listing['server_ids'] = []
+            listing['marker'] = None
 
+        server_ids = list(listing['server_ids'])
+        seen = set(server_ids)
+        server_ids.extend(sid for sid in listing['last_server_ids'] if sid not in seen)
         return server_ids
 
     def get_stats_for_single_server(self, server_id, tags=None):
@@ -707,13 +780,27 @@ class OpenStackCheck(AgentCheck):
         return self._aggregate_list
     ###
 
+    def _run_jobs(self, jobs):
+        """
+        Run a list of `(func, args, kwargs)` API calls, on the thread pool when there is one
+        """
+        if self.pool is None:
+            for func, args, kwargs in jobs:
+                func(*args, **kwargs)
+            return
+
+        results = [self.pool.apply_async(func, args, kwargs) for func, args, kwargs in jobs]
+        for result in results:
+            # Raise the exceptions like the calls made in the check's thread
+            result.get()
+
     def _send_api_service_checks(self, instance_scope):
         # Nova
         headers = {"X-Auth-Token": instance_scope.auth_token}
 
         try:
-            requests.get(instance_scope.service_catalog.nova_endpoint, headers=headers,
-                         verify=self._ssl_verify, timeout=DEFAULT_API_REQUEST_TIMEOUT, proxies=self.proxies)
+            self._session.get(instance_scope.service_catalog.nova_endpoint, headers=headers,
+                              verify=self._ssl_verify, timeout=DEFAULT_API_REQUEST_TIMEOUT, proxies=self.proxies)
             self.service_check(self.COMPUTE_API_SC, AgentCheck.OK,
                                tags=["keystone_server:%s" % self.init_config.get("keystone_server_url")])
         except (requests.exceptions.HTTPError, requests.exceptions.Timeout, requests.exceptions.ConnectionError):
@@ -722,8 +809,8 @@ class OpenStackCheck(AgentCheck):
 
         # Neutron
         try:
-            requests.get(instance_scope.service_catalog.neutron_endpoint, headers=headers,
-                         verify=self._ssl_verify, timeout=DEFAULT_API_REQUEST_TIMEOUT, proxies=self.proxies)
+            self._session.get(instance_scope.service_catalog.neutron_endpoint, headers=headers,
+                              verify=self._ssl_verify, timeout=DEFAULT_API_REQUEST_TIMEOUT, proxies=self.proxies)
             self.service_check(self.NETWORK_API_SC, AgentCheck.OK,
                                tags=["keystone_server:%s" % self.init_config.get("keystone_server_url")])
         except (requests.exceptions.HTTPError, requests.exceptions.Timeout, requests.exceptions.ConnectionError):
@@ -798,19 +885,22 @@ class OpenStackCheck(AgentCheck):
 
             host_tags = self._get_tags_for_host()
 
-            for sid in server_ids:
-                server_tags = ["nova_managed_server"]
-                if instance_scope.tenant_id:
-                    server_tags.append("tenant_id:%s" % instance_scope.tenant_id)
+            server_tags = ["nova_managed_server"]
+            if instance_scope.tenant_id:
+                server_tags.append("tenant_id:%s" % instance_scope.tenant_id)
 
+            jobs = []
+            for sid in server_ids:
                 self.external_host_tags[sid] = host_tags
-                self.get_stats_for_single_server(sid, tags=server_tags)
+                jobs.append((self.get_stats_for_single_server, (sid,), {'tags': server_tags}))
 
             if hyp:
-                self.get_stats_for_single_hypervisor(hyp, host_tags=host_tags)
+                jobs.append((self.get_stats_for_single_hypervisor, (hyp,), {'host_tags': host_tags}))
             else:
                 self.warning("Couldn't get hypervisor to monitor for host: %s" % self.get_my_hostname())
 
+            self._run_jobs(jobs)
+
             if project:
                 self.get_stats_for_single_project(project)
 
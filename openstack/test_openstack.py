@@ -6,8 +6,9 @@
 from nose.plugins.attrib import attr
 from time import sleep
 from unittest import TestCase
-from mock import patch
+from mock import MagicMock, patch
 import re
+import threading
 
 # 3p
 
@@ -364,3 +365,84 @@ class TestOpenstack(AgentCheckTest):
 
             # cleanup
             self.check.exclude_network_id_rules = set([])
+
+    def _mock_current_scope(self):
+        scope = MagicMock()
+        scope.auth_token = "test_token"
+        scope.service_catalog.nova_endpoint = "http://10.0.2.15:8774/v2.1/test_project_id"
+        self.check._current_scope = scope
+
+    def test_server_pagination(self):
+        """
+        List the servers one page at a time, resuming the listing on the next run when out of time
+        """
+        self._mock_current_scope()
+        self.check.paginated_server_limit = 2
+        self.check.server_listing_time_budget = 1.5
+
+        server_ids = ["server-{0}".format(i) for i in range(5)]
+        requested_markers = []
+
+        def list_servers(url, headers=None, params=None):
+            marker = params.get("marker")
+            requested_markers.append(marker)
+            start = server_ids.index(marker) + 1 if marker else 0
+            page = server_ids[start:start + params["limit"]]
+            resp = {"servers": [{"id": sid} for sid in page]}
+            if len(page) == params["limit"]:
+                resp["servers_links"] = [{"href": url, "rel": "next"}]
+            return resp
+
+        # Every page takes 1 second to fetch
+        clock = MagicMock()
+        clock.time.side_effect = range(100)
+
+        with patch("_openstack.OpenStackCheck._make_request_with_auth_fallback", side_effect=list_servers), \
+                patch("_openstack.time", clock):
+            # .. out of time after 2 pages
+            self.assertEqual(self.check.get_all_server_ids(), server_ids[:4])
+            self.assertEqual(requested_markers, [None, "server-1"])
+
+            # .. the listing resumes after the last server fetched
+            self.assertEqual(self.check.get_all_server_ids(), server_ids)
+            self.assertEqual(requested_markers, [None, "server-1", "server-3"])
+
+            # .. and starts over once complete, returning the servers of the last listing meanwhile
+            self.assertEqual(self.check.get_all_server_ids(), server_ids)
+            self.assertEqual(requested_markers[3:], [None, "server-1"])
+
+    def test_server_stats_thread_pool(self):
+        """
+        Fetch the server stats on the thread pool
+        """
+        config = {
+            "init_config": dict(self.MOCK_CONFIG["init_config"], threads_count=4),
+            "instances": self.MOCK_CONFIG["instances"],
+        }
+        self.load_check(config, self.DEFAULT_AGENT_CONFIG)
+        self._mock_current_scope()
+
+        threads = set()
+
+        def get_diagnostics(url, headers=None, params=None):
+            threads.add(threading.current_thread().ident)
+            return {"memory": 1024, "cpu0_time": 42, "unknown_metric": 0}
+
+        server_ids = ["server-{0}".format(i) for i in range(20)]
+        jobs = [(self.check.get_stats_for_single_server, (sid,), {"tags": ["nova_managed_server"]})
+                for sid in server_ids]
+
+        try:
+            with patch("_openstack.OpenStackCheck._make_request_with_auth_fallback", side_effect=get_diagnostics):
+                self.check._run_jobs(jobs)
+        finally:
+            self.check.stop()
+
+        self.assertNotIn(threading.current_thread().ident, threads)
+        self.metrics = self.check.get_metrics()
+        for sid in server_ids:
+            self.assertMetric("openstack.nova.server.memory", value=1024, tags=["nova_managed_server"],
+                              hostname=sid, count=1)
+            self.assertMetric("openstack.nova.server.cpu0_time", value=42, tags=["nova_managed_server"],
+                              hostname=sid, count=1)
+        self.assertEqual(len(self.metrics), 2 * len(server_ids))
@@ -7,7 +7,10 @@
 Collects database-wide metrics and optionally per-relation metrics, custom metrics.
 """
 # stdlib
+from collections import OrderedDict
+import re
 import socket
+import threading
 
 # 3rd party
 try:
@@ -19,10 +22,23 @@ import pg8000
 
 # project
 from checks import AgentCheck, CheckException
+from checks.libs.thread_pool import Pool
 from config import _is_affirmative
 
 MAX_CUSTOM_RESULTS = 100
 TABLE_COUNT_LIMIT = 200
+DEFAULT_MAX_DATABASE_CONNECTIONS = 5
+DEFAULT_THREADS_COUNT = 1
+
+# Databases whose relations are collected by `autodiscover_databases`
+DATABASE_DISCOVERY_QUERY = """
+SELECT datname
+  FROM pg_database
+ WHERE datallowconn
+   AND NOT datistemplate
+   AND datname not ilike 'postgres'
+   AND datname not ilike 'rdsadmin'
+ ORDER BY datname"""
 
 def psycopg2_connect(*args, **kwargs):
     if 'ssl' in kwargs:
@@ -152,7 +168,7 @@ SELECT mode,
         'query': """
 SELECT relname,schemaname,%s
   FROM pg_stat_user_tables
- WHERE relname = ANY(array[%s])""",
+ WHERE %s""",
         'relation': True,
     }
 
@@ -173,7 +189,7 @@ SELECT relname,
        indexrelname,
        %s
   FROM pg_stat_user_indexes
- WHERE relname = ANY(array[%s])""",
+ WHERE %s""",
         'relation': True,
     }
 
@@ -196,7 +212,7 @@ LEFT JOIN pg_namespace N ON (N.oid = C.relnamespace)
 WHERE nspname NOT IN ('pg_catalog', 'information_schema') AND
   nspname !~ '^pg_toast' AND
   relkind IN ('r') AND
-  relname = ANY(array[%s])"""
+  %s"""
     }
 
     COUNT_METRICS = {
@@ -269,7 +285,7 @@ SELECT relname,
        schemaname,
        %s
   FROM pg_statio_user_tables
- WHERE relname = ANY(array[%s])""",
+ WHERE %s""",
         'relation': True,
     }
 
@@ -314,6 +330,34 @@ SELECT s.schemaname,
         self.db_bgw_metrics = []
         self.replication_metrics = {}
         self.custom_metrics = {}
+        # Built once per instance
+        self.relations_config = {}
+        self.queries = {}
+        # Tags of the rows of each scope, by the values of their descriptors
+        self.row_tags = {}
+
+        # Connections to the autodiscovered databases of each instance: the idle
+        # ones by database name, least recently used first, and the count of
+        # the ones in use
+        self.database_connections = {}
+        self.database_connections_in_use = {}
+        self.database_connections_lock = threading.Lock()
+
+        # Autodiscovered databases are collected concurrently when there's more than one thread
+        self.pool = None
+        self.threads_count = int(init_config.get('threads_count', DEFAULT_THREADS_COUNT))
+        if self.threads_count > 1:
+            self.pool = Pool(self.threads_count)
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        for idle in self.database_connections.itervalues():
+            for connection in idle.itervalues():
+                self._close_connection(connection)
+        self.database_connections = {}
 
     def _get_pg_attrs(self, instance):
         if _is_affirmative(instance.get('use_psycopg2', False)):
@@ -434,6 +478,12 @@ SELECT s.schemaname,
             try:
                 if isinstance(element, str):
                     config[element] = {'relation_name': element, 'schemas': []}
+                elif isinstance(element, dict) and 'relation_regex' in element:
+                    regex = element['relation_regex']
+                    config[regex] = {}
+                    config[regex]['schemas'] = element.get('schemas', [])
+                    config[regex]['relation_regex'] = regex
+                    config[regex]['pattern'] = re.compile(regex)
                 elif isinstance(element, dict):
                     name = element['relation_name']
                     config[name] = {}
@@ -445,6 +495,91 @@ SELECT s.schemaname,
                 self.log.warn('Failed to parse config element=%s, check syntax' % str(element))
         return config
 
+    def _get_relations_config(self, key, relations):
+        """Returns the relations configuration of an instance, and the filter
+        selecting its relations server-side: a condition on `relname` with the
+        relation names and regexes as array parameters
+        """
+        if key not in self.relations_config:
+            config = self._build_relations_config(relations)
+            names = [name for name, c in config.iteritems() if 'relation_name' in c]
+            regexes = [regex for regex, c in config.iteritems() if 'relation_regex' in c]
+
+            conditions, params = [], []
+            if names:
+                conditions.append("relname = ANY(%s)")
+                params.append(names)
+            if regexes:
+                conditions.append("relname ~ ANY(%s)")
+                params.append(regexes)
+            condition = "(%s)" % " OR ".join(conditions) if conditions else "false"
+
+            self.relations_config[key] = (config, (condition, params))
+        return self.relations_config[key]
+
+    def _get_query(self, key, scope, relations_filter=None, relations_config=None, custom=False):
+        """Builds the query of a scope, once per instance
+        Returns the query, its parameters and the metrics, in the order of the columns
+        """
+        cache_key = (key, scope['query'], tuple(scope['metrics']), scope['relation'])
+        if cache_key in self.queries:
+            return self.queries[cache_key]
+
+        cols = scope['metrics'].keys()  # list of metrics to query, in some order
+        # we must remember that order to parse results
+
+        params = None
+        # if this is a relation-specific query, we need to list all relations last
+        if scope['relation'] and relations_config is not None:
+            if custom:
+                # Custom queries get the quoted names of the relations
+                relnames = ', '.join(
+                    "'{0}'".format(w) for w, c in relations_config.iteritems() if 'relation_name' in c
+                )
+                query = scope['query'] % (", ".join(cols), relnames)
+            else:
+                condition, params = relations_filter
+                query = scope['query'] % (", ".join(cols), condition)
+        else:
+            query = scope['query'] % (", ".join(cols))
+            query = query.replace(r'%', r'%%')
+
+        self.queries[cache_key] = (query, params, [scope['metrics'][c] for c in cols])
+        return self.queries[cache_key]
+
+    def _get_row_tags(self, key, scope, instance_tags):
+        """Returns the cache of the tags of the rows of a scope, by the values of
+        their descriptors. The cache is dropped when the instance tags change
+        """
+        instance_row_tags = self.row_tags.get(key)
+        if instance_row_tags is None or instance_row_tags[0] != instance_tags:
+            instance_row_tags = (list(instance_tags), {})
+            self.row_tags[key] = instance_row_tags
+
+        cache_key = (scope['query'], tuple(scope['descriptors']), scope['relation'])
+        return instance_row_tags[1].setdefault(cache_key, {})
+
+    def _build_row_tags(self, desc, descriptors, base_tags, relations_config):
+        """Builds the tags of a row from the values of its descriptors, or returns
+        False if its relation is not in the configured schemas
+        """
+        # build a map of descriptors and their values
+        desc_map = dict(zip([x[1] for x in desc], descriptors))
+        if 'schema' in desc_map and 'table' in desc_map and relations_config is not None:
+            relname = desc_map['table']
+            config = relations_config.get(relname)
+            if config is None:
+                # Selected by a regex
+                for c in relations_config.itervalues():
+                    if 'pattern' in c and c['pattern'].search(relname):
+                        config = c
+                        break
+
+            if config is not None and config['schemas'] and desc_map['schema'] not in config['schemas']:
+                return False
+
+        return base_tags + [("%s:%s" % (k,v)) for (k,v) in desc_map.iteritems()]
+
     def _collect_stats(self, key, db, instance_tags, relations, custom_metrics, function_metrics, count_metrics, database_size_metrics, interface_error, programming_error):
         """Query pg_stat_* for various metrics
         If relations is not an empty list, gather per-relation metrics
@@ -485,7 +620,9 @@ SELECT s.schemaname,
                 self.SIZE_METRICS,
                 self.STATIO_METRICS
             ]
-            relations_config = self._build_relations_config(relations)
+            relations_config, relations_filter = self._get_relations_config(key, relations)
+        else:
+            relations_config, relations_filter = None, None
 
         replication_metrics = self._get_replication_metrics(key, db)
         if replication_metrics is not None:
@@ -495,102 +632,206 @@ SELECT s.schemaname,
 
         full_metric_scope = list(metric_scope) + custom_metrics
         try:
-            cursor = db.cursor()
+            scope_results = self._run_scopes(key, db, full_metric_scope, custom_metrics,
+                                             relations_config, relations_filter, programming_error)
+        except interface_error as e:
+            self.log.error("Connection error: %s" % str(e))
+            raise ShouldRestartException
+        except socket.error as e:
+            self.log.error("Connection error: %s" % str(e))
+            raise ShouldRestartException
+
+        self._submit_scopes(key, scope_results, instance_tags, custom_metrics, relations_config)
+
+    def _run_scopes(self, key, db, scopes, custom_metrics, relations_config, relations_filter, programming_error):
+        """Runs the queries of the scopes
+        Returns the (scope, metrics, results) of the scopes that returned results
+        """
+        scope_results = []
+        cursor = db.cursor()
+
+        for scope in scopes:
+            if scope == self.REPLICATION_METRICS or not self._is_above(key, db, [9,0,0]):
+                log_func = self.log.debug
+            else:
+                log_func = self.log.warning
+
+            custom = scope in custom_metrics
+            query, params, metrics = self._get_query(key, scope, relations_filter, relations_config, custom)
 
-            for scope in full_metric_scope:
-                if scope == self.REPLICATION_METRICS or not self._is_above(key, db, [9,0,0]):
-                    log_func = self.log.debug
+            try:
+                if params:
+                    self.log.debug("Running query: %s with relations: %s" % (query, params))
+                    cursor.execute(query, params)
                 else:
-                    log_func = self.log.warning
-
-                # build query
-                cols = scope['metrics'].keys()  # list of metrics to query, in some order
-                # we must remember that order to parse results
-
-                try:
-                    # if this is a relation-specific query, we need to list all relations last
-                    if scope['relation'] and len(relations) > 0:
-                        relnames = ', '.join("'{0}'".format(w) for w in relations_config.iterkeys())
-                        query = scope['query'] % (", ".join(cols), "%s")  # Keep the last %s intact
-                        self.log.debug("Running query: %s with relations: %s" % (query, relnames))
-                        cursor.execute(query % (relnames))
-                    else:
-                        query = scope['query'] % (", ".join(cols))
-                        self.log.debug("Running query: %s" % query)
-                        cursor.execute(query.replace(r'%', r'%%'))
-
-                    results = cursor.fetchall()
-                except programming_error as e:
-                    log_func("Not all metrics may be available: %s" % str(e))
+                    self.log.debug("Running query: %s" % query)
+                    cursor.execute(query)
+
+                results = cursor.fetchall()
+            except programming_error as e:
+                log_func("Not all metrics may be available: %s" % str(e))
+                continue
+
+            if not results:
+                continue
+
+            if custom and len(results) > MAX_CUSTOM_RESULTS:
+                self.warning(
+                    "Query: {0} returned more than {1} results ({2}). Truncating"
+                    .format(query, MAX_CUSTOM_RESULTS, len(results))
+                )
+                results = results[:MAX_CUSTOM_RESULTS]
+
+            scope_results.append((scope, metrics, results))
+
+        cursor.close()
+        return scope_results
+
+    def _submit_scopes(self, key, scope_results, instance_tags, custom_metrics, relations_config):
+        for scope, metrics, results in scope_results:
+            # FIXME this cramps my style
+            if scope == self.DB_METRICS:
+                self.gauge("postgresql.db.count", len(results),
+                    tags=[t for t in instance_tags if not t.startswith("db:")])
+
+            desc = scope['descriptors']
+            desc_len = len(desc)
+            custom = scope in custom_metrics
+
+            # Build tags
+            # descriptors are: (pg_name, dd_tag_name): value
+            # Special-case the "db" tag, which overrides the one that is passed as instance_tag
+            # The reason is that pg_stat_database returns all databases regardless of the
+            # connection.
+            if not scope['relation']:
+                base_tags = [t for t in instance_tags if not t.startswith("db:")]
+            else:
+                base_tags = [t for t in instance_tags]
+
+            # The descriptors of custom metrics may take any value, their tags are not cached
+            row_tags = None if custom else self._get_row_tags(key, scope, instance_tags)
+
+            # parse & submit results
+            # A row should look like this
+            # (descriptor, descriptor, ..., value, value, value, value, ...)
+            # with descriptor a PG relation or index name, which we use to create the tags
+            for row in results:
+                # Check that all columns will be processed
+                assert len(row) == len(metrics) + desc_len
+
+                descriptors = tuple(row[:desc_len])
+                tags = row_tags.get(descriptors) if row_tags is not None else None
+                if tags is None:
+                    tags = self._build_row_tags(desc, descriptors, base_tags, relations_config)
+                    if row_tags is not None:
+                        row_tags[descriptors] = tags
+                if tags is False:
                     continue
 
-                if not results:
+                # [(metric-map, value), (metric-map, value), ...]
+                # metric-map is: (dd_name, "rate"|"gauge")
+                # shift the results since the first columns will be the "descriptors"
+                # To submit simply call the function for each value v
+                # v[0] == (metric_name, submit_function)
+                # v[1] == the actual value
+                # tags are
+                for v in zip(metrics, row[desc_len:]):
+                    v[0][1](self, v[0][0], v[1], tags=tags)
+
+    def _collect_databases(self, key, db, instance_tags, relations, connect, max_connections,
+                           programming_error):
+        """Collects the relations of the other databases of the server, over the
+        bounded pool of connections of the instance
+        """
+        cursor = db.cursor()
+        cursor.execute(DATABASE_DISCOVERY_QUERY)
+        dbnames = [row[0] for row in cursor.fetchall() if row[0] != key[2]]
+        cursor.close()
+
+        relations_config, relations_filter = self._get_relations_config(key, relations)
+        scopes = [self.REL_METRICS, self.IDX_METRICS, self.SIZE_METRICS, self.STATIO_METRICS]
+
+        def run_scopes(dbname):
+            connection = self._acquire_database_connection(key, dbname, max_connections, connect)
+            if connection is None:
+                return None
+            reuse = False
+            try:
+                scope_results = self._run_scopes(key, connection, scopes, [], relations_config,
+                                                 relations_filter, programming_error)
+                # commit to close the current query transaction
+                connection.commit()
+                reuse = True
+            except Exception as e:
+                # Any driver error, e.g. a query canceled by `statement_timeout`,
+                # only skips this database; its connection is closed
+                self.log.warning("Unable to collect the relations of database %s: %s", dbname, e)
+                return None
+            finally:
+                self._release_database_connection(key, dbname, connection, reuse=reuse)
+            return scope_results
+
+        # No more databases are collected at once than the pool has connections
+        batch_size = min(self.threads_count, max_connections) if self.pool is not None else 1
+        for i in xrange(0, len(dbnames), batch_size):
+            batch = dbnames[i:i + batch_size]
+            if self.pool is None:
+                outcomes = [run_scopes(dbname) for dbname in batch]
+            else:
+                outcomes = self.pool.map(run_scopes, batch)
+
+            for dbname, scope_results in zip(batch, outcomes):
+                if scope_results is None:
                     continue
+                tags = [t for t in instance_tags if not t.startswith("db:")] + ["db:%s" % dbname]
+                self._submit_scopes(key[:2] + (dbname,), scope_results, tags, [], relations_config)
 
-                if scope in custom_metrics and len(results) > MAX_CUSTOM_RESULTS:
-                    self.warning(
-                        "Query: {0} returned more than {1} results ({2}). Truncating"
-                        .format(query, MAX_CUSTOM_RESULTS, len(results))
-                    )
-                    results = results[:MAX_CUSTOM_RESULTS]
-
-                # FIXME this cramps my style
-                if scope == self.DB_METRICS:
-                    self.gauge("postgresql.db.count", len(results),
-                        tags=[t for t in instance_tags if not t.startswith("db:")])
-
-                desc = scope['descriptors']
-
-                # parse & submit results
-                # A row should look like this
-                # (descriptor, descriptor, ..., value, value, value, value, ...)
-                # with descriptor a PG relation or index name, which we use to create the tags
-                for row in results:
-                    # Check that all columns will be processed
-                    assert len(row) == len(cols) + len(desc)
-
-                    # build a map of descriptors and their values
-                    desc_map = dict(zip([x[1] for x in desc], row[0:len(desc)]))
-                    if 'schema' in desc_map:
-                        try:
-                            relname = desc_map['table']
-                            config_schemas = relations_config[relname]['schemas']
-                            if config_schemas and desc_map['schema'] not in config_schemas:
-                                continue
-                        except KeyError:
-                            pass
-
-                    # Build tags
-                    # descriptors are: (pg_name, dd_tag_name): value
-                    # Special-case the "db" tag, which overrides the one that is passed as instance_tag
-                    # The reason is that pg_stat_database returns all databases regardless of the
-                    # connection.
-                    if not scope['relation']:
-                        tags = [t for t in instance_tags if not t.startswith("db:")]
-                    else:
-                        tags = [t for t in instance_tags]
-
-                    tags += [("%s:%s" % (k,v)) for (k,v) in desc_map.iteritems()]
-
-                    # [(metric-map, value), (metric-map, value), ...]
-                    # metric-map is: (dd_name, "rate"|"gauge")
-                    # shift the results since the first columns will be the "descriptors"
-                    values = zip([scope['metrics'][c] for c in cols], row[len(desc):])
-
-                    # To submit simply call the function for each value v
-                    # v[0] == (metric_name, submit_function)
-                    # v[1] == the actual value
-                    # tags are
-                    for v in values:
-                        v[0][1](self, v[0][0], v[1], tags=tags)
+    def _acquire_database_connection(self, key, dbname, max_connections, connect):
+        """Takes the idle connection to a database out of the pool of the instance,
+        or opens a new one once the least recently used idle connections are
+        closed to stay within `max_connections`
+        """
+        evicted = []
+        with self.database_connections_lock:
+            idle = self.database_connections.setdefault(key, OrderedDict())
+            connection = idle.pop(dbname, None)
+            in_use = self.database_connections_in_use.get(key, 0)
+            if connection is None:
+                while idle and len(idle) + in_use >= max_connections:
+                    evicted.append(idle.popitem(last=False)[1])
+            self.database_connections_in_use[key] = in_use + 1
+
+        for c in evicted:
+            self._close_connection(c)
+
+        if connection is None:
+            try:
+                connection = connect(dbname)
+            except Exception as e:
+                self.log.warning("Unable to connect to database %s: %s", dbname, e)
+                with self.database_connections_lock:
+                    self.database_connections_in_use[key] -= 1
+        return connection
 
-            cursor.close()
-        except interface_error as e:
-            self.log.error("Connection error: %s" % str(e))
-            raise ShouldRestartException
-        except socket.error as e:
-            self.log.error("Connection error: %s" % str(e))
-            raise ShouldRestartException
+    def _release_database_connection(self, key, dbname, connection, reuse=True):
+        with self.database_connections_lock:
+            self.database_connections_in_use[key] -= 1
+            if reuse:
+                self.database_connections[key][dbname] = connection
+        if not reuse:
+            self._close_connection(connection)
+
+    def _rollback(self, connection):
+        try:
+            connection.rollback()
+        except Exception as e:
+            self.log.warning("Unable to rollback: %s", e)
+
+    def _close_connection(self, connection):
+        try:
+            connection.close()
+        except Exception as e:
+            self.log.debug("Unable to close connection: %s", e)
 
     def _get_service_check_tags(self, host, port, dbname):
         service_check_tags = [
@@ -600,27 +841,15 @@ SELECT s.schemaname,
         ]
         return service_check_tags
 
-    def get_connection(self, key, host, port, user, password, dbname, ssl, connect_fct, use_cached=True):
+    def get_connection(self, key, host, port, user, password, dbname, ssl, connect_fct, use_cached=True,
+                       statement_timeout=None):
         "Get and memoize connections to instances"
         if key in self.dbs and use_cached:
             return self.dbs[key]
 
         elif host != "" and user != "":
             try:
-                if host == 'localhost' and password == '':
-                    # Use ident method
-                    connection = connect_fct("user=%s dbname=%s" % (user, dbname))
-                elif port != '':
-                    connection = connect_fct(host=host, port=port, user=user,
-                        password=password, database=dbname, ssl=ssl)
-                elif host.startswith('/'):
-                    # If the hostname starts with /, it's probably a path
-                    # to a UNIX socket. This is similar behaviour to psql
-                    connection = connect_fct(unix_sock=host, user=user,
-                        password=password, database=dbname)
-                else:
-                    connection = connect_fct(host=host, user=user, password=password,
-                        database=dbname, ssl=ssl)
+                connection = self._connect(host, port, user, password, dbname, ssl, connect_fct, statement_timeout)
             except Exception as e:
                 message = u'Error establishing postgres connection: %s' % (str(e))
                 service_check_tags = self._get_service_check_tags(host, port, dbname)
@@ -636,6 +865,31 @@ SELECT s.schemaname,
         self.dbs[key] = connection
         return connection
 
+    def _connect(self, host, port, user, password, dbname, ssl, connect_fct, statement_timeout=None):
+        if host == 'localhost' and password == '':
+            # Use ident method
+            connection = connect_fct("user=%s dbname=%s" % (user, dbname))
+        elif port != '':
+            connection = connect_fct(host=host, port=port, user=user,
+                password=password, database=dbname, ssl=ssl)
+        elif host.startswith('/'):
+            # If the hostname starts with /, it's probably a path
+            # to a UNIX socket. This is similar behaviour to psql
+            connection = connect_fct(unix_sock=host, user=user,
+                password=password, database=dbname)
+        else:
+            connection = connect_fct(host=host, user=user, password=password,
+                database=dbname, ssl=ssl)
+
+        if statement_timeout:
+            # Committed to apply to the whole session
+            cursor = connection.cursor()
+            cursor.execute("SET statement_timeout = %d" % int(statement_timeout))
+            cursor.close()
+            connection.commit()
+
+        return connection
+
     def _get_custom_metrics(self, custom_metrics, key):
         # Pre-processed cached custom_metrics
         if key in self.custom_metrics:
@@ -676,6 +930,9 @@ SELECT s.schemaname,
         # Default value for `count_metrics` is True for backward compatibility
         count_metrics = _is_affirmative(instance.get('collect_count_metrics', True))
         database_size_metrics = _is_affirmative(instance.get('collect_database_size_metrics', True))
+        autodiscover_databases = _is_affirmative(instance.get('autodiscover_databases', False))
+        max_database_connections = int(instance.get('max_database_connections', DEFAULT_MAX_DATABASE_CONNECTIONS))
+        statement_timeout = instance.get('statement_timeout')
 
         if relations and not dbname:
             self.warning('"dbname" parameter must be set when using the "relations" parameter.')
@@ -706,15 +963,37 @@ SELECT s.schemaname,
 
         # Collect metrics
         try:
-            # Check version
-            db = self.get_connection(key, host, port, user, password, dbname, ssl, connect_fct)
-            version = self._get_version(key, db)
-            self.log.debug("Running check against version %s" % version)
-            self._collect_stats(key, db, tags, relations, custom_metrics, function_metrics, count_metrics, database_size_metrics, interface_error, programming_error)
-        except ShouldRestartException:
-            self.log.info("Resetting the connection")
-            db = self.get_connection(key, host, port, user, password, dbname, ssl, connect_fct, use_cached=False)
-            self._collect_stats(key, db, tags, relations, custom_metrics, function_metrics, count_metrics, database_size_metrics, interface_error, programming_error)
+            try:
+                # Check version
+                db = self.get_connection(key, host, port, user, password, dbname, ssl, connect_fct,
+                                         statement_timeout=statement_timeout)
+                version = self._get_version(key, db)
+                self.log.debug("Running check against version %s" % version)
+                self._collect_stats(key, db, tags, relations, custom_metrics, function_metrics, count_metrics, database_size_metrics, interface_error, programming_error)
+            except ShouldRestartException:
+                self.log.info("Resetting the connection")
+                db = self.get_connection(key, host, port, user, password, dbname, ssl, connect_fct, use_cached=False,
+                                         statement_timeout=statement_timeout)
+                self._collect_stats(key, db, tags, relations, custom_metrics, function_metrics, count_metrics, database_size_metrics, interface_error, programming_error)
+        except Exception:
+            # A driver error, e.g. a statement canceled by `statement_timeout`, aborts the
+            # transaction of the cached connection: roll it back for the next runs
+            if db is not None:
+                self._rollback(db)
+            raise
+
+        if autodiscover_databases and relations and db is not None:
+            # Relations of the other databases of the server, the server-wide
+            # metrics are only collected from the database of the instance
+            def connect(name):
+                return self._connect(host, port, user, password, name, ssl, connect_fct, statement_timeout)
+
+            try:
+                self._collect_databases(key, db, tags, relations, connect, max_database_connections,
+                                        programming_error)
+            except Exception as e:
+                self.warning("Unable to autodiscover the databases: %s" % str(e))
+                self._rollback(db)
 
         if db is not None:
             service_check_tags = self._get_service_check_tags(host, port, dbname)
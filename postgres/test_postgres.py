@@ -3,6 +3,7 @@
 # Licensed under Simplified BSD License (see LICENSE)
 
 # 3p
+import mock
 from nose.plugins.attrib import attr
 
 # project
@@ -461,3 +462,140 @@ class TestPostgres(AgentCheckTest):
 
         self.coverage_report()
         self.check.dbs[key].close()
+
+    def test_relations_query(self):
+        """
+        Relations are selected server-side, with queries and tags built once
+        """
+        key = ('localhost', 15432, 'dogs')
+        relations = ['breed', {'relation_regex': '^kenn', 'schemas': ['public']}]
+        self.load_check({'instances': [{}]})
+        self.check.versions[key] = [9, 4, 0]
+
+        db = mock.Mock()
+        cursor = db.cursor.return_value
+
+        def fetchall():
+            if 'FROM pg_stat_user_tables' in cursor.execute.call_args[0][0]:
+                return [
+                    ['breed', 'public'] + [1] * 10,
+                    ['kennel', 'public'] + [2] * 10,
+                    ['kennel', 'archive'] + [3] * 10,
+                ]
+            return []
+        cursor.fetchall.side_effect = fetchall
+
+        for _ in range(2):
+            self.check._collect_stats(key, db, ['db:dogs'], relations, [], False, False, False, Exception, Exception)
+
+        self.metrics = self.check.get_metrics()
+        self.assertMetric('postgresql.live_rows', value=1, count=1, tags=['db:dogs', 'table:breed', 'schema:public'])
+        self.assertMetric('postgresql.live_rows', value=2, count=1, tags=['db:dogs', 'table:kennel', 'schema:public'])
+        self.assertMetric('postgresql.live_rows', count=2)
+
+        queries = [c[0] for c in cursor.execute.call_args_list if 'FROM pg_stat_user_tables' in c[0][0]]
+        self.assertEquals(len(queries), 2)
+        query, params = queries[0]
+        self.assertTrue('(relname = ANY(%s) OR relname ~ ANY(%s))' in query)
+        self.assertEquals(params, [['breed'], ['^kenn']])
+        self.assertTrue(queries[1][0] is query)
+
+    def test_statement_timeout(self):
+        """
+        The transaction of the cached connection is rolled back when a statement is canceled
+        """
+        class QueryCanceledError(Exception):
+            pass
+
+        key = ('localhost', 15432, 'dogs')
+        instance = {'host': 'localhost', 'port': 15432, 'username': 'datadog', 'password': 'datadog',
+                    'dbname': 'dogs', 'relations': ['breed'], 'statement_timeout': 1000}
+        self.load_check({'instances': [instance]})
+        self.check.versions[key] = [9, 4, 0]
+
+        db = mock.Mock()
+        cursor = db.cursor.return_value
+        cursor.fetchall.return_value = []
+        self.check.dbs[key] = db
+
+        def execute(query, params=None):
+            if 'FROM pg_stat_user_tables' in query:
+                raise QueryCanceledError("canceling statement due to statement timeout")
+        cursor.execute.side_effect = execute
+
+        self.assertRaises(QueryCanceledError, self.check.check, instance)
+        db.rollback.assert_called_once_with()
+        self.assertFalse(db.commit.called)
+
+        cursor.execute.side_effect = None
+        self.check.check(instance)
+        self.assertTrue(self.check.dbs[key] is db)
+        db.commit.assert_called_once_with()
+
+    def test_autodiscover_databases(self):
+        """
+        Relations of the autodiscovered databases are collected over a bounded pool of connections
+        """
+        key = ('localhost', 15432, 'dogs')
+        main_db = mock.Mock()
+        main_db.cursor.return_value.fetchall.return_value = [['dogs'], ['db1'], ['db2'], ['db3']]
+        connections = []
+
+        def connect(dbname):
+            connection = mock.Mock()
+            cursor = connection.cursor.return_value
+
+            def fetchall():
+                if 'FROM pg_stat_user_tables' in cursor.execute.call_args[0][0]:
+                    return [['breed', 'public'] + [1] * 10]
+                return []
+            cursor.fetchall.side_effect = fetchall
+            connections.append((dbname, connection))
+            return connection
+
+        for threads_count, max_connections, connects in [(1, 3, 3), (2, 2, 6)]:
+            del connections[:]
+            self.load_check({'init_config': {'threads_count': threads_count}, 'instances': [{}]})
+            self.check.versions[key] = [9, 4, 0]
+            for _ in range(2):
+                self.check._collect_databases(key, main_db, ['db:dogs'], ['breed'], connect, max_connections,
+                                              Exception)
+
+            self.metrics = self.check.get_metrics()
+            for dbname in ('db1', 'db2', 'db3'):
+                self.assertMetric('postgresql.live_rows', count=1, tags=['db:%s' % dbname, 'table:breed', 'schema:public'])
+            self.assertMetric('postgresql.live_rows', count=3)
+
+            self.assertEquals(len(connections), connects)
+            idle = self.check.database_connections[key]
+            self.assertTrue(len(idle) <= max_connections)
+            self.assertEquals(self.check.database_connections_in_use[key], 0)
+            self.assertEquals(len([c for _, c in connections if c.close.called]), connects - len(idle))
+
+            self.check.stop()
+            self.assertTrue(all(c.close.called for _, c in connections))
+
+        # A database failing with any driver error, e.g. a canceled statement, is skipped
+        # and its connection is closed instead of being returned to the pool
+        class QueryCanceledError(Exception):
+            pass
+
+        del connections[:]
+        self.load_check({'init_config': {}, 'instances': [{}]})
+        self.check.versions[key] = [9, 4, 0]
+        run_scopes = self.check._run_scopes
+
+        def failing_run_scopes(key, db, *args):
+            if ('db2', db) in connections:
+                raise QueryCanceledError("canceling statement due to statement timeout")
+            return run_scopes(key, db, *args)
+
+        self.check._run_scopes = failing_run_scopes
+        self.check._collect_databases(key, main_db, ['db:dogs'], ['breed'], connect, 3, Exception)
+        self.metrics = self.check.get_metrics()
+        self.assertMetric('postgresql.live_rows', count=1, tags=['db:db1', 'table:breed', 'schema:public'])
+        self.assertMetric('postgresql.live_rows', count=0, tags=['db:db2', 'table:breed', 'schema:public'])
+        self.assertMetric('postgresql.live_rows', count=2)
+        self.assertEquals(self.check.database_connections_in_use[key], 0)
+        self.assertTrue(connections[1][1].close.called)
+        self.assertEquals(sorted(self.check.database_connections[key]), ['db1', 'db3'])
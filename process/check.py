@@ -5,6 +5,7 @@
 
 # stdlib
 from collections import defaultdict
+import re
 import time
 
 # 3p
@@ -19,6 +20,10 @@ from utils.platform import Platform
 DEFAULT_AD_CACHE_DURATION = 120
 DEFAULT_PID_CACHE_DURATION = 120
 
+# Position of the lazily read attributes in the process snapshot entries
+SNAPSHOT_NAME = 1
+SNAPSHOT_CMDLINE = 2
+
 
 ATTR_TO_METRIC = {
     'thr':              'threads',
@@ -90,6 +95,19 @@ class ProcessCheck(AgentCheck):
         # Process cache, indexed by instance
         self.process_cache = defaultdict(dict)
 
+        # Snapshot of the process table shared by all the instances of a run,
+        # indexed by pid: [psutil.Process, name, cmdline]
+        self.process_snapshot = None
+        self._snapshot_users = set()
+
+        # Compiled search_string matchers, indexed by (search_string, exact_match)
+        self._matchers = {}
+
+    def run(self):
+        # Every run starts with a fresh process table snapshot
+        self.process_snapshot = None
+        return AgentCheck.run(self)
+
     def should_refresh_ad_cache(self, name):
         now = time.time()
         return now - self.last_ad_cache_ts.get(name, 0) > self.access_denied_cache_duration
@@ -114,39 +132,29 @@ class ProcessCheck(AgentCheck):
 
         matching_pids = set()
 
-        for proc in psutil.process_iter():
+        match = self._get_matcher(search_string, exact_match)
+        attr = SNAPSHOT_NAME if exact_match else SNAPSHOT_CMDLINE
+
+        for pid, entry in self._get_process_snapshot(name).iteritems():
             # Skip access denied processes
-            if not refresh_ad_cache and proc.pid in self.ad_cache:
+            if not refresh_ad_cache and pid in self.ad_cache:
                 continue
 
-            found = False
-            for string in search_string:
-                try:
-                    # FIXME 6.x: All has been deprecated from the doc, should be removed
-                    if string == 'All':
-                        found = True
-                    if exact_match:
-                        if proc.name() == string:
-                            found = True
-                    else:
-                        cmdline = proc.cmdline()
-                        if string in ' '.join(cmdline):
-                            found = True
-                except psutil.NoSuchProcess:
-                    self.log.warning('Process disappeared while scanning')
-                except psutil.AccessDenied as e:
-                    ad_error_logger('Access denied to process with PID %s', proc.pid)
-                    ad_error_logger('Error: %s', e)
-                    if refresh_ad_cache:
-                        self.ad_cache.add(proc.pid)
-                    if not ignore_ad:
-                        raise
-                else:
-                    if refresh_ad_cache:
-                        self.ad_cache.discard(proc.pid)
-                    if found:
-                        matching_pids.add(proc.pid)
-                        break
+            value = self._get_snapshot_attr(entry, attr)
+            if isinstance(value, psutil.NoSuchProcess):
+                continue
+            elif isinstance(value, psutil.AccessDenied):
+                ad_error_logger('Access denied to process with PID %s', pid)
+                ad_error_logger('Error: %s', value)
+                if refresh_ad_cache:
+                    self.ad_cache.add(pid)
+                if not ignore_ad:
+                    raise value
+            else:
+                if refresh_ad_cache:
+                    self.ad_cache.discard(pid)
+                if match(value):
+                    matching_pids.add(pid)
 
         self.pid_cache[name] = matching_pids
         self.last_pid_cache_ts[name] = time.time()
@@ -154,6 +162,61 @@ class ProcessCheck(AgentCheck):
             self.last_ad_cache_ts[name] = time.time()
         return matching_pids
 
+    def _get_process_snapshot(self, name):
+        """
+        Return the process table snapshot of the current run, listing
+        the processes only once for all the instances.
+        An instance asking twice for it means a new run started.
+        """
+        if self.process_snapshot is None or name in self._snapshot_users:
+            self.process_snapshot = dict(
+                (proc.pid, [proc, None, None]) for proc in psutil.process_iter()
+            )
+            self._snapshot_users = set()
+        self._snapshot_users.add(name)
+        return self.process_snapshot
+
+    def _get_snapshot_attr(self, entry, attr):
+        """
+        Return the name or the joined cmdline of a snapshot entry, reading it
+        on first access. psutil errors are cached in place of the value.
+        """
+        value = entry[attr]
+        if value is None:
+            proc = entry[0]
+            try:
+                if attr == SNAPSHOT_NAME:
+                    value = proc.name()
+                else:
+                    value = ' '.join(proc.cmdline())
+            except psutil.NoSuchProcess as e:
+                self.log.warning('Process disappeared while scanning')
+                value = e
+            except psutil.AccessDenied as e:
+                value = e
+            entry[attr] = value
+        return value
+
+    def _get_matcher(self, search_string, exact_match):
+        """
+        Return a function telling if a process name (exact_match) or cmdline
+        matches one of the search strings. Matchers are compiled once.
+        """
+        key = (tuple(search_string), exact_match)
+        if key not in self._matchers:
+            # FIXME 6.x: All has been deprecated from the doc, should be removed
+            if 'All' in search_string:
+                matcher = lambda value: True
+            elif not search_string:
+                matcher = lambda value: False
+            elif exact_match:
+                matcher = frozenset(search_string).__contains__
+            else:
+                pattern = re.compile('|'.join(re.escape(string) for string in search_string))
+                matcher = lambda value: pattern.search(value) is not None
+            self._matchers[key] = matcher
+        return self._matchers[key]
+
     def psutil_wrapper(self, process, method, accessors, *args, **kwargs):
         """
         A psutil wrapper that is calling
@@ -205,12 +268,21 @@ class ProcessCheck(AgentCheck):
         for pid in pids_to_remove:
             del self.process_cache[name][pid]
 
+        snapshot = self.process_snapshot or {}
+
         for pid in pids:
             st['pids'].append(pid)
 
             new_process = False
-            # If the pid's process is not cached, retrieve it
-            if pid not in self.process_cache[name] or not self.process_cache[name][pid].is_running():
+            # If the pid's process is not cached, retrieve it. When the pid is in the
+            # snapshot of this run, comparing it to the snapshot process (pid and
+            # create time) is enough to know it's still the same running process.
+            cached = self.process_cache[name].get(pid)
+            if pid in snapshot:
+                running = cached is not None and cached == snapshot[pid][0]
+            else:
+                running = cached is not None and cached.is_running()
+            if not running:
                 new_process = True
                 try:
                     self.process_cache[name][pid] = psutil.Process(pid)
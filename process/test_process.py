@@ -394,6 +394,49 @@ class ProcessCheckTest(AgentCheckTest):
         self.run_check(config, mocks={'get_pagefault_stats': noop_get_pagefault_stats})
         self.assertMetric('system.processes.cpu.pct', count=1, tags=expected_tags)
 
+    def test_shared_process_snapshot(self):
+        "Check that all the instances of a run match against a single process table listing"
+        config = {
+            'instances': [{
+                'name': 'py_%s' % i,
+                'search_string': ['python', 'py.test'],
+                'exact_match': i % 2 == 0,
+            } for i in xrange(10)]
+        }
+
+        orig_process_iter = psutil.process_iter
+        with patch('psutil.process_iter', side_effect=orig_process_iter) as mock_process_iter:
+            self.run_check(config, mocks={'get_pagefault_stats': noop_get_pagefault_stats})
+            self.assertEqual(mock_process_iter.call_count, 1)
+
+            # the pid cache is still valid, the snapshot shouldn't even be built
+            self.run_check(config, mocks={'get_pagefault_stats': noop_get_pagefault_stats})
+            self.assertEqual(mock_process_iter.call_count, 1)
+
+            self.check.last_pid_cache_ts = {}
+            self.run_check(config, mocks={'get_pagefault_stats': noop_get_pagefault_stats})
+            self.assertEqual(mock_process_iter.call_count, 2)
+
+        self.assertIn(os.getpid(), self.check.pid_cache['py_1'])
+
+    def test_matcher(self):
+        self.load_check({'instances': []})
+
+        exact = self.check._get_matcher(['python', 'sshd'], True)
+        self.assertTrue(exact('sshd'))
+        self.assertFalse(exact('ssh'))
+
+        cmdline = self.check._get_matcher(['node server.js', 'a.b'], False)
+        self.assertTrue(cmdline('/usr/bin/node server.js --port 80'))
+        self.assertFalse(cmdline('/usr/bin/node server2.js'))
+        self.assertFalse(cmdline('axb'))
+
+        self.assertTrue(self.check._get_matcher(['All'], True)('anything'))
+        self.assertFalse(self.check._get_matcher([], False)('anything'))
+
+        # matchers are compiled once
+        self.assertIs(cmdline, self.check._get_matcher(['node server.js', 'a.b'], False))
+
     @attr('unix')
     def test_relocated_procfs(self):
         from utils.platform import Platform
@@ -22,6 +22,18 @@ MAX_SLOW_ENTRIES_KEY = "slowlog-max-len"
 REPL_KEY = 'master_link_status'
 LINK_DOWN_KEY = 'master_link_down_since_seconds'
 
+# The glob patterns of `key_patterns` are expanded with SCAN and cached
+# for `key_patterns_refresh_interval` seconds
+DEFAULT_KEY_PATTERNS_REFRESH_INTERVAL = 60
+DEFAULT_KEY_PATTERNS_SCAN_COUNT = 1000
+
+KEY_LENGTH_COMMANDS = {
+    'list': 'llen',
+    'set': 'scard',
+    'zset': 'zcard',
+    'hash': 'hlen',
+}
+
 
 class Redis(AgentCheck):
     db_key_pattern = re.compile(r'^db\d+')
@@ -99,6 +111,8 @@ class Redis(AgentCheck):
         AgentCheck.__init__(self, name, init_config, agentConfig, instances)
         self.connections = {}
         self.last_timestamp_seen = defaultdict(int)
+        # (instance key, pattern) -> (matching keys, timestamp of the expansion)
+        self._expanded_keys = {}
 
     def get_library_versions(self):
         return {"redis": redis.__version__}
@@ -231,31 +245,82 @@ class Redis(AgentCheck):
         if key_list is not None:
             if not isinstance(key_list, list) or len(key_list) == 0:
                 self.warning("keys in redis configuration is either not a list or empty")
-            else:
-                l_tags = list(tags)
-                for key in key_list:
-                    key_type = conn.type(key)
-                    key_tags = l_tags + ['key:' + key]
-
-                    if key_type == 'list':
-                        self.gauge('redis.key.length', conn.llen(key), tags=key_tags)
-                    elif key_type == 'set':
-                        self.gauge('redis.key.length', conn.scard(key), tags=key_tags)
-                    elif key_type == 'zset':
-                        self.gauge('redis.key.length', conn.zcard(key), tags=key_tags)
-                    elif key_type == 'hash':
-                        self.gauge('redis.key.length', conn.hlen(key), tags=key_tags)
-                    else:
-                        # If the type is unknown, it might be because the key doesn't exist,
-                        # which can be because the list is empty. So always send 0 in that case.
-                        if instance.get("warn_on_missing_keys", True):
-                            self.warning("{0} key not found in redis".format(key))
-                        self.gauge('redis.key.length', 0, tags=key_tags)
+                key_list = None
+        key_patterns = instance.get('key_patterns')
+        if key_patterns is not None:
+            if not isinstance(key_patterns, list) or len(key_patterns) == 0:
+                self.warning("key_patterns in redis configuration is either not a list or empty")
+                key_patterns = None
+        if key_list or key_patterns:
+            self._check_key_lengths(conn, instance, key_list or [], key_patterns or [], tags)
 
         self._check_replication(info, tags)
         if instance.get("command_stats", False):
             self._check_command_stats(conn, tags)
 
+    def _expand_keys(self, conn, instance, key_list, key_patterns):
+        """
+        Return the keys to check: the keys of `key_list` followed by the keys the
+        glob patterns of `key_patterns` match, and whether each key was configured
+        explicitly. Pattern expansions are cached for `key_patterns_refresh_interval`
+        seconds since a SCAN over the whole keyspace is far more expensive than the checks.
+        """
+        instance_key = self._generate_instance_key(instance)
+        refresh_interval = int(instance.get('key_patterns_refresh_interval',
+                                            DEFAULT_KEY_PATTERNS_REFRESH_INTERVAL))
+        scan_count = int(instance.get('key_patterns_scan_count', DEFAULT_KEY_PATTERNS_SCAN_COUNT))
+        now = time.time()
+
+        keys = [(key, True) for key in key_list]
+        seen = set(key_list)
+        for pattern in key_patterns:
+            cache_key = (instance_key, pattern)
+            matches, last_refresh = self._expanded_keys.get(cache_key, (None, 0))
+            if matches is None or now - last_refresh >= refresh_interval:
+                matches = sorted(set(conn.scan_iter(match=pattern, count=scan_count)))
+                self._expanded_keys[cache_key] = (matches, now)
+
+            for match in matches:
+                if match not in seen:
+                    seen.add(match)
+                    keys.append((match, False))
+
+        return keys
+
+    def _check_key_lengths(self, conn, instance, key_list, key_patterns, tags):
+        """
+        Submit the length of the configured keys, in two round trips whatever the
+        number of keys: one pipeline for their types, then one for their lengths.
+        """
+        keys = self._expand_keys(conn, instance, key_list, key_patterns)
+        if not keys:
+            return
+
+        pipe = conn.pipeline(transaction=False)
+        for key, _ in keys:
+            pipe.type(key)
+        key_types = pipe.execute()
+
+        pipe = conn.pipeline(transaction=False)
+        for (key, _), key_type in zip(keys, key_types):
+            command = KEY_LENGTH_COMMANDS.get(key_type)
+            if command is not None:
+                getattr(pipe, command)(key)
+        lengths = iter(pipe.execute())
+
+        l_tags = list(tags)
+        warn_on_missing_keys = instance.get("warn_on_missing_keys", True)
+        for (key, explicit), key_type in zip(keys, key_types):
+            key_tags = l_tags + ['key:' + key]
+            if key_type in KEY_LENGTH_COMMANDS:
+                self.gauge('redis.key.length', next(lengths), tags=key_tags)
+            else:
+                # If the type is unknown, it might be because the key doesn't exist,
+                # which can be because the list is empty. So always send 0 in that case.
+                if explicit and warn_on_missing_keys:
+                    self.warning("{0} key not found in redis".format(key))
+                self.gauge('redis.key.length', 0, tags=key_tags)
+
     def _check_replication(self, info, tags):
 
         # Save the replication delay for each slave
@@ -160,6 +160,43 @@ class TestRedis(AgentCheckTest):
         for meta_dict in service_metadata:
             assert meta_dict
 
+    def test_key_length(self):
+        port = NOAUTH_PORT
+
+        db = redis.Redis(port=port, db=14)  # Datadog's test db
+        db.flushdb()
+        db.rpush("queue:a", "1", "2", "3")
+        db.sadd("queue:b", "1", "2")
+        db.zadd("queue:c", "1", 1)
+        db.hset("hash", "field", "value")
+        db.set("string", "value")
+        db.rpush("jobs[1]", "1", "2")
+
+        instance = {
+            'host': 'localhost',
+            'port': port,
+            'db': 14,
+            'keys': ['hash', 'string', 'missing', 'jobs[1]'],
+            'key_patterns': ['queue:*'],
+        }
+        tags = ["redis_host:localhost", "redis_port:{0}".format(port)]
+        config = {'init_config': {}, 'instances': [instance]}
+
+        self.run_check(config, force_reload=True)
+        for key, length in [('queue:a', 3), ('queue:b', 2), ('queue:c', 1),
+                            ('hash', 1), ('string', 0), ('missing', 0), ('jobs[1]', 2)]:
+            self.assertMetric('redis.key.length', value=length, tags=tags + ['key:' + key], count=1)
+        self.assertEquals(len(self.warnings), 2, self.warnings)
+
+        # The expansion of the pattern is cached until the next refresh
+        db.rpush("queue:d", "1")
+        self.run_check(config)
+        self.assertMetric('redis.key.length', tags=tags + ['key:queue:d'], count=0)
+
+        instance['key_patterns_refresh_interval'] = 0
+        self.run_check(config)
+        self.assertMetric('redis.key.length', value=1, tags=tags + ['key:queue:d'], count=1)
+
     def test_redis_replication_link_metric(self):
         metric_name = 'redis.replication.master_link_down_since_seconds'
         r = load_check('redisdb', {}, {})
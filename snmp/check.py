@@ -3,12 +3,14 @@
 # Licensed under Simplified BSD License (see LICENSE)
 
 # std
-from collections import defaultdict
+from collections import defaultdict, deque
 from functools import wraps
 
 # 3rd party
+from pyasn1.type import univ
 from pysnmp.entity.rfc3413.oneliner import cmdgen
 import pysnmp.proto.rfc1902 as snmp_type
+from pysnmp.proto import errind
 from pysnmp.smi import builder
 from pysnmp.smi.exval import noSuchInstance, noSuchObject
 from pysnmp.error import PySnmpError
@@ -39,6 +41,8 @@ SNMP_GAUGES = frozenset([
     snmp_type.Integer32.__name__])
 
 DEFAULT_OID_BATCH_SIZE = 10
+DEFAULT_BULK_MAX_REPETITIONS = 10
+DEFAULT_MAX_INFLIGHT_REQUESTS = 10
 
 
 def reply_invalid(oid):
@@ -46,6 +50,15 @@ def reply_invalid(oid):
         noSuchObject.isSameTypeWith(oid)
 
 
+def in_walked_subtree(head, name, value):
+    '''
+    Whether a value returned by a walk still belongs to the subtree of the
+    queried OID `head` (noSuchObject, noSuchInstance and endOfMibView are all
+    Null values)
+    '''
+    return head.isPrefixOf(name) and not isinstance(value, univ.Null)
+
+
 class SnmpCheck(NetworkCheck):
 
     SOURCE_TYPE_NAME = 'system'
@@ -61,10 +74,20 @@ class SnmpCheck(NetworkCheck):
             instance['skip_event'] = True
 
         self.generators = {}
+        self.async_generators = {}
+        # Transport target and authentication data per instance
+        self.targets = {}
 
         # Set OID batch size
         self.oid_batch_size = int(init_config.get("oid_batch_size", DEFAULT_OID_BATCH_SIZE))
 
+        # Number of rows fetched by each GETBULK request of a table walk, 0 to walk with GETNEXT
+        self.bulk_max_repetitions = int(init_config.get("bulk_max_repetitions", DEFAULT_BULK_MAX_REPETITIONS))
+
+        # Send the requests to a device concurrently
+        self.async_polling = _is_affirmative(init_config.get("async_polling", False))
+        self.max_inflight_requests = int(init_config.get("max_inflight_requests", DEFAULT_MAX_INFLIGHT_REQUESTS))
+
         # Load Custom MIB directory
         self.mibs_path = None
         self.ignore_nonincreasing_oid = False
@@ -86,8 +109,13 @@ class SnmpCheck(NetworkCheck):
         instance_key = instance['name']
         cmd_generator = self.generators.get(instance_key, None)
         if not cmd_generator:
-            cmd_generator = self.create_command_generator(self.mibs_path, self.ignore_nonincreasing_oid)
+            # The synchronous generator shares the SNMP engine and the configured
+            # transports of the asynchronous one
+            async_generator = cmdgen.AsynCommandGenerator()
+            cmd_generator = self.create_command_generator(self.mibs_path, self.ignore_nonincreasing_oid,
+                                                          async_generator=async_generator)
             self.generators[instance_key] = cmd_generator
+            self.async_generators[instance_key] = async_generator
 
         return cmd_generator, ip_address, tags, metrics, timeout, retries, enforce_constraints
 
@@ -123,13 +151,14 @@ class SnmpCheck(NetworkCheck):
             return result
         return wrapper
 
-    def create_command_generator(self, mibs_path, ignore_nonincreasing_oid):
+    def create_command_generator(self, mibs_path, ignore_nonincreasing_oid, async_generator=None):
         '''
         Create a command generator to perform all the snmp query.
         If mibs_path is not None, load the mibs present in the custom mibs
         folder. (Need to be in pysnmp format)
+        If async_generator is not None, the command generator runs on top of it.
         '''
-        cmd_generator = cmdgen.CommandGenerator()
+        cmd_generator = cmdgen.CommandGenerator(asynCmdGen=async_generator)
         cmd_generator.ignoreNonIncreasingOid = ignore_nonincreasing_oid
 
         if mibs_path is not None:
@@ -195,6 +224,23 @@ class SnmpCheck(NetworkCheck):
         port = int(instance.get("port", 161)) # Default SNMP port
         return cmdgen.UdpTransportTarget((ip_address, port), timeout=timeout, retries=retries)
 
+    def get_target(self, instance, timeout, retries):
+        '''
+        Return the transport target and the authentication data of the instance,
+        built once per instance
+        '''
+        instance_key = instance['name']
+        if instance_key not in self.targets:
+            self.targets[instance_key] = (self.get_transport_target(instance, timeout, retries),
+                                          self.get_auth_data(instance))
+        return self.targets[instance_key]
+
+    def use_bulk(self, auth_data):
+        '''
+        GETBULK doesn't exist in SNMP v1
+        '''
+        return self.bulk_max_repetitions > 0 and getattr(auth_data, 'mpModel', None) != 0
+
     def raise_on_error_indication(self, error_indication, instance):
         if error_indication:
             message = "{0} for instance {1}".format(error_indication,
@@ -202,6 +248,19 @@ class SnmpCheck(NetworkCheck):
             instance["service_check_error"] = message
             raise Exception(message)
 
+    def handle_snmp_error(self, instance, e):
+        if "service_check_error" not in instance:
+            instance["service_check_error"] = "Fail to collect some metrics: {0}".format(e)
+        if "service_check_severity" not in instance:
+            instance["service_check_severity"] = Status.CRITICAL
+        self.warning("Fail to collect some metrics: {0}".format(e))
+
+    def handle_walk_error_status(self, instance, error_status):
+        message = "{0} for instance {1}".format(error_status.prettyPrint(),
+                                                instance["ip_address"])
+        instance["service_check_error"] = message
+        self.warning(message)
+
     def check_table(self, instance, cmd_generator, oids, lookup_names,
                     timeout, retries, enforce_constraints=False):
         '''
@@ -219,17 +278,44 @@ class SnmpCheck(NetworkCheck):
         # For example:
         # snmpgetnext -v2c -c public localhost:11111 1.3.6.1.2.1.25.4.2.1.7.222
         # iso.3.6.1.2.1.25.4.2.1.7.224 = INTEGER: 2
-        # SOLUTION: perform a snmpget command and fallback with snmpgetnext if not found
+        # SOLUTION: perform a snmpget command and fallback with a walk of the subtree if not found
+        transport_target, auth_data = self.get_target(instance, timeout, retries)
+
+        if self.async_polling:
+            all_binds = self.fetch_async(instance, self.async_generators[instance['name']], oids,
+                                         lookup_names, transport_target, auth_data, enforce_constraints)
+        else:
+            all_binds = self.fetch(instance, cmd_generator, oids, lookup_names,
+                                   transport_target, auth_data, enforce_constraints)
+
+        # if we've collected some variables, it's not that bad.
+        if "service_check_severity" in instance and len(all_binds):
+            instance["service_check_severity"] = Status.WARNING
+
+        results = defaultdict(dict)
+        for result_oid, value in all_binds:
+            if lookup_names:
+                _, metric, indexes = result_oid.getMibSymbol()
+                results[metric][indexes] = value
+            else:
+                oid = result_oid.asTuple()
+                matching = ".".join([str(i) for i in oid])
+                results[matching] = value
+        self.log.debug("Raw results: {0}".format(results))
+        return results
 
-        # Set aliases for snmpget and snmpgetnext with logging
+    def fetch(self, instance, cmd_generator, oids, lookup_names,
+              transport_target, auth_data, enforce_constraints):
+        '''
+        Query the oids one batch after the other, return the collected var binds
+        '''
+        # Set aliases for snmpget, snmpgetnext and snmpgetbulk with logging
         snmpget = self.snmp_logger(cmd_generator.getCmd)
         snmpgetnext = self.snmp_logger(cmd_generator.nextCmd)
-        transport_target = self.get_transport_target(instance, timeout, retries)
-        auth_data = self.get_auth_data(instance)
+        snmpgetbulk = self.snmp_logger(cmd_generator.bulkCmd)
 
         first_oid = 0
         all_binds = []
-        results = defaultdict(dict)
 
         while first_oid < len(oids):
             try:
@@ -257,52 +343,150 @@ class SnmpCheck(NetworkCheck):
                         complete_results.append(var)
 
                 if missing_results:
-                    # If we didn't catch the metric using snmpget, try snmpnext
-                    error_indication, error_status, error_index, var_binds_table = snmpgetnext(
-                        auth_data,
-                        transport_target,
-                        *missing_results,
-                        lookupValues=enforce_constraints,
-                        lookupNames=lookup_names)
+                    # If we didn't catch the metric using snmpget, walk its subtree
+                    # with snmpgetbulk, or snmpgetnext
+                    if self.use_bulk(auth_data):
+                        error_indication, error_status, error_index, var_binds_table = snmpgetbulk(
+                            auth_data,
+                            transport_target,
+                            0, self.bulk_max_repetitions,
+                            *missing_results,
+                            lookupValues=enforce_constraints,
+                            lookupNames=lookup_names)
+                    else:
+                        error_indication, error_status, error_index, var_binds_table = snmpgetnext(
+                            auth_data,
+                            transport_target,
+                            *missing_results,
+                            lookupValues=enforce_constraints,
+                            lookupNames=lookup_names)
 
                     # Raise on error_indication
                     self.raise_on_error_indication(error_indication, instance)
 
                     if error_status:
-                        message = "{0} for instance {1}".format(error_status.prettyPrint(),
-                                                                instance["ip_address"])
-                        instance["service_check_error"] = message
-                        self.warning(message)
+                        self.handle_walk_error_status(instance, error_status)
 
+                    heads = [univ.ObjectIdentifier(oid) for oid in missing_results]
                     for table_row in var_binds_table:
-                        complete_results.extend(table_row)
+                        complete_results.extend(
+                            (name, value) for head, (name, value) in zip(heads, table_row)
+                            if in_walked_subtree(head, name, value))
 
                 all_binds.extend(complete_results)
 
             except PySnmpError as e:
-                if "service_check_error" not in instance:
-                    instance["service_check_error"] = "Fail to collect some metrics: {0}".format(e)
-                if "service_check_severity" not in instance:
-                    instance["service_check_severity"] = Status.CRITICAL
-                self.warning("Fail to collect some metrics: {0}".format(e))
+                self.handle_snmp_error(instance, e)
 
             # if we fail move onto next batch
             first_oid = first_oid + self.oid_batch_size
 
-        # if we've collected some variables, it's not that bad.
-        if "service_check_severity" in instance and len(all_binds):
-            instance["service_check_severity"] = Status.WARNING
+        return all_binds
 
-        for result_oid, value in all_binds:
-            if lookup_names:
-                _, metric, indexes = result_oid.getMibSymbol()
-                results[metric][indexes] = value
-            else:
-                oid = result_oid.asTuple()
-                matching = ".".join([str(i) for i in oid])
-                results[matching] = value
-        self.log.debug("Raw results: {0}".format(results))
-        return results
+    def fetch_async(self, instance, async_generator, oids, lookup_names,
+                    transport_target, auth_data, enforce_constraints):
+        '''
+        Send the snmpget of every batch of oids without waiting for the previous
+        ones, with at most `max_inflight_requests` requests in flight, and walk
+        the subtrees of the missing oids as soon as their snmpget returns.
+        All the requests are processed by a single run of the device's dispatcher.
+
+        Return the collected var binds
+        '''
+        batches = deque(oids[i:i + self.oid_batch_size] for i in xrange(0, len(oids), self.oid_batch_size))
+        use_bulk = self.use_bulk(auth_data)
+        all_binds = []
+        error_indications = []
+        inflight = [0]
+
+        def request_done():
+            inflight[0] -= 1
+            send_batches()
+
+        def send_batches():
+            while batches and inflight[0] < self.max_inflight_requests:
+                batch = batches.popleft()
+                self.log.debug("Running SNMP command getCmd on OIDS {0}".format(batch))
+                try:
+                    async_generator.getCmd(auth_data, transport_target, batch, (on_get, None),
+                                           lookupNames=lookup_names, lookupValues=enforce_constraints)
+                except PySnmpError as e:
+                    self.handle_snmp_error(instance, e)
+                    continue
+                inflight[0] += 1
+
+        def on_get(send_request_handle, error_indication, error_status, error_index, var_binds, cb_ctx):
+            if error_indication:
+                error_indications.append(error_indication)
+                request_done()
+                return
+
+            missing_results = []
+            for var in var_binds:
+                result_oid, value = var
+                if reply_invalid(value):
+                    missing_results.append(".".join([str(i) for i in result_oid.asTuple()]))
+                else:
+                    all_binds.append(var)
+
+            if missing_results:
+                # If we didn't catch the metric using snmpget, walk its subtree,
+                # the walk takes over the slot of this request
+                heads = [univ.ObjectIdentifier(oid) for oid in missing_results]
+                try:
+                    if use_bulk:
+                        self.log.debug("Running SNMP command bulkCmd on OIDS {0}".format(missing_results))
+                        async_generator.bulkCmd(auth_data, transport_target, 0, self.bulk_max_repetitions,
+                                                missing_results, (on_walk, heads),
+                                                lookupNames=lookup_names, lookupValues=enforce_constraints)
+                    else:
+                        self.log.debug("Running SNMP command nextCmd on OIDS {0}".format(missing_results))
+                        async_generator.nextCmd(auth_data, transport_target, missing_results, (on_walk, heads),
+                                                lookupNames=lookup_names, lookupValues=enforce_constraints)
+                    return
+                except PySnmpError as e:
+                    self.handle_snmp_error(instance, e)
+
+            request_done()
+
+        def on_walk(send_request_handle, error_indication, error_status, error_index, var_binds_table, heads):
+            if self.ignore_nonincreasing_oid and isinstance(error_indication, errind.OidNotIncreasing):
+                error_indication = None
+            if error_indication:
+                error_indications.append(error_indication)
+                request_done()
+                return
+            if error_status:
+                self.handle_walk_error_status(instance, error_status)
+                request_done()
+                return
+
+            # Fix possibly non-rectangular table
+            while var_binds_table and len(var_binds_table[-1]) != len(heads):
+                del var_binds_table[-1]
+
+            for table_row in var_binds_table:
+                all_binds.extend(
+                    (name, value) for head, (name, value) in zip(heads, table_row)
+                    if in_walked_subtree(head, name, value))
+
+            # Carry on while at least one column hasn't reached the end of its subtree
+            if var_binds_table and any(in_walked_subtree(head, name, value)
+                                       for head, (name, value) in zip(heads, var_binds_table[-1])):
+                return True
+            request_done()
+
+        send_batches()
+        if inflight[0]:
+            try:
+                async_generator.snmpEngine.transportDispatcher.runDispatcher()
+            except PySnmpError as e:
+                self.handle_snmp_error(instance, e)
+
+        if error_indications:
+            self.raise_on_error_indication(error_indications[0], instance)
+
+        return all_binds
 
     def _check(self, instance):
         '''
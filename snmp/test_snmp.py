@@ -129,6 +129,12 @@ class SNMPTestCase(AgentCheckTest):
         }
     ]
 
+    ASYNC_POLLING = {
+        'async_polling': True,
+        'max_inflight_requests': 2,
+        'oid_batch_size': 1,
+    }
+
     PLAY_WITH_GET_NEXT_METRICS = [
         {
             "OID": "1.3.6.1.2.1.4.31.3.1.3.2",
@@ -385,3 +391,86 @@ class SNMPTestCase(AgentCheckTest):
                                 tags=self.CHECK_TAGS, count=1)
 
         self.coverage_report()
+
+    def test_table_walk_modes(self):
+        """
+        Tables walked with GETBULK, GETNEXT or asynchronously report the same metrics
+        """
+        results = []
+        for init_config in [{}, {'bulk_max_repetitions': 0}, {'bulk_max_repetitions': 50}, self.ASYNC_POLLING]:
+            config = {
+                'init_config': init_config,
+                'instances': [self.generate_instance_config(self.TABULAR_OBJECTS + self.SCALAR_OBJECTS)]
+            }
+            self.run_check(config, force_reload=True)
+            time.sleep(2)
+            self.run_check_n(config, repeat=2, sleep=2)
+            self.service_checks = self.wait_for_async('get_service_checks', 'service_checks', 1)
+            self.assertServiceCheck("snmp.can_check", status=AgentCheck.OK,
+                                    tags=self.CHECK_TAGS, count=1)
+            self.assertMetric("snmp.tcpCurrEstab", tags=self.CHECK_TAGS, count=1)
+
+            # Out of table rows returned by GETBULK are ignored
+            results.append(sorted(set(
+                (m[0], tuple(sorted(m[3].get('tags', [])))) for m in self.metrics
+                if m[0] in ("snmp.ifInOctets", "snmp.ifOutOctets", "snmp.tcpCurrEstab")
+            )))
+
+        self.assertTrue(results[0])
+        for result in results[1:]:
+            self.assertEquals(result, results[0])
+
+    def test_async_polling(self):
+        """
+        Support SNMP scalar and tabular objects with asynchronous polling
+        """
+        config = {
+            'init_config': self.ASYNC_POLLING,
+            'instances': [self.generate_instance_config(
+                self.SCALAR_OBJECTS + self.TABULAR_OBJECTS + self.PLAY_WITH_GET_NEXT_METRICS)]
+        }
+        self.run_check_n(config, repeat=3, sleep=2)
+        self.service_checks = self.wait_for_async('get_service_checks', 'service_checks', 1)
+
+        # Test metrics
+        for metric in self.SCALAR_OBJECTS + self.PLAY_WITH_GET_NEXT_METRICS:
+            metric_name = "snmp." + (metric.get('name') or metric.get('symbol'))
+            self.assertMetric(metric_name, tags=self.CHECK_TAGS, count=1)
+        for symbol in self.TABULAR_OBJECTS[0]['symbols']:
+            metric_name = "snmp." + symbol
+            self.assertMetric(metric_name, at_least=1)
+            for mtag in self.TABULAR_OBJECTS[0]['metric_tags']:
+                self.assertMetricTagPrefix(metric_name, mtag['tag'], at_least=1)
+
+        # Test service check
+        self.assertServiceCheck("snmp.can_check", status=AgentCheck.OK,
+                                tags=self.CHECK_TAGS, count=1)
+
+        # The transport target of the device is built once
+        self.assertEquals(len(self.check.targets), 1)
+
+        self.coverage_report()
+
+    def test_async_network_failure(self):
+        """
+        Network failure is reported once in service check with asynchronous polling
+        """
+        instance = self.generate_instance_config(self.SCALAR_OBJECTS)
+        instance['port'] = 162
+        instance['retries'] = 0
+
+        config = {
+            'init_config': self.ASYNC_POLLING,
+            'instances': [instance]
+        }
+        self.run_check(config)
+        self.warnings = self.wait_for_async('get_warnings', 'warnings', 1)
+
+        self.assertWarning("No SNMP response received before timeout for instance localhost", count=1)
+
+        # Test service check
+        self.service_checks = self.wait_for_async('get_service_checks', 'service_checks', 1)
+        self.assertServiceCheck("snmp.can_check", status=AgentCheck.CRITICAL,
+                                tags=self.CHECK_TAGS, count=1)
+
+        self.coverage_report()
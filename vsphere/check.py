@@ -13,7 +13,7 @@ import traceback
 
 # 3p
 from pyVim import connect
-from pyVmomi import vim  # pylint: disable=E0611
+from pyVmomi import vim, vmodl  # pylint: disable=E0611
 
 # project
 from config import _is_affirmative
@@ -36,6 +36,8 @@ REFRESH_MORLIST_INTERVAL = 3 * 60
 REFRESH_METRICS_METADATA_INTERVAL = 10 * 60
 # The amount of jobs batched at the same time in the queue to query available metrics
 BATCH_MORLIST_SIZE = 50
+# The amount of MORs processed by one job, i.e. queried with a single `QueryPerf` call
+BATCH_QUERY_SIZE = 1
 
 REALTIME_RESOURCES = {'vm', 'host'}
 
@@ -46,6 +48,18 @@ RESOURCE_TYPE_MAP = {
     'datastore': vim.Datastore
 }
 
+# Properties of the inventory objects followed with `incremental_inventory`:
+# resources and all the objects that can be their parents
+INVENTORY_PROPERTIES = {
+    vim.VirtualMachine: ['name', 'parent', 'runtime.powerState', 'runtime.host', 'customValue'],
+    vim.HostSystem: ['name', 'parent'],
+    vim.Datastore: ['name', 'parent'],
+    vim.Datacenter: ['name', 'parent'],
+    vim.ComputeResource: ['name', 'parent'],
+    vim.ResourcePool: ['name', 'parent'],
+    vim.Folder: ['name', 'parent'],
+}
+
 # Time after which we reap the jobs that clog the queue
 # TODO: use it
 JOB_TIMEOUT = 10
@@ -360,6 +374,26 @@ class VSphereCheck(AgentCheck):
         self.morlist = {}
         # Metrics metadata, basically perfCounterId -> {name, group, description}
         self.metrics_metadata = {}
+        # Metrics to report, perfCounterId -> (metric name, is a percentage)
+        self.reported_counters = {}
+        # perfCounterIds of the BASIC_METRICS
+        self.basic_counters = {}
+
+        # The amount of MORs processed by one job
+        self.batch_query_size = int(init_config.get('batch_query_size', BATCH_QUERY_SIZE))
+
+        # Keep the inventory up to date with a property collector instead of exploring
+        # the whole infrastructure on every refresh
+        self.incremental_inventory = _is_affirmative(init_config.get('incremental_inventory', False))
+        # Property collector and version of its latest updates
+        self.inventory_collectors = {}
+        self.inventory_versions = {}
+        # Properties of the objects, MOR -> {property: value}
+        self.inventory = {}
+        # Formatted resources, MOR -> `morlist_raw` item, None when excluded
+        self.inventory_mors = {}
+        # Tags of the parents, MOR -> tags
+        self.inventory_parent_tags = {}
 
         self.latest_event_query = {}
 
@@ -507,17 +541,9 @@ class VSphereCheck(AgentCheck):
             return available_metrics
 
         i_key = self._instance_key(instance)
-        wanted_metrics = []
-        # Get only the basic metrics
-        for metric in available_metrics:
-            # No cache yet, skip it for now
-            if (i_key not in self.metrics_metadata
-                    or metric.counterId not in self.metrics_metadata[i_key]):
-                continue
-            if self.metrics_metadata[i_key][metric.counterId]['name'] in BASIC_METRICS:
-                wanted_metrics.append(metric)
-
-        return wanted_metrics
+        # Get only the basic metrics, none if there's no metadata cache yet
+        basic_counters = self.basic_counters.get(i_key, frozenset())
+        return [metric for metric in available_metrics if metric.counterId in basic_counters]
 
     def get_external_host_tags(self):
         """ Returns a list of tags for every host that is detected by the vSphere
@@ -569,28 +595,16 @@ class VSphereCheck(AgentCheck):
 
         If it's a node we want to query metric for, queue it in `self.morlist_raw` that
         will be processed by another job.
-        """
-        def _get_parent_tags(mor):
-            tags = []
-            if mor.parent:
-                tag = []
-                if isinstance(mor.parent, vim.HostSystem):
-                    tag.append(u'vsphere_host:{}'.format(mor.parent.name))
-                elif isinstance(mor.parent, vim.Folder):
-                    tag.append(u'vsphere_folder:{}'.format(mor.parent.name))
-                elif isinstance(mor.parent, vim.ComputeResource):
-                    if isinstance(mor.parent, vim.ClusterComputeResource):
-                        tag.append(u'vsphere_cluster:{}'.format(mor.parent.name))
-                    tag.append(u'vsphere_compute:{}'.format(mor.parent.name))
-                elif isinstance(mor.parent, vim.Datacenter):
-                    tag.append(u'vsphere_datacenter:{}'.format(mor.parent.name))
-
-                tags = _get_parent_tags(mor.parent)
-                if tag:
-                    tags.extend(tag)
-
-            return tags
 
+        With `incremental_inventory`, the inventory is kept by a property collector and
+        only the objects that changed since the previous discovery are queued.
+        """
+        if self.incremental_inventory:
+            self.pool.apply_async(
+                self._update_inventory_atomic,
+                args=(instance, tags, regexes, include_only_marked)
+            )
+            return
 
         def _get_all_objs(content, vimtype, regexes=None, include_only_marked=False, tags=[]):
             """
@@ -603,35 +617,25 @@ class VSphereCheck(AgentCheck):
                 True)
 
             for c in container.view:
-                instance_tags = []
-                if not self._is_excluded(c, regexes, include_only_marked):
-                    hostname = c.name
-                    if c.parent:
-                        instance_tags += _get_parent_tags(c)
-
-                    vsphere_type = None
-                    if isinstance(c, vim.VirtualMachine):
-                        vsphere_type = u'vsphere_type:vm'
-                        if c.runtime.powerState == vim.VirtualMachinePowerState.poweredOff:
-                            continue
-                        host = c.runtime.host.name
-                        instance_tags.append(u'vsphere_host:{}'.format(host))
-                    elif isinstance(c, vim.HostSystem):
-                        vsphere_type = u'vsphere_type:host'
-                    elif isinstance(c, vim.Datastore):
-                        vsphere_type = u'vsphere_type:datastore'
-                        instance_tags.append(u'vsphere_datastore:{}'.format(c.name))
-                        hostname = None
-                    elif isinstance(c, vim.Datacenter):
-                        vsphere_type = u'vsphere_type:datacenter'
-                        hostname = None
-
-                    if vsphere_type:
-                        instance_tags.append(vsphere_type)
-                    obj_list.append(dict(mor_type=vimtype, mor=c, hostname=hostname, tags=tags+instance_tags))
+                if self._is_excluded(c, regexes, include_only_marked):
+                    continue
+
+                host_name = None
+                if isinstance(c, vim.VirtualMachine):
+                    if c.runtime.powerState == vim.VirtualMachinePowerState.poweredOff:
+                        continue
+                    host_name = c.runtime.host.name
+
+                parent_tags = self._get_parent_tags(c, get_parent, get_name, parent_tags_cache)
+                obj_list.append(self._format_mor(c, vimtype, c.name, host_name, parent_tags, tags))
 
             return obj_list
 
+        # Tags of the parents, shared by their children for this discovery
+        parent_tags_cache = {}
+        get_parent = lambda mor: mor.parent
+        get_name = lambda mor: mor.name
+
         # @atomic_method
         def build_resource_registry(instance, tags, regexes=None, include_only_marked=False):
             i_key = self._instance_key(instance)
@@ -655,18 +659,235 @@ class VSphereCheck(AgentCheck):
         )
 
     @staticmethod
-    def _is_excluded(obj, regexes, include_only_marked):
+    def _get_parent_tags(mor, get_parent, get_name, cache):
+        """
+        Return the tags of all the parents of `mor`, memoized per parent in `cache`.
+        `get_parent` and `get_name` give the parent and the name of an object.
+        """
+        parent = get_parent(mor)
+        if not parent:
+            return []
+
+        if parent not in cache:
+            tags = []
+            name = get_name(parent)
+            if isinstance(parent, vim.HostSystem):
+                tags.append(u'vsphere_host:{}'.format(name))
+            elif isinstance(parent, vim.Folder):
+                tags.append(u'vsphere_folder:{}'.format(name))
+            elif isinstance(parent, vim.ComputeResource):
+                if isinstance(parent, vim.ClusterComputeResource):
+                    tags.append(u'vsphere_cluster:{}'.format(name))
+                tags.append(u'vsphere_compute:{}'.format(name))
+            elif isinstance(parent, vim.Datacenter):
+                tags.append(u'vsphere_datacenter:{}'.format(name))
+
+            cache[parent] = VSphereCheck._get_parent_tags(parent, get_parent, get_name, cache) + tags
+
+        return cache[parent]
+
+    @staticmethod
+    def _format_mor(mor, vimtype, name, host_name, parent_tags, tags):
+        """
+        Build the `morlist_raw` item of `mor`, `host_name` is the name of the host of a
+        virtual machine
+        """
+        hostname = name
+        instance_tags = list(parent_tags)
+
+        vsphere_type = None
+        if isinstance(mor, vim.VirtualMachine):
+            vsphere_type = u'vsphere_type:vm'
+            instance_tags.append(u'vsphere_host:{}'.format(host_name))
+        elif isinstance(mor, vim.HostSystem):
+            vsphere_type = u'vsphere_type:host'
+        elif isinstance(mor, vim.Datastore):
+            vsphere_type = u'vsphere_type:datastore'
+            instance_tags.append(u'vsphere_datastore:{}'.format(name))
+            hostname = None
+        elif isinstance(mor, vim.Datacenter):
+            vsphere_type = u'vsphere_type:datacenter'
+            hostname = None
+
+        if vsphere_type:
+            instance_tags.append(vsphere_type)
+
+        return dict(mor_type=vimtype, mor=mor, hostname=hostname, tags=tags+instance_tags)
+
+    def _create_inventory_collector(self, server_instance):
+        """
+        Create a property collector, and its filter, following the properties
+        of the inventory objects
+        """
+        content = server_instance.RetrieveContent()
+        view = content.viewManager.CreateContainerView(
+            content.rootFolder,
+            list(INVENTORY_PROPERTIES),
+            True)
+
+        traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(
+            name='traverseView', path='view', skip=False, type=vim.view.ContainerView)
+        object_specs = [
+            vmodl.query.PropertyCollector.ObjectSpec(obj=view, skip=True, selectSet=[traversal_spec]),
+            # The root folder isn't part of its own view
+            vmodl.query.PropertyCollector.ObjectSpec(obj=content.rootFolder, skip=False),
+        ]
+        property_specs = [
+            vmodl.query.PropertyCollector.PropertySpec(type=vimtype, pathSet=properties)
+            for vimtype, properties in INVENTORY_PROPERTIES.iteritems()
+        ]
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=object_specs, propSet=property_specs)
+
+        # A collector of our own, so that no one else consumes its versions
+        collector = content.propertyCollector.CreatePropertyCollector()
+        collector.CreateFilter(filter_spec, partialUpdates=True)
+
+        return collector
+
+    def _fetch_inventory_updates(self, i_key):
+        """
+        Apply to the inventory of the instance the updates since the last known version.
+
+        Return the objects that entered or changed, and whether one of them may be
+        the parent, or the host, of other objects.
+        """
+        collector = self.inventory_collectors[i_key]
+        inventory = self.inventory[i_key]
+        options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=0)
+
+        changed = set()
+        parents_changed = False
+        while True:
+            update_set = collector.WaitForUpdatesEx(self.inventory_versions[i_key], options)
+            if update_set is None:
+                # No more updates
+                break
+
+            for filter_update in update_set.filterSet:
+                for object_update in filter_update.objectSet:
+                    mor = object_update.obj
+                    if object_update.kind == 'leave':
+                        inventory.pop(mor, None)
+                        changed.discard(mor)
+                    else:
+                        properties = inventory.setdefault(mor, {})
+                        for change in object_update.changeSet:
+                            if change.op in ('remove', 'indirectRemove'):
+                                properties.pop(change.name, None)
+                            else:
+                                properties[change.name] = change.val
+                        changed.add(mor)
+
+                    if not isinstance(mor, (vim.VirtualMachine, vim.Datastore)):
+                        parents_changed = True
+
+            self.inventory_versions[i_key] = update_set.version
+            if not update_set.truncated:
+                break
+
+        return changed, parents_changed
+
+    @atomic_method
+    def _update_inventory_atomic(self, instance, tags, regexes=None, include_only_marked=False):
+        """
+        Update the inventory of the instance from the property collector, queue the
+        objects that entered or changed in `self.morlist_raw` and keep the others,
+        still there, in `self.morlist`.
+        """
+        i_key = self._instance_key(instance)
+        server_instance = self._get_server_instance(instance)
+
+        if i_key not in self.inventory_collectors:
+            self.inventory_collectors[i_key] = self._create_inventory_collector(server_instance)
+            self.inventory_versions[i_key] = ''
+            self.inventory[i_key] = {}
+            self.inventory_mors[i_key] = {}
+            self.inventory_parent_tags[i_key] = {}
+
+        try:
+            changed, parents_changed = self._fetch_inventory_updates(i_key)
+        except Exception:
+            # The collector, or its version, is not valid anymore: start over next time
+            for cache in (self.inventory_collectors, self.inventory_versions, self.inventory,
+                          self.inventory_mors, self.inventory_parent_tags):
+                cache.pop(i_key, None)
+            raise
+
+        inventory = self.inventory[i_key]
+        inventory_mors = self.inventory_mors[i_key]
+        parent_tags_cache = self.inventory_parent_tags[i_key]
+
+        if parents_changed:
+            # Tags of every object may have changed
+            parent_tags_cache.clear()
+            changed = set(inventory)
+
+        # Drop the objects that left the inventory
+        for mor in inventory_mors.keys():
+            if mor not in inventory:
+                del inventory_mors[mor]
+
+        get_parent = lambda mor: inventory.get(mor, {}).get('parent')
+        get_name = lambda mor: inventory.get(mor, {}).get('name')
+
+        morlist_raw = dict((resource, []) for resource in RESOURCE_TYPE_MAP)
+        for mor in changed:
+            vimtype = self._get_resource_type(mor)
+            if vimtype is None:
+                continue
+
+            properties = inventory[mor]
+            inventory_mors[mor] = None
+            if self._is_excluded(mor, regexes, include_only_marked, properties=properties):
+                continue
+
+            host_name = None
+            if isinstance(mor, vim.VirtualMachine):
+                if properties.get('runtime.powerState') == vim.VirtualMachinePowerState.poweredOff:
+                    continue
+                host_name = get_name(properties.get('runtime.host'))
+
+            parent_tags = self._get_parent_tags(mor, get_parent, get_name, parent_tags_cache)
+            inventory_mors[mor] = self._format_mor(mor, vimtype, properties.get('name'), host_name,
+                                                   parent_tags, tags)
+            morlist_raw[vimtype].append(inventory_mors[mor])
+
+        # Objects that didn't change are still there
+        now = time.time()
+        for mor_name, mor in self.morlist.get(i_key, {}).items():
+            if inventory_mors.get(mor['mor']) is not None:
+                mor['last_seen'] = now
+
+        self.log.debug(u"%s objects changed in the inventory of %s", len(changed), i_key)
+        self.morlist_raw[i_key] = morlist_raw
+
+    @staticmethod
+    def _get_resource_type(mor):
+        for resource_type, vimtype in RESOURCE_TYPE_MAP.iteritems():
+            if isinstance(mor, vimtype):
+                return resource_type
+        return None
+
+    @staticmethod
+    def _is_excluded(obj, regexes, include_only_marked, properties=None):
         """
         Return `True` if the given host or virtual machine is excluded by the user configuration,
         i.e. violates any of the following rules:
         * Do not match the corresponding `*_include_only` regular expressions
         * Is "non-labeled" while `include_only_marked` is enabled (virtual machine only)
+
+        `properties` are the properties of the object known by the property collector, if any.
         """
+        def get_property(name):
+            if properties is not None:
+                return properties.get(name)
+            return getattr(obj, name)
+
         # Host
         if isinstance(obj, vim.HostSystem):
             # Based on `host_include_only_regex`
             if regexes and regexes.get('host_include') is not None:
-                match = re.search(regexes['host_include'], obj.name)
+                match = re.search(regexes['host_include'], get_property('name'))
                 if not match:
                     return True
 
@@ -674,14 +895,14 @@ class VSphereCheck(AgentCheck):
         elif isinstance(obj, vim.VirtualMachine):
             # Based on `vm_include_only_regex`
             if regexes and regexes.get('vm_include') is not None:
-                match = re.search(regexes['vm_include'], obj.name)
+                match = re.search(regexes['vm_include'], get_property('name'))
                 if not match:
                     return True
 
             # Based on `include_only_marked`
             if include_only_marked:
                 monitored = False
-                for field in obj.customValue:
+                for field in get_property('customValue') or []:
                     if field.value == VM_MONITORING_FLAG:
                         monitored = True
                         break  # we shall monitor
@@ -723,9 +944,9 @@ class VSphereCheck(AgentCheck):
         self.cache_times[i_key][MORLIST][LAST] = time.time()
 
     @atomic_method
-    def _cache_morlist_process_atomic(self, instance, mor):
-        """ Process one item of the self.morlist_raw list by querying the available
-        metrics for this MOR and then putting it in self.morlist
+    def _cache_morlist_process_atomic(self, instance, mors):
+        """ Process a batch of items of the self.morlist_raw list by querying the available
+        metrics for each MOR and then putting it in self.morlist
         """
         ### <TEST-INSTRUMENTATION>
         t = Timer()
@@ -734,26 +955,32 @@ class VSphereCheck(AgentCheck):
         server_instance = self._get_server_instance(instance)
         perfManager = server_instance.content.perfManager
 
-        self.log.debug(
-            "job_atomic: Querying available metrics"
-            " for MOR {0} (type={1})".format(mor['mor'], mor['mor_type'])
-        )
+        for mor in mors:
+            self.log.debug(
+                "job_atomic: Querying available metrics"
+                " for MOR {0} (type={1})".format(mor['mor'], mor['mor_type'])
+            )
 
-        mor['interval'] = REAL_TIME_INTERVAL if mor['mor_type'] in REALTIME_RESOURCES else None
+            mor['interval'] = REAL_TIME_INTERVAL if mor['mor_type'] in REALTIME_RESOURCES else None
 
-        available_metrics = perfManager.QueryAvailablePerfMetric(
-            mor['mor'], intervalId=mor['interval'])
+            try:
+                available_metrics = perfManager.QueryAvailablePerfMetric(
+                    mor['mor'], intervalId=mor['interval'])
+            except vmodl.fault.ManagedObjectNotFound:
+                # Gone since the MOR list was refreshed, don't fail the rest of the batch
+                self.log.debug(u"Skipping MOR %s, it doesn't exist anymore", mor['mor'])
+                continue
 
-        mor['metrics'] = self._compute_needed_metrics(instance, available_metrics)
+            mor['metrics'] = self._compute_needed_metrics(instance, available_metrics)
 
-        mor_name = str(mor['mor'])
-        if mor_name in self.morlist[i_key]:
-            # Was already here last iteration
-            self.morlist[i_key][mor_name]['metrics'] = mor['metrics']
-        else:
-            self.morlist[i_key][mor_name] = mor
+            mor_name = str(mor['mor'])
+            if mor_name in self.morlist[i_key]:
+                # Was already here last iteration
+                self.morlist[i_key][mor_name]['metrics'] = mor['metrics']
+            else:
+                self.morlist[i_key][mor_name] = mor
 
-        self.morlist[i_key][mor_name]['last_seen'] = time.time()
+            self.morlist[i_key][mor_name]['last_seen'] = time.time()
 
         ### <TEST-INSTRUMENTATION>
         self.histogram('datadog.agent.vsphere.morlist_process_atomic.time', t.total())
@@ -761,8 +988,8 @@ class VSphereCheck(AgentCheck):
 
     def _cache_morlist_process(self, instance):
         """ Empties the self.morlist_raw by popping items and running asynchronously
-        the _cache_morlist_process_atomic operation that will get the available
-        metrics for this MOR and put it in self.morlist
+        the _cache_morlist_process_atomic operation, by batches of `batch_query_size`,
+        that will get the available metrics for these MORs and put them in self.morlist
         """
         i_key = self._instance_key(instance)
         if i_key not in self.morlist:
@@ -771,11 +998,14 @@ class VSphereCheck(AgentCheck):
         batch_size = self.init_config.get('batch_morlist_size', BATCH_MORLIST_SIZE)
 
         processed = 0
+        mors = []
         for resource_type in RESOURCE_TYPE_MAP:
             for i in xrange(batch_size):
                 try:
-                    mor = self.morlist_raw[i_key][resource_type].pop()
-                    self.pool.apply_async(self._cache_morlist_process_atomic, args=(instance, mor))
+                    mors.append(self.morlist_raw[i_key][resource_type].pop())
+                    if len(mors) == self.batch_query_size:
+                        self.pool.apply_async(self._cache_morlist_process_atomic, args=(instance, mors))
+                        mors = []
 
                     processed += 1
                     if processed == batch_size:
@@ -786,7 +1016,9 @@ class VSphereCheck(AgentCheck):
 
             if processed == batch_size:
                 break
-        return
+
+        if mors:
+            self.pool.apply_async(self._cache_morlist_process_atomic, args=(instance, mors))
 
     def _vacuum_morlist(self, instance):
         """ Check if self.morlist doesn't have some old MORs that are gone, ie
@@ -814,6 +1046,8 @@ class VSphereCheck(AgentCheck):
         perfManager = server_instance.content.perfManager
 
         new_metadata = {}
+        reported_counters = {}
+        basic_counters = set()
         for counter in perfManager.perfCounter:
             d = dict(
                 name = "%s.%s" % (counter.groupInfo.key, counter.nameInfo.key),
@@ -821,32 +1055,28 @@ class VSphereCheck(AgentCheck):
                 instance_tag = 'instance'  # FIXME: replace by what we want to tag!
             )
             new_metadata[counter.key] = d
+
+            # Resolve once what we need to know about each counter when collecting metrics
+            if d['name'] in ALL_METRICS:
+                reported_counters[counter.key] = ("vsphere.%s" % d['name'], d['unit'] == 'percent')
+            if d['name'] in BASIC_METRICS:
+                basic_counters.add(counter.key)
         self.cache_times[i_key][METRICS_METADATA][LAST] = time.time()
 
         self.log.info("Finished metadata collection for instance {0}".format(i_key))
         # Reset metadata
         self.metrics_metadata[i_key] = new_metadata
+        self.reported_counters[i_key] = reported_counters
+        self.basic_counters[i_key] = frozenset(basic_counters)
 
         ### <TEST-INSTRUMENTATION>
         self.histogram('datadog.agent.vsphere.metric_metadata_collection.time', t.total())
         ### </TEST-INSTRUMENTATION>
 
-    def _transform_value(self, instance, counter_id, value):
-        """ Given the counter_id, look up for the metrics metadata to check the vsphere
-        type of the counter and apply pre-reporting transformation if needed.
-        """
-        i_key = self._instance_key(instance)
-        if counter_id in self.metrics_metadata[i_key]:
-            unit = self.metrics_metadata[i_key][counter_id]['unit']
-            if unit == 'percent':
-                return float(value) / 100
-
-        # Defaults to return the value without transformation
-        return value
-
     @atomic_method
-    def _collect_metrics_atomic(self, instance, mor):
-        """ Task that collects the metrics listed in the morlist for one MOR
+    def _collect_metrics_atomic(self, instance, mors):
+        """ Task that collects the metrics listed in the morlist for a batch of MORs,
+        with a single `QueryPerf` call
         """
         ### <TEST-INSTRUMENTATION>
         t = Timer()
@@ -855,36 +1085,49 @@ class VSphereCheck(AgentCheck):
         i_key = self._instance_key(instance)
         server_instance = self._get_server_instance(instance)
         perfManager = server_instance.content.perfManager
+        reported_counters = self.reported_counters[i_key]
+
+        queries = []
+        mors_by_name = {}
+        for mor in mors:
+            queries.append(vim.PerformanceManager.QuerySpec(maxSample=1,
+                                                            entity=mor['mor'],
+                                                            metricId=mor['metrics'],
+                                                            intervalId=mor['interval'],
+                                                            format='normal'))
+            mors_by_name[str(mor['mor'])] = mor
 
-        query = vim.PerformanceManager.QuerySpec(maxSample=1,
-                                                 entity=mor['mor'],
-                                                 metricId=mor['metrics'],
-                                                 intervalId=mor['interval'],
-                                                 format='normal')
-        results = perfManager.QueryPerf(querySpec=[query])
-        if results:
-            for result in results[0].value:
-                if result.id.counterId not in self.metrics_metadata[i_key]:
-                    self.log.debug("Skipping this metric value, because there is no metadata about it")
-                    continue
-                instance_name = result.id.instance or "none"
-                value = self._transform_value(instance, result.id.counterId, result.value[0])
+        try:
+            results = perfManager.QueryPerf(querySpec=queries)
+        except vmodl.fault.ManagedObjectNotFound:
+            # One of the MORs is gone since the MOR list was refreshed,
+            # query them one at a time so that only its metrics are lost
+            results = self._query_perf_by_entity(perfManager, queries)
+
+        for entity_metric in results or []:
+            mor = mors_by_name.get(str(entity_metric.entity))
+            if mor is None:
+                self.log.debug(u"Skipping values of unexpected entity %s", entity_metric.entity)
+                continue
 
+            for result in entity_metric.value:
                 # Metric types are absolute, delta, and rate
-                metric_name = self.metrics_metadata[i_key][result.id.counterId]['name']
-
-                if metric_name not in ALL_METRICS:
-                    self.log.debug(u"Skipping unknown `%s` metric.", metric_name)
+                counter = reported_counters.get(result.id.counterId)
+                if counter is None:
+                    self.log.debug(u"Skipping value of counter %s, no metadata or unknown metric",
+                                   result.id.counterId)
                     continue
+                metric_name, is_percent = counter
 
-                tags = ['instance:%s' % instance_name]
-                if not mor['hostname']: # no host tags available
-                    tags.extend(mor['tags'])
+                instance_name = result.id.instance or "none"
+                value = result.value[0]
+                if is_percent:
+                    value = float(value) / 100
 
                 # vsphere "rates" should be submitted as gauges (rate is
                 # precomputed).
                 self.gauge(
-                    "vsphere.%s" % metric_name,
+                    metric_name,
                     value,
                     hostname=mor['hostname'],
                     tags=['instance:%s' % instance_name]
@@ -894,9 +1137,22 @@ class VSphereCheck(AgentCheck):
         self.histogram('datadog.agent.vsphere.metric_colection.time', t.total())
         ### </TEST-INSTRUMENTATION>
 
+    def _query_perf_by_entity(self, perfManager, queries):
+        """ Run the `QueryPerf` queries of a batch one at a time, skipping the MORs
+        that don't exist anymore
+        """
+        results = []
+        for query in queries:
+            try:
+                results.extend(perfManager.QueryPerf(querySpec=[query]) or [])
+            except vmodl.fault.ManagedObjectNotFound:
+                self.log.debug(u"Skipping MOR %s, it doesn't exist anymore", query.entity)
+        return results
+
     def collect_metrics(self, instance):
-        """ Calls asynchronously _collect_metrics_atomic on all MORs, as the
-        job queue is processed the Aggregator will receive the metrics.
+        """ Calls asynchronously _collect_metrics_atomic on all MORs, by batches of
+        `batch_query_size`, as the job queue is processed the Aggregator will receive
+        the metrics.
         """
         i_key = self._instance_key(instance)
         if i_key not in self.morlist:
@@ -907,6 +1163,7 @@ class VSphereCheck(AgentCheck):
         self.log.debug("Collecting metrics of %d mors" % len(mors))
 
         vm_count = 0
+        batch = []
 
         for mor_name, mor in mors:
             if mor['mor_type'] == 'vm':
@@ -915,7 +1172,13 @@ class VSphereCheck(AgentCheck):
                 # self.log.debug("Skipping entity %s collection because we didn't cache its metrics yet" % mor['hostname'])
                 continue
 
-            self.pool.apply_async(self._collect_metrics_atomic, args=(instance, mor))
+            batch.append(mor)
+            if len(batch) == self.batch_query_size:
+                self.pool.apply_async(self._collect_metrics_atomic, args=(instance, batch))
+                batch = []
+
+        if batch:
+            self.pool.apply_async(self._collect_metrics_atomic, args=(instance, batch))
 
         self.gauge('vsphere.vm.count', vm_count, tags=["vcenter_server:%s" % instance.get('name')])
 
@@ -3,11 +3,12 @@
 # Licensed under Simplified BSD License (see LICENSE)
 
 # stdlib
+from collections import defaultdict
 import os
 
 # 3p
 from mock import Mock, MagicMock
-from pyVmomi import vim  # pylint: disable=E0611
+from pyVmomi import vim, vmodl  # pylint: disable=E0611
 import simplejson as json
 
 # datadog
@@ -84,6 +85,71 @@ class MockedContainer(Mock):
         return view
 
 
+class MockedPropertyCollector(Mock):
+    """
+    Stand-in for a vCenter property collector following the objects of the given topology.
+    The first `WaitForUpdatesEx` call returns all of them, by chunks, the next ones
+    return the updates queued with `update` and `leave`.
+    """
+    CHUNK_SIZE = 5
+
+    def __init__(self, **kwargs):
+        # Mocking
+        super(MockedPropertyCollector, self).__init__(**kwargs)
+
+        self.version = 0
+        self.pending = []
+        if kwargs.get('topology') is not None:
+            self.pending = [self._object_update('enter', mor, self._properties(mor))
+                            for mor in self._walk(kwargs['topology'])]
+
+    def _walk(self, topology_node):
+        yield topology_node
+        for attribute in ('childEntity', 'hostFolder', 'host', 'vm'):
+            if hasattr(topology_node, attribute):
+                children = getattr(topology_node, attribute)
+                if not isinstance(children, list):
+                    children = [children]
+                for child in children:
+                    for mor in self._walk(child):
+                        yield mor
+                break
+
+    @staticmethod
+    def _properties(mor):
+        properties = {'name': mor.name, 'parent': mor.parent}
+        if isinstance(mor, vim.VirtualMachine):
+            properties['runtime.powerState'] = mor.runtime.powerState
+            properties['runtime.host'] = mor.parent
+            properties['customValue'] = mor.customValue
+        return properties
+
+    @staticmethod
+    def _object_update(kind, mor, properties):
+        change_set = []
+        for name, value in properties.iteritems():
+            change = Mock(op='assign', val=value)
+            change.name = name
+            change_set.append(change)
+        return Mock(kind=kind, obj=mor, changeSet=change_set)
+
+    def update(self, mor, **properties):
+        self.pending.append(self._object_update('modify', mor, properties))
+
+    def leave(self, mor):
+        self.pending.append(self._object_update('leave', mor, {}))
+
+    def WaitForUpdatesEx(self, version, options):
+        if not self.pending:
+            return None
+
+        self.version += 1
+        object_updates = self.pending[:self.CHUNK_SIZE]
+        self.pending = self.pending[self.CHUNK_SIZE:]
+        return Mock(version=str(self.version), truncated=bool(self.pending),
+                    filterSet=[Mock(objectSet=object_updates)])
+
+
 def create_topology(topology_json):
     """
     Helper, recursively generate a vCenter topology from a JSON description.
@@ -151,6 +217,43 @@ def create_topology(topology_json):
 
 
 
+class FakePerformanceManager(object):
+    """
+    Stand-in for vCenter's PerformanceManager, counting the calls made to it.
+    Every entity exposes all the `counters`, a list of (name, unit), with a single instance.
+    """
+    def __init__(self, counters):
+        self.perfCounter = []
+        for key, (name, unit) in enumerate(counters):
+            group, name = name.split('.', 1)
+            self.perfCounter.append(
+                Mock(key=key, groupInfo=Mock(key=group), nameInfo=Mock(key=name), unitInfo=Mock(key=unit))
+            )
+        self.calls = defaultdict(int)
+        # Names of the entities that don't exist anymore
+        self.deleted = set()
+
+    def _check_entity(self, entity):
+        if entity.name in self.deleted:
+            raise vmodl.fault.ManagedObjectNotFound(obj=entity)
+
+    def QueryAvailablePerfMetric(self, entity, intervalId=None):
+        self.calls['QueryAvailablePerfMetric'] += 1
+        self._check_entity(entity)
+        return [vim.PerformanceManager.MetricId(counterId=counter.key, instance='')
+                for counter in self.perfCounter]
+
+    def QueryPerf(self, querySpec):
+        self.calls['QueryPerf'] += 1
+        self.calls['QuerySpec'] += len(querySpec)
+        for query in querySpec:
+            self._check_entity(query.entity)
+        return [
+            Mock(entity=query.entity, value=[Mock(id=metric_id, value=[50]) for metric_id in query.metricId])
+            for query in querySpec
+        ]
+
+
 class TestvSphereUnit(AgentCheckTest):
     """
     Unit tests for vSphere AgentCheck.
@@ -197,8 +300,10 @@ class TestvSphereUnit(AgentCheckTest):
         * disable threading
         * create a unique container for MORs independent of the instance key
         """
+        self._load_check({})
+
+    def _load_check(self, config):
         # Initialize
-        config = {}
         self.load_check(config)
 
         # Disable threading
@@ -335,3 +440,187 @@ class TestvSphereUnit(AgentCheckTest):
                 u"vsphere_host:host3", u"vsphere_type:vm"
             ]
         )
+
+    def test_batched_queries(self):
+        """
+        Pack the `QueryPerf` queries of `batch_query_size` MORs in a single call.
+        """
+        instance = {'name': 'vsphere_mock'}
+        nb_vms = 120
+        counters = [(u"cpu.usage", u"percent"), (u"mem.active", u"kiloBytes")]
+
+        metrics = []
+        for batch_query_size in (1, 50):
+            self._load_check({
+                'init_config': {'batch_query_size': batch_query_size, 'batch_morlist_size': 1000},
+                'instances': [instance],
+            })
+            perf_manager = FakePerformanceManager(counters)
+            server_mock = MagicMock()
+            server_mock.content.perfManager = perf_manager
+            self.check._get_server_instance = MagicMock(return_value=server_mock)
+            self.check.morlist_raw = {
+                'vsphere_mock': {
+                    'vm': [
+                        dict(mor_type='vm', mor=MockedMOR(spec="VirtualMachine", name="vm%d" % i),
+                             hostname="vm%d" % i, tags=[])
+                        for i in xrange(nb_vms)
+                    ]
+                }
+            }
+
+            self.check._cache_metrics_metadata(instance)
+            self.check._cache_morlist_process(instance)
+            self.assertEquals(perf_manager.calls['QueryAvailablePerfMetric'], nb_vms)
+            self.assertEquals(len(self.check.morlist['vsphere_mock']), nb_vms)
+
+            # One collection cycle
+            self.check.collect_metrics(instance)
+            self.assertEquals(perf_manager.calls['QuerySpec'], nb_vms)
+            self.assertEquals(perf_manager.calls['QueryPerf'], -(-nb_vms // batch_query_size))
+
+            metrics.append(sorted(
+                (m[0], m[2], m[3].get('hostname')) for m in self.check.get_metrics()
+                if m[0].startswith('vsphere.') and m[0] != 'vsphere.vm.count'
+            ))
+
+        self.assertEquals(len(metrics[0]), nb_vms * len(counters))
+        self.assertEquals(metrics[0], metrics[1])
+        # Percentages are transformed
+        self.assertIn(('vsphere.cpu.usage', 0.5, 'vm0'), metrics[0])
+
+    def test_deleted_mor(self):
+        """
+        A MOR deleted since the last refresh doesn't fail the other MORs of its batch.
+        """
+        instance = {'name': 'vsphere_mock'}
+        nb_vms = 10
+        self._load_check({
+            'init_config': {'batch_query_size': 50, 'batch_morlist_size': 1000},
+            'instances': [instance],
+        })
+        perf_manager = FakePerformanceManager([(u"cpu.usage", u"percent")])
+        server_mock = MagicMock()
+        server_mock.content.perfManager = perf_manager
+        self.check._get_server_instance = MagicMock(return_value=server_mock)
+        self.check.morlist_raw = {
+            'vsphere_mock': {
+                'vm': [
+                    dict(mor_type='vm', mor=MockedMOR(spec="VirtualMachine", name="vm%d" % i),
+                         hostname="vm%d" % i, tags=[])
+                    for i in xrange(nb_vms)
+                ]
+            }
+        }
+
+        # Deleted before its available metrics are queried
+        perf_manager.deleted.add("vm0")
+        self.check._cache_metrics_metadata(instance)
+        self.check._cache_morlist_process(instance)
+        self.assertEquals(sorted(m['hostname'] for m in self.check.morlist['vsphere_mock'].values()),
+                          ["vm%d" % i for i in xrange(1, nb_vms)])
+
+        # Deleted before its metrics are collected
+        perf_manager.deleted.add("vm1")
+        self.check.collect_metrics(instance)
+        self.assertEquals(perf_manager.calls['QueryPerf'], 1 + nb_vms - 1)
+        self.assertEquals(
+            sorted(m[3].get('hostname') for m in self.check.get_metrics() if m[0] == 'vsphere.cpu.usage'),
+            ["vm%d" % i for i in xrange(2, nb_vms)]
+        )
+        self.assertTrue(self.check.exceptionq.empty())
+
+    def test_incremental_inventory(self):
+        """
+        Keep the inventory up to date with a property collector, only process the objects
+        that changed.
+        """
+        # Samples
+        instance = {'name': 'vsphere_mock'}
+        tags = [u"toto"]
+        include_regexes = {
+            'host_include': "host[2-9]",
+            'vm_include': "vm[^2]",
+        }
+        include_only_marked = True
+
+        self._load_check({'init_config': {'incremental_inventory': True}, 'instances': [instance]})
+        discover_mor = self.check._discover_mor
+
+        # mock pyvmomi stuff
+        vcenter_topology = create_topology('vsphere_topology.json')
+        collector = MockedPropertyCollector(topology=vcenter_topology)
+        content_mock = MagicMock(**{
+            'rootFolder': vcenter_topology,
+            'viewManager.CreateContainerView.return_value': Mock(spec=vim.view.ContainerView),
+            'propertyCollector.CreatePropertyCollector.return_value': collector,
+        })
+        server_mock = MagicMock()
+        server_mock.configure_mock(**{'RetrieveContent.return_value': content_mock})
+        self.check._get_server_instance = MagicMock(return_value=server_mock)
+
+        def find(name):
+            inventory = self.check.inventory['vsphere_mock']
+            return next(mor for mor, properties in inventory.iteritems() if properties.get('name') == name)
+
+        # Discover hosts and virtual machines: same as exploring the whole tree
+        discover_mor(instance, tags, include_regexes, include_only_marked)
+        self.assertTrue(self.check.exceptionq.empty())
+        self.assertMOR(instance, count=5)
+        self.assertMOR(instance, spec="host", count=2)
+        self.assertMOR(
+            instance,
+            name="host3", spec="host",
+            tags=[
+                u"toto", u"vsphere_folder:rootFolder", u"vsphere_folder:folder1",
+                u"vsphere_datacenter:datacenter2", u"vsphere_compute:compute_resource2",
+                u"vsphere_cluster:compute_resource2", u"vsphere_type:host"
+            ]
+        )
+        self.assertMOR(
+            instance,
+            name="vm4", spec="vm",
+            tags=[
+                u"toto", u"vsphere_folder:rootFolder", u"vsphere_folder:folder1",
+                u"vsphere_datacenter:datacenter2", u"vsphere_compute:compute_resource2",
+                u"vsphere_cluster:compute_resource2", u"vsphere_host:host3", u"vsphere_type:vm"
+            ]
+        )
+
+        # Nothing changed, nothing to process
+        discover_mor(instance, tags, include_regexes, include_only_marked)
+        self.assertEquals(sum(len(mors) for mors in self.check.morlist_raw['vsphere_mock'].values()), 0)
+
+        # A virtual machine is renamed: only process it
+        collector.update(find("vm4"), name="vm5")
+        discover_mor(instance, tags, include_regexes, include_only_marked)
+        self.assertMOR(instance, count=1)
+        self.assertMOR(instance, name="vm5", spec="vm", count=1)
+
+        # A virtual machine is powered off: it's not collected anymore
+        collector.update(find("vm5"), **{'runtime.powerState': "poweredOff"})
+        discover_mor(instance, tags, include_regexes, include_only_marked)
+        self.assertEquals(sum(len(mors) for mors in self.check.morlist_raw['vsphere_mock'].values()), 0)
+        collector.update(find("vm5"), **{'runtime.powerState': "poweredOn"})
+
+        # A cluster is renamed: tags of the objects below it change
+        collector.update(find("compute_resource2"), name="cluster2")
+        discover_mor(instance, tags, include_regexes, include_only_marked)
+        self.assertMOR(instance, count=5)
+        self.assertMOR(
+            instance,
+            name="host3", spec="host",
+            tags=[
+                u"toto", u"vsphere_folder:rootFolder", u"vsphere_folder:folder1",
+                u"vsphere_datacenter:datacenter2", u"vsphere_compute:cluster2",
+                u"vsphere_cluster:cluster2", u"vsphere_type:host"
+            ]
+        )
+        self.assertMOR(instance, name="vm5", spec="vm", tags=[u"vsphere_cluster:cluster2"], subset=True)
+
+        # A virtual machine leaves the inventory
+        collector.leave(find("vm5"))
+        discover_mor(instance, tags, include_regexes, include_only_marked)
+        self.assertEquals(sum(len(mors) for mors in self.check.morlist_raw['vsphere_mock'].values()), 0)
+        self.assertEquals(len(self.check.inventory_mors['vsphere_mock']), 8)
+        self.assertTrue(self.check.exceptionq.empty())